@@ -0,0 +1,64 @@
+"""
+In-memory simulation API.
+
+    import api
+    res = api.simulate("GGGAGGGAGG...", {'sigma': -0.07, 'npeak': 100})
+    res.getColumns()['probability']   # NumPy columns
+    res.getStructures()                # pandas DataFrame, built on demand
+
+simulate() runs the same engine as main.py (simulation.simulate_record)
+but reads and writes no files apart from the energy table and the caches
+a caller opts into (cache_dir, band_dir), and changes no working
+directory or global state; the file outputs of main.py and the cli are
+writers on top of the same records.
+"""
+
+import gene
+import model
+import result
+import simulation
+
+def makeParams(params=None):
+    """simulation_params from None, a simulation_params or a dict of its attributes.
+
+    Unknown keys raise ValueError rather than being silently ignored.
+    """
+    if isinstance(params, simulation.simulation_params):
+        return(params)
+    mysim = simulation.simulation_params()
+    for name, value in (params or {}).items():
+        if not hasattr(simulation.simulation_params, name):
+            raise ValueError(f"unknown simulation parameter {name!r}")
+        setattr(mysim, name, value)
+    return(mysim)
+
+def simulate(sequence, params=None, energy=None, name="sequence"):
+    """Simulate one sequence and return a result.Result.
+
+    sequence is a string (or bytes) of bases or a gene.Gene; params as in
+    makeParams; energy an energy CSV path or a simulation.energyTable,
+    defaulting to params' energy file, else the energy.csv bundled with the
+    package (never one in the working directory). Structure table, peaks
+    and profile are kept as requested by params (profile_flag,
+    profile_only_flag, peaks_only_flag, top, threshold_flag, dynamic_flag,
+    ...), exactly as the file outputs would hold them. Sweeps and batches run over files
+    (sweep_main, batch_main) and are not handled here. The only directories
+    written are those params names: cache_dir, where the record is looked
+    up and stored in a cache.ResultCache, and band_dir, a sweep.BandStore
+    of its sequence band.
+    """
+    mysim = makeParams(params)
+    mygene = sequence if isinstance(sequence, gene.Gene) else gene.Gene(sequence, name)
+    mymodel = model.rloop_model(sigma=mysim.getSigma(), a=mysim.geta())
+    if energy is None:
+        energy = mysim.getEnergyFile() if mysim.getEnergyFile() is not None else simulation.bundledEnergyFile()
+    energy = simulation.loadEnergyTable(energy)
+    tables = list()
+    peaks = list()
+    def collect(myres, mypeaks):
+        if myres is not None:
+            tables.append(myres)
+        if mypeaks is not None:
+            peaks.append(mypeaks)
+    profile = simulation.simulate_record(mygene, mymodel, energy, mysim, collect)
+    return(result.Result(mygene.getName(), result.Result.concatenate(tables), result.Result.concatenate(peaks), profile))
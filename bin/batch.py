@@ -0,0 +1,164 @@
+import os
+import re
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import copy
+import contextlib
+import functools
+import itertools
+import numpy as np
+from concurrent.futures import wait, FIRST_COMPLETED
+import model
+import cache
+import simulation
+import parallel
+
+logger = logging.getLogger(__name__)
+
+# Batch tasks submitted per worker ahead of the results written so far
+IN_FLIGHT_PER_WORKER = 2
+
+def estimateCost(length, mymodel):
+    """Number of (n, m) structures of a record, used to schedule the longest jobs first."""
+    starts, counts = simulation.computeBandCounts(length, mymodel, 0, length)
+    return(int(counts.sum()))
+
+def geneDirectory(name):
+    # Record names such as chr1:100-200 or ENSG/1 made safe as a directory name
+    return(re.sub(r'[^\w.-]', '_', name) or "record")
+
+def batch_worker(task):
+    """Simulate one record in a pool worker.
+
+    With per-gene output the worker writes the record's files itself and
+    returns only its statistics; otherwise the structure tables and the
+    profile are returned for the parent to append to the combined files.
+    With --stream the tables are instead spooled block by block to the raw
+    column files of a cache.EntryWriter at task['spool'], which the parent
+    replays into the combined files, so neither process holds a whole table.
+    """
+    began = time.perf_counter()
+    mygene = task['gene']
+    mysim = task['sim']
+    mymodel = model.rloop_model.fromParameters(task['model'])
+    if task['outdir'] is not None:
+        os.makedirs(task['outdir'], exist_ok=True)
+        with simulation.openOutput(mysim, mymodel, task['outdir']) as output:
+            writer = simulation.outputWriter(output, task['outdir'], mysim.peak_format)
+            recordprofile = simulation.simulate_record(mygene, mymodel, task['energy'], mysim, functools.partial(writer.write, mygene.getName(), strand=mygene.getPos().strand))
+            structures = output.rows
+        if recordprofile is not None:
+            if mysim.profile_format == 'npy':
+                np.savez(os.path.join(task['outdir'], "rlooper_profile.npz"), **{mygene.getName(): recordprofile})
+            else:
+                simulation.printprofile(recordprofile, mygene.getName(), outdir=task['outdir'])
+        tables = None
+        recordprofile = None
+    elif task['spool'] is not None:
+        entry = cache.EntryWriter(task['spool'])
+        try:
+            recordprofile = simulation.simulate_record(mygene, mymodel, task['energy'], mysim, entry.write)
+        finally:
+            entry.close(None)
+        structures = entry.rows
+        tables = None
+    else:
+        tables = list()
+        recordprofile = simulation.simulate_record(mygene, mymodel, task['energy'], mysim, lambda myres, mypeaks: tables.append((myres, mypeaks)))
+        structures = sum(len(myres['n']) for myres, mypeaks in tables if myres is not None)
+    return({'name': mygene.getName(), 'strand': mygene.getPos().strand, 'length': mygene.getLength(), 'structures': structures,
+            'seconds': time.perf_counter() - began, 'tables': tables, 'spool': task['spool'], 'profile': recordprofile})
+
+def batch_main(mysim, outdir="."):
+    """Simulate every record of a multi-FASTA file (or BED regions) on a process pool.
+
+    Records are scheduled longest first by their number of structures, so
+    the largest jobs do not start last and leave the pool idle behind one
+    straggler. Each record runs serially in one of mysim.threads workers.
+    Results go to the combined rlooper_*.csv files in completion order (with
+    the record name in the chr column), or with batch_output "per-gene" to
+    one directory per record, all under outdir. Per-record timing is logged
+    and written to rlooper_batch_timing.tsv.
+    """
+    mymodel = model.rloop_model(sigma=mysim.getSigma(), a=mysim.geta())
+    energy = simulation.loadEnergyTable(mysim.getEnergyFile())
+    records = sorted(simulation.readRecords(mysim), key=lambda mygene: estimateCost(mygene.getLength(), mymodel), reverse=True)
+    workers = max(mysim.threads, 1)
+    logger.info(f"Batch of {len(records)} records on {workers} workers, longest first")
+
+    # Workers simulate each record serially; the pool is the only parallelism
+    worksim = copy.copy(mysim)
+    worksim.threads = 1
+    worksim.batch_flag = False
+    tasks = list()
+    directories = set()
+    # Streamed records reach the combined files through per-record spools on the output disk
+    spooldir = None
+    if mysim.batch_output != "per-gene" and mysim.stream_flag:
+        spooldir = tempfile.mkdtemp(prefix=".rlooper_batch_", dir=outdir)
+    for number, mygene in enumerate(records):
+        genedir = None
+        spool = os.path.join(spooldir, str(number)) if spooldir is not None else None
+        if mysim.batch_output == "per-gene":
+            genedir = geneDirectory(mygene.getName())
+            # Repeated record names get numbered directories
+            suffix = 1
+            while genedir in directories:
+                suffix += 1
+                genedir = f"{geneDirectory(mygene.getName())}_{suffix}"
+            directories.add(genedir)
+            genedir = os.path.join(outdir, genedir)
+        tasks.append({'gene': mygene, 'sim': worksim, 'model': mymodel.getParameters(), 'energy': energy, 'outdir': genedir, 'spool': spool})
+
+    try:
+        runBatch(tasks, workers, mysim, mymodel, outdir)
+    finally:
+        if spooldir is not None:
+            shutil.rmtree(spooldir, ignore_errors=True)
+
+def runBatch(tasks, workers, mysim, mymodel, outdir):
+    """Run the batch_worker tasks on the pool and write their results into outdir as they complete."""
+    began = time.perf_counter()
+    profiles = dict()
+    profilewritten = False
+    # Combined structure table, unless every record writes its own directory
+    combined = simulation.openOutput(mysim, mymodel, outdir) if mysim.batch_output != "per-gene" else contextlib.nullcontext()
+    with open(os.path.join(outdir, "rlooper_batch_timing.tsv"), "w") as timing, combined as output:
+        writer = simulation.outputWriter(output, outdir, mysim.peak_format) if output is not None else None
+        timing.write("chr\tlength\tstructures\tseconds\n")
+        executor = parallel.getExecutor(workers)
+        # At most IN_FLIGHT_PER_WORKER tasks per worker are submitted at a time, and each
+        # finished future is dropped once written, so the parent holds a few records' tables
+        queue = iter(tasks)
+        pending = set()
+        done = 0
+        while True:
+            for task in itertools.islice(queue, IN_FLIGHT_PER_WORKER * workers - len(pending)):
+                pending.add(executor.submit(batch_worker, task))
+            if len(pending) == 0:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            while finished:
+                stats = finished.pop().result()
+                done += 1
+                if stats['tables'] is not None:
+                    for myres, mypeaks in stats['tables']:
+                        writer.write(stats['name'], myres, mypeaks, strand=stats['strand'])
+                if stats['spool'] is not None:
+                    cache.replayEntry(cache.readEntry(stats['spool']), functools.partial(writer.write, stats['name'], strand=stats['strand']), simulation.STREAM_BLOCK_SIZE)
+                    shutil.rmtree(stats['spool'], ignore_errors=True)
+                if stats['profile'] is not None:
+                    if mysim.profile_format == 'npy':
+                        profiles[stats['name']] = stats['profile']
+                    else:
+                        simulation.printprofile(stats['profile'], stats['name'], append=profilewritten, outdir=outdir)
+                        profilewritten = True
+                timing.write(f"{stats['name']}\t{stats['length']}\t{stats['structures']}\t{stats['seconds']:.4f}\n")
+                logger.info(f"[{done}/{len(tasks)}] {stats['name']}: {stats['length']} bp, {stats['structures']} structures, "
+                            f"{stats['seconds']:.2f} s (elapsed {time.perf_counter() - began:.1f} s)")
+    if len(profiles) > 0:
+        np.savez(os.path.join(outdir, "rlooper_profile.npz"), **profiles)
+    logger.info(f"Batch finished in {time.perf_counter() - began:.1f} s")
@@ -0,0 +1,289 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import numpy as np
+import version
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the engine or the sampling changes what a simulation returns,
+# so entries written by older code are never served again
+ENGINE_VERSION = 1
+
+# Simulation settings that change the emitted tables, peaks or profile. The
+# output, compression, profile and peak formats do not: entries hold raw
+# columns and every format is written from them. Neither does the thread
+# count, which at most changes the rounding of the partition function sum
+RESULT_PARAMETERS = ('minlength', 'dynamic_flag', 'dynamic_window_size', 'auto_domain_size',
+                     'top', 'threshold_flag', 'power_threshold', 'profile_flag', 'profile_only_flag',
+                     'peaks_only_flag', 'stream_flag', 'npeak', 'replicates', 'seed', 'naive_flag')
+
+# Settings that only change how the results are written, part of the key of cached output files
+OUTPUT_PARAMETERS = ('output_format', 'compression', 'profile_format', 'peak_format')
+
+# Default size cap of a cache directory
+DEFAULT_CACHE_SIZE = 10 * (1 << 30)
+
+def recordKey(mygene, mymodel, energy, mysim):
+    """Content hash of everything that determines the simulation of one record.
+
+    Covers the encoded sequence, the record name (it seeds the peak
+    streams), the rloop_model parameters, the energy matrix, the result
+    settings of mysim and the engine version, so changing any of them
+    misses the cache.
+    """
+    digest = hashlib.sha256()
+    settings = {
+        'engine': ENGINE_VERSION,
+        'version': version.__version__,
+        'name': mygene.getName(),
+        'model': mymodel.getParameters(),
+        'sim': {name: getattr(mysim, name) for name in RESULT_PARAMETERS},
+    }
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(energy.matrix, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(mygene.getCodes()).tobytes())
+    return(digest.hexdigest())
+
+def runKey(recordKeys, mysim):
+    """Hash of the output files of a run over records with recordKeys, in that order."""
+    digest = hashlib.sha256()
+    settings = {
+        'engine': ENGINE_VERSION,
+        'records': list(recordKeys),
+        'output': {name: getattr(mysim, name) for name in OUTPUT_PARAMETERS},
+    }
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return(digest.hexdigest())
+
+class EntryWriter():
+    """Collects what simulate_record emits into a new cache entry directory.
+
+    Structure table blocks are appended to one raw file per column as they
+    arrive, so a streamed simulation is cached without being held in
+    memory; each peak emit is kept as its own segment, because the peak
+    file is sorted per emit.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path)
+        self.handles = None
+        self.columns = None
+        self.rows = 0
+        self.peaks = []
+
+    def write(self, myres, mypeaks):
+        if myres is not None:
+            if self.handles is None:
+                self.columns = {name: np.asarray(values).dtype.str for name, values in myres.items()}
+                self.handles = {name: open(os.path.join(self.path, f"table.{name}.bin"), "wb") for name in self.columns}
+            for name, handle in self.handles.items():
+                np.ascontiguousarray(myres[name], dtype=self.columns[name]).tofile(handle)
+            self.rows += len(myres['n'])
+        if mypeaks is not None:
+            segment = len(self.peaks)
+            np.savez(os.path.join(self.path, f"peaks.{segment}.npz"), **mypeaks)
+            self.peaks.append(len(mypeaks['n']))
+
+    def close(self, profile):
+        for handle in (self.handles or {}).values():
+            handle.close()
+        if profile is not None:
+            np.save(os.path.join(self.path, "profile.npy"), profile)
+        meta = {'columns': self.columns, 'rows': self.rows, 'peaks': self.peaks, 'profile': profile is not None}
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+def readEntry(path):
+    """Metadata, open column handles, peaks and profile of the record entry directory path.
+
+    Raises OSError, ValueError or KeyError for a missing or damaged entry;
+    the column files stay readable if the directory is removed meanwhile.
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    handles = {}
+    try:
+        for name in (meta['columns'] or {}):
+            handles[name] = open(os.path.join(path, f"table.{name}.bin"), "rb")
+        peaks = [dict(np.load(os.path.join(path, f"peaks.{segment}.npz"))) for segment in range(len(meta['peaks']))]
+        profile = np.load(os.path.join(path, "profile.npy")) if meta['profile'] else None
+    except BaseException:
+        for handle in handles.values():
+            handle.close()
+        raise
+    return(meta, handles, peaks, profile)
+
+def replayEntry(hit, emit, block_size):
+    """Emit an entry opened by readEntry as simulate_record would: table blocks of block_size rows, then the peaks."""
+    meta, handles, peaks, profile = hit
+    try:
+        for start in range(0, meta['rows'], block_size):
+            count = min(block_size, meta['rows'] - start)
+            emit({name: np.fromfile(handle, dtype=meta['columns'][name], count=count) for name, handle in handles.items()}, None)
+    finally:
+        for handle in handles.values():
+            handle.close()
+    for mypeaks in peaks:
+        emit(None, mypeaks)
+    return(profile)
+
+# Bytes in each cache directory as of its last scan plus the entries this process stored since
+totals = {}
+
+def entrySize(path):
+    """Bytes in the files of the entry directory path."""
+    return(sum(f.stat().st_size for f in os.scandir(path)))
+
+class ResultCache():
+    """On-disk cache of simulated records (keyed by recordKey) and output files (keyed by runKey).
+
+    A record entry is a directory with the structure table as raw column
+    files, the peaks of every emit and the profile. A hit replays them to
+    the emit callback in blocks of block_size rows, so a cached record
+    produces the same output files as simulating it and memory stays as
+    flat as with --stream. Formatting a large text table can cost as much
+    as simulating it, so whole runs also keep their finished output files,
+    which a repeated run copies instead of writing. Hits refresh the
+    entry's time stamp; once the directory grows past max_bytes the least
+    recently used entries are removed. Each process scans the size of a
+    cache directory once and then keeps a running total of the entries it
+    stores (in totals, shared by the ResultCaches of the directory), so
+    only a store that takes the total past max_bytes scans every entry
+    again, which also counts those stored by other processes meanwhile.
+    Entries are written under a temporary name and renamed into place, so concurrent processes (e.g.
+    Snakemake jobs) sharing a cache never read a partial entry.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE, block_size=1 << 18):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        os.makedirs(directory, exist_ok=True)
+
+    def entryPath(self, key):
+        return(os.path.join(self.directory, key[:2], key))
+
+    def simulate(self, mygene, mymodel, energy, mysim, emit, compute):
+        """Replay the cached record, or run compute (simulate_record's signature) and store it."""
+        key = recordKey(mygene, mymodel, energy, mysim)
+        hit = self.openRecord(key)
+        if hit is not None:
+            logger.info(f"{mygene.getName()}: cached result {key[:12]}")
+            return(self.replay(hit, emit))
+        results = {}
+        def fill(partial):
+            entry = EntryWriter(partial)
+            def tee(myres, mypeaks):
+                entry.write(myres, mypeaks)
+                emit(myres, mypeaks)
+            try:
+                results['profile'] = compute(mygene, mymodel, energy, mysim, tee)
+            finally:
+                entry.close(results.get('profile'))
+        self.store(key, fill)
+        return(results['profile'])
+
+    def store(self, key, fill):
+        # fill(directory) writes a new entry, which is then renamed into place
+        path = self.entryPath(key)
+        partial = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(partial, ignore_errors=True)
+        if self.max_bytes is not None and self.directory not in totals:
+            totals[self.directory] = self.size()
+        try:
+            fill(partial)
+            added = entrySize(partial)
+            try:
+                os.rename(partial, path)
+            except OSError:
+                # Another process stored the same entry first
+                shutil.rmtree(partial, ignore_errors=True)
+                added = 0
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        if self.max_bytes is not None:
+            totals[self.directory] += added
+            if totals[self.directory] > self.max_bytes:
+                self.evict()
+
+    def openMeta(self, key):
+        path = self.entryPath(key)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        os.utime(os.path.join(path, "meta.json"))
+        return(path, meta)
+
+    def openRecord(self, key):
+        # readEntry of a record entry, or None on a miss
+        try:
+            path, meta = self.openMeta(key)
+            return(readEntry(path))
+        except (OSError, ValueError, KeyError):
+            return(None)
+
+    def fetchFiles(self, key, outdir):
+        """Copy the output files cached under key into outdir; returns their names, or None on a miss."""
+        try:
+            path, meta = self.openMeta(key)
+            for name in meta['files']:
+                shutil.copyfile(os.path.join(path, name), os.path.join(outdir, name))
+        except (OSError, ValueError, KeyError):
+            return(None)
+        return(meta['files'])
+
+    def storeFiles(self, key, outdir, names):
+        """Keep copies of the output files names of outdir under key."""
+        def fill(partial):
+            os.makedirs(partial)
+            for name in names:
+                shutil.copyfile(os.path.join(outdir, name), os.path.join(partial, name))
+            with open(os.path.join(partial, "meta.json"), "w") as f:
+                json.dump({'files': list(names)}, f)
+        self.store(key, fill)
+
+    def replay(self, hit, emit):
+        return(replayEntry(hit, emit, self.block_size))
+
+    def entries(self):
+        # (last use, bytes, path) of every complete entry
+        found = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir() or '.tmp-' in entry.name:
+                    continue
+                try:
+                    used = os.stat(os.path.join(entry.path, "meta.json")).st_mtime
+                    size = entrySize(entry.path)
+                except OSError:
+                    continue
+                found.append((used, size, entry.path))
+        return(found)
+
+    def size(self):
+        return(sum(size for used, size, path in self.entries()))
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        if self.max_bytes is None:
+            return
+        found = sorted(self.entries())
+        total = sum(size for used, size, path in found)
+        for used, size, path in found:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info(f"cache: evicted {os.path.basename(path)[:12]} ({size / (1 << 20):.1f} MiB)")
+        totals[self.directory] = total
+
+    def clear(self):
+        for used, size, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+        totals.pop(self.directory, None)
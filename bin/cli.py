@@ -40,6 +40,54 @@ Examples:zz
                        help="Path to energy CSV file (default: use package data)")
     parser.add_argument("--output-dir", default=".", 
                        help="Output directory for results (default: current directory)")
+    parser.add_argument("--bed", metavar="BED",
+                       help="Simulate the regions of this BED file, read from the indexed FASTA file")
+    parser.add_argument("--top", type=int, metavar="K",
+                       help="Only write the K most probable structures")
+    parser.add_argument("--power-threshold", type=float, metavar="P",
+                       help="Only write structures with probability >= 10^-P")
+    parser.add_argument("--profile", nargs="?", const="bedgraph", choices=["bedgraph", "npy"],
+                       help="Also write the per-base R-loop probability profile")
+    parser.add_argument("--profile-only", action="store_true",
+                       help="Write only the profile, without the structure table and peaks")
+    parser.add_argument("--window-size", type=float, metavar="KB",
+                       help="Split long sequences into overlapping KB-sized domains simulated independently (KB above the ~2 kb overlap)")
+    parser.add_argument("--auto-domain-size", action="store_true",
+                       help="Split long sequences into domains of the model's superhelical domain size N")
+    parser.add_argument("--threads", "-t", type=int, default=1,
+                       help="Worker processes for the simulation engine; --stream and --peaks-only run serially (default: 1)")
+    parser.add_argument("--sweep-sigma", metavar="LIST",
+                       help="Comma-separated sigma values; run a parameter sweep instead of one simulation")
+    parser.add_argument("--sweep-a", metavar="LIST",
+                       help="Comma-separated a values for the parameter sweep")
+    parser.add_argument("--output-format", choices=["tsv", "parquet", "feather", "npz"],
+                       help="Format of the structure table rlooper_output (default: tsv)")
+    parser.add_argument("--compression", choices=["gzip", "zstd"],
+                       help="Compress the tsv structure table (rlooper_output.csv.gz or .zst)")
+    parser.add_argument("--peaks-only", action="store_true",
+                       help="Sample peaks in one engine pass, without building or writing the structure table")
+    parser.add_argument("--stream", action="store_true",
+                       help="Write the structure table block by block instead of holding it in memory")
+    parser.add_argument("--npeak", type=int,
+                       help="Peaks sampled per replicate from each structure table, per domain in windowed mode (default: 50)")
+    parser.add_argument("--replicates", type=int,
+                       help="Independent peak replicates (default: 1)")
+    parser.add_argument("--seed", type=int,
+                       help="Seed of the peak replicate streams (default: 0)")
+    parser.add_argument("--peak-format", choices=["csv", "bed"],
+                       help="Write peaks as rlooper_peaks.csv or compact BED6+1 rlooper_peaks.bed (default: csv)")
+    parser.add_argument("--batch", action="store_true",
+                       help="Run the records on a pool of --threads worker processes, longest first")
+    parser.add_argument("--batch-output", choices=["combined", "per-gene"],
+                       help="Batch mode: combined output files or one directory per record (default: combined)")
+    parser.add_argument("--cache", metavar="DIR",
+                       help="Result cache directory; unchanged records are read from it instead of simulated")
+    parser.add_argument("--cache-size", type=float, metavar="GB",
+                       help="Size cap of the result cache, least recently used entries removed first; the cache keeps a second full copy of every output file (default: 10)")
+    parser.add_argument("--band-cache", metavar="DIR",
+                       help="Store of memory-mapped sequence bands, reused by runs on the same sequence with other parameters")
+    parser.add_argument("--naive", action="store_true",
+                       help="Use the reference per-structure loop instead of the vectorized engine")
     
     args = parser.parse_args()
     
@@ -90,29 +138,64 @@ Examples:zz
     
     # Import and run the simulation
     try:
-        from .main import main as run_simulation
+        from . import main as rlooper_main
         
-        # Change to output directory
-        original_dir = os.getcwd()
+        # Outputs go to the output directory; the working directory is left alone
         output_dir = Path(args.output_dir).resolve()
         output_dir.mkdir(parents=True, exist_ok=True)
-        os.chdir(output_dir)
         
-        # Set up sys.argv for the original main function - use relative path from output dir
+        # Options for the original main.py parser, with absolute input paths
         fasta_absolute = fasta_path.resolve()
-        sys.argv = ["rlooper-sim", str(fasta_absolute)]
-        
-        # Copy energy.csv to current directory if needed
-        local_energy = Path("energy.csv")
-        if not local_energy.exists():
-            import shutil
-            shutil.copy2(energy_csv, local_energy)
+        argv = ["-i", str(fasta_absolute), "-e", str(Path(energy_csv).resolve())]
+        if args.bed:
+            argv.extend(["-b", str(Path(args.bed).resolve())])
+        if args.top is not None:
+            argv.extend(["--top", str(args.top)])
+        if args.power_threshold is not None:
+            argv.extend(["--power-threshold", str(args.power_threshold)])
+        if args.profile:
+            argv.extend(["--profile", args.profile])
+        if args.profile_only:
+            argv.append("--profile-only")
+        if args.window_size is not None:
+            argv.extend(["--window-size", str(args.window_size)])
+        if args.auto_domain_size:
+            argv.append("--auto-domain-size")
+        if args.threads > 1:
+            argv.extend(["--threads", str(args.threads)])
+        if args.sweep_sigma:
+            argv.append("--sweep-sigma=" + args.sweep_sigma)
+        if args.sweep_a:
+            argv.append("--sweep-a=" + args.sweep_a)
+        if args.output_format:
+            argv.extend(["--output-format", args.output_format])
+        if args.compression:
+            argv.extend(["--compression", args.compression])
+        if args.stream:
+            argv.append("--stream")
+        if args.peaks_only:
+            argv.append("--peaks-only")
+        for option in ("npeak", "replicates", "seed"):
+            if getattr(args, option) is not None:
+                argv.extend(["--" + option, str(getattr(args, option))])
+        if args.peak_format:
+            argv.extend(["--peak-format", args.peak_format])
+        if args.batch:
+            argv.append("--batch")
+        if args.batch_output:
+            argv.extend(["--batch-output", args.batch_output])
+        if args.cache:
+            argv.extend(["--cache", str(Path(args.cache).resolve())])
+        if args.cache_size is not None:
+            argv.extend(["--cache-size", str(args.cache_size)])
+        if args.band_cache:
+            argv.extend(["--band-cache", str(Path(args.band_cache).resolve())])
+        if args.naive:
+            argv.append("--naive")
         
         # Run the simulation
-        result = run_simulation()
-        
-        # Change back to original directory
-        os.chdir(original_dir)
+        mysim = rlooper_main.parseArgv(argv)
+        result = rlooper_main.loadSimulation().simulation_main(mysim, outdir=str(output_dir))
         
         print(f"Simulation completed. Results saved in: {output_dir}")
         return result if result is not None else 0
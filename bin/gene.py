@@ -1,85 +1,320 @@
 import os
 import sys
+import gzip
+import mmap
 import logging
-import pandas as pd
+import numpy as np
 import structure
 
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Integer base codes used by the energy matrix and the engines
+BASES = "ACGTN"
+BASE_CODES = np.full(256, BASES.index('N'), dtype=np.uint8)
+for code, base in enumerate(BASES):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+BASE_LETTERS = np.frombuffer(BASES.encode('ascii'), dtype=np.uint8)
+BASE_COMPLEMENT = np.array([BASES.index(b) for b in "TGCAN"], dtype=np.uint8)
+
+def encodeSequence(sequence):
+    """Return sequence (str, bytes or list of bases) as a uint8 array of base codes.
+
+    A uint8 array is taken to hold codes already and returned unchanged.
+    """
+    if isinstance(sequence, np.ndarray) and sequence.dtype == np.uint8:
+        return(sequence)
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii', errors='replace')
+    elif not isinstance(sequence, (bytes, bytearray, memoryview)):
+        sequence = ''.join(sequence).encode('ascii', errors='replace')
+    return(BASE_CODES[np.frombuffer(sequence, dtype=np.uint8)])
+
+def decodeSequence(codes):
+    """Return a uint8 code array as bytes of upper-case bases."""
+    return(BASE_LETTERS[codes].tobytes())
+
+def baseCode(base):
+    if isinstance(base, str):
+        return(int(BASE_CODES[ord(base)]) if len(base) == 1 and ord(base) < 256 else BASES.index('N'))
+    return(int(base))
+
 class Gene():
+    """One sequence record: name, header, position and base codes.
+
+    Genes are immutable; the readers below build them with every field set,
+    and replace() derives a modified copy. The code array is made read-only
+    so it can be shared between threads and simulations; a uint8 code
+    array passed in is checked, and copied unless it is already frozen.
+    """
+
+    __slots__ = ('gene_name', 'header', 'pos', 'codes', 'sequence_bytes', 'ground_state_energy')
+
+    def __init__(self, sequence=None, name="init", header="", pos=None, ground_state_energy=0.0):
+        codes = encodeSequence(sequence if sequence is not None else b"")
+        if codes is sequence:
+            # A uint8 array is taken as base codes, not as ASCII letters
+            if len(codes) > 0 and codes.max() >= len(BASES):
+                raise ValueError(f"uint8 sequence arrays must hold base codes 0-{len(BASES) - 1} ({BASES}); pass letters as str or bytes")
+            # A frozen array that owns its data (another Gene's, or one the readers built) is
+            # taken over; any other array is copied, so freezing it leaves the caller's writeable
+            if codes.flags.writeable or not codes.flags.owndata:
+                codes = codes.copy()
+        codes.flags.writeable = False
+        object.__setattr__(self, 'gene_name', name)
+        object.__setattr__(self, 'header', header)
+        object.__setattr__(self, 'pos', pos if pos is not None else structure.Loci())
+        object.__setattr__(self, 'codes', codes)
+        object.__setattr__(self, 'sequence_bytes', None)
+        object.__setattr__(self, 'ground_state_energy', ground_state_energy)
 
-    gene_name = "init"
-    header = ""
-    pos = structure.Loci()
-    sequence = list()
-    mystruct = structure.Structure()
-    ground_state_energy = 0.0
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Gene is immutable; use replace({name}=...)")
+
+    def __reduce__(self):
+        return(Gene, (self.codes, self.gene_name, self.header, self.pos, self.ground_state_energy))
+
+    def replace(self, sequence=None, name=None, header=None, pos=None, ground_state_energy=None):
+        return(Gene(self.codes if sequence is None else sequence,
+                    self.gene_name if name is None else name,
+                    self.header if header is None else header,
+                    self.pos if pos is None else pos,
+                    self.ground_state_energy if ground_state_energy is None else ground_state_energy))
 
     def parseHeader(self):
         pass
     def getName(self):
-        return(Gene.gene_name)
-    def setName(self,name):
-        Gene.gene_name = name
+        return(self.gene_name)
     def getHeader(self):
-        return(Gene.header)
-    def setHeader(self,h):
-        Gene.header = h
+        return(self.header)
+    def getCodes(self):
+        return(self.codes)
+    def getBytes(self):
+        if self.sequence_bytes is None:
+            # Lazily cached; racing threads would only compute the same bytes twice
+            object.__setattr__(self, 'sequence_bytes', decodeSequence(self.codes))
+        return(self.sequence_bytes)
     def getSequence(self):
-        return(Gene.sequence)
-    def setSequence(self,seq):
-        Gene.sequence = seq
+        return(self.getBytes().decode('ascii'))
     def getPos(self):
-        return(Gene.pos)
-    def setPos(self,p):
-        Gene.pos = p
+        return(self.pos)
 
     def printGene(self):
-        logger.info("Gene Name: " + Gene.gene_name)
-        logger.info("Header: " + Gene.header)
-        logger.info("Position: " + Gene.pos.chromsome + ":" + str(Gene.pos.start_pos) + "-" + str(Gene.pos.end_pos) + " (" + Gene.pos.strand + ")")
-        logger.info("Sequence Length: " + str(len(Gene.sequence)))
-        logger.info("Sequence: " + ''.join(Gene.sequence[0:10]) + ("..." if len(Gene.sequence) > 10 else ""))
-        logger.info("Ground State Energy: " + str(Gene.ground_state_energy))
+        logger.info("Gene Name: " + self.gene_name)
+        logger.info("Header: " + self.header)
+        logger.info("Position: " + self.pos.chromsome + ":" + str(self.pos.start_pos) + "-" + str(self.pos.end_pos) + " (" + self.pos.strand + ")")
+        logger.info("Sequence Length: " + str(len(self.codes)))
+        logger.info("Sequence: " + decodeSequence(self.codes[0:10]).decode('ascii') + ("..." if len(self.codes) > 10 else ""))
+        logger.info("Ground State Energy: " + str(self.ground_state_energy))
 
     def getGroundStateEnergy(self):
-        return(Gene.ground_state_energy)
-    def setGroundStateEnergy(e):
-        Gene.ground_state_energy = e
+        return(self.ground_state_energy)
+
+    def countBases(self):
+        # Counts of A, C, G, T, N in gene.BASES order
+        return(np.bincount(self.codes, minlength=len(BASES)))
     
     def computeGCSkew(self):
-        return( (Gene.sequence.count('G') - Gene.sequence.count('C')) / (Gene.sequence.count('G') + Gene.sequence.count('C')) 
-               if (Gene.sequence.count('G') + Gene.sequence.count('C')) > 0 else 0 
-               )
+        a, c, g, t, n = self.countBases()
+        return((g - c) / (g + c) if (g + c) > 0 else 0)
     def computeATSkew(self):
-        return( (Gene.sequence.count('A') - Gene.sequence.count('T')) / (Gene.sequence.count('A') + Gene.sequence.count('T')) 
-               if (Gene.sequence.count('A') + Gene.sequence.count('T')) > 0 else 0 
-               )
+        a, c, g, t, n = self.countBases()
+        return((a - t) / (a + t) if (a + t) > 0 else 0)
     def computeGCContent(self):
-        return( (Gene.sequence.count('G') + Gene.sequence.count('C')) / len(Gene.sequence) 
-               if len(Gene.sequence) > 0 else 0 
-               )
+        a, c, g, t, n = self.countBases()
+        return((g + c) / len(self.codes) if len(self.codes) > 0 else 0)
     def computeATContent(self):
-        return( (Gene.sequence.count('A') + Gene.sequence.count('T')) / len(Gene.sequence) 
-               if len(Gene.sequence) > 0 else 0 
-               )
+        a, c, g, t, n = self.countBases()
+        return((a + t) / len(self.codes) if len(self.codes) > 0 else 0)
+    def reverseComplementCodes(self):
+        return(BASE_COMPLEMENT[self.codes[::-1]])
     def reverseComplement(self):
-        complement = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C', 'N': 'N'}
-        return(''.join(complement.get(base, base) for base in reversed(Gene.sequence)))
+        return(decodeSequence(self.reverseComplementCodes()).decode('ascii'))
     def getLength(self):
-        return(len(Gene.sequence))
-    def extractSubsequence(start, end):
-        return(''.join(Gene.sequence[start:end]))
-    def loadFromFasta(self,fasta_file):
-        with open(fasta_file, 'r') as f:
-            lines = f.readlines()
-            header = lines[0].strip()
-            sequence = ''.join(line.strip() for line in lines[1:])
-        gene = Gene()
-        gene.setHeader(header)
-        gene.setSequence(list(sequence))
-        gene.setName(header.split()[0][1:])  # Assuming the first word after '>' is the gene name
-        return(gene)
+        return(len(self.codes))
+    def extractSubsequence(self, start, end):
+        return(decodeSequence(self.codes[start:end]).decode('ascii'))
+    @classmethod
+    def loadFromFasta(cls,fasta_file):
+        # First record of fasta_file (an empty gene if there is none)
+        for record in readFasta(fasta_file):
+            return(record)
+        return(cls())
+
+def openFasta(fasta_file):
+    """Open a plain or gzip-compressed FASTA file for binary reading."""
+    with open(fasta_file, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return(gzip.open(fasta_file, 'rb'))
+    return(open(fasta_file, 'rb'))
+
+def makeGene(header, sequence):
+    name = header.split()[0][1:] if len(header) > 1 else ""  # Assuming the first word after '>' is the gene name
+    return(Gene(sequence, name, header))
+
+def readFasta(fasta_file):
+    """Yield one Gene per record of fasta_file.
+
+    Lines are read one at a time, so only the current record is held in
+    memory.
+    """
+    with openFasta(fasta_file) as f:
+        header = None
+        sequence = bytearray()
+        for line in f:
+            if line.startswith(b'>'):
+                if header is not None:
+                    yield(makeGene(header, sequence))
+                header = line.strip().decode()
+                sequence = bytearray()
+            elif header is not None:
+                sequence += line.strip()
+        if header is not None:
+            yield(makeGene(header, sequence))
+
+def buildFastaIndex(fasta_file):
+    """Scan an uncompressed FASTA file into samtools faidx entries.
+
+    Returns a dict of name -> (length, offset, linebases, linewidth).
+    """
+    entries = {}
+    name = None
+    with open(fasta_file, 'rb') as f:
+        position = 0
+        for line in f:
+            if line.startswith(b'>'):
+                name = line[1:].split()[0].decode() if len(line[1:].split()) > 0 else ""
+                entries[name] = [0, position + len(line), 0, 0]
+                lastline = False
+            elif name is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                entry = entries[name]
+                if entry[2] == 0:
+                    entry[2] = bases
+                    entry[3] = len(line)
+                elif lastline or bases > entry[2]:
+                    raise ValueError(f"{fasta_file}: record {name} has lines of different lengths and cannot be indexed")
+                lastline = bases < entry[2]
+                entry[0] += bases
+            position += len(line)
+    return({name: tuple(entry) for name, entry in entries.items()})
+
+def readFastaIndex(fai_file):
+    entries = {}
+    with open(fai_file) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 5:
+                entries[fields[0]] = tuple(int(x) for x in fields[1:5])
+    return(entries)
+
+def writeFastaIndex(entries, fai_file):
+    with open(fai_file, 'w') as f:
+        for name, (length, offset, linebases, linewidth) in entries.items():
+            f.write(f"{name}\t{length}\t{offset}\t{linebases}\t{linewidth}\n")
+
+class FastaIndex():
+    """Random access to an uncompressed FASTA file through its .fai index and mmap.
+
+    An existing <fasta>.fai that is newer than the FASTA file is reused;
+    otherwise the index is built and written next to the file if possible.
+    """
+
+    def __init__(self, fasta_file):
+        self.fasta_file = fasta_file
+        with open(fasta_file, 'rb') as f:
+            if f.read(2) == b'\x1f\x8b':
+                raise ValueError(f"{fasta_file}: indexed access needs an uncompressed FASTA file")
+        fai_file = fasta_file + '.fai'
+        if os.path.exists(fai_file) and os.path.getmtime(fai_file) >= os.path.getmtime(fasta_file):
+            self.entries = readFastaIndex(fai_file)
+        else:
+            self.entries = buildFastaIndex(fasta_file)
+            try:
+                writeFastaIndex(self.entries, fai_file)
+            except OSError:
+                logger.info(f"Could not write {fai_file}; keeping the index in memory")
+        self.handle = open(fasta_file, 'rb')
+        self.mmap = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = np.frombuffer(self.mmap, dtype=np.uint8)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data = None
+        self.mmap.close()
+        self.handle.close()
+
+    def getNames(self):
+        return(list(self.entries))
+
+    def getLength(self, chrom):
+        return(self.entries[chrom][0])
+
+    def fetchCodes(self, chrom, start, end):
+        """Return chrom[start:end] (0-based, half-open) as a uint8 code array.
+
+        Raises ValueError for an unknown chrom or a region outside it.
+        """
+        if chrom not in self.entries:
+            raise ValueError(f"{self.fasta_file}: no sequence named {chrom}")
+        length, offset, linebases, linewidth = self.entries[chrom]
+        if start < 0 or end > length or end < start:
+            raise ValueError(f"{self.fasta_file}: region {chrom}:{start}-{end} is outside {chrom} (length {length})")
+        if end == start:
+            return(np.zeros(0, dtype=np.uint8))
+        firstrow = start // linebases
+        lastrow = (end - 1) // linebases
+        if firstrow == lastrow:
+            begin = offset + firstrow * linewidth + start % linebases
+            return(BASE_CODES[self.data[begin:begin + end - start]])
+        # Full lines are a strided (rows, linebases) view of the mapped file, so
+        # newlines are skipped without copying before the code lookup
+        rows = self.data[offset + firstrow * linewidth:offset + lastrow * linewidth].reshape(-1, linewidth)[:, :linebases]
+        head = start - firstrow * linebases
+        tail = end - lastrow * linebases
+        last = self.data[offset + lastrow * linewidth:offset + lastrow * linewidth + tail]
+        codes = np.empty(end - start, dtype=np.uint8)
+        codes[:rows.size - head] = BASE_CODES[rows].reshape(-1)[head:]
+        codes[rows.size - head:] = BASE_CODES[last]
+        return(codes)
+
+    def fetch(self, chrom, start, end, name=None, strand='+'):
+        """Gene of chrom[start:end], reverse complemented for the - strand."""
+        pos = structure.Loci(chromsome=chrom, start_pos=start, end_pos=end, strand=strand, get_length=end - start)
+        name = name if name is not None else f"{chrom}:{start}-{end}"
+        codes = self.fetchCodes(chrom, start, end)
+        if strand == '-':
+            codes = BASE_COMPLEMENT[codes[::-1]]
+        # Frozen here, so Gene takes the fresh array over instead of copying it
+        codes.setflags(write=False)
+        return(Gene(codes, name, f">{name}", pos))
+
+def readBedRegions(fasta_file, bed_file):
+    """Yield one Gene per BED region, sliced out of the indexed fasta_file.
 
+    Regions on the - strand are simulated on their reverse complement, so
+    structure positions count from the region's 5' end on that strand.
+    """
+    with FastaIndex(fasta_file) as index:
+        with open(bed_file) as f:
+            for lineno, line in enumerate(f, 1):
+                if len(line.strip()) == 0 or line.startswith(('#', 'track', 'browser')):
+                    continue
+                fields = line.rstrip('\r\n').split('\t')
+                chrom, start, end = fields[0], int(fields[1]), int(fields[2])
+                name = fields[3] if len(fields) > 3 else None
+                strand = fields[5] if len(fields) > 5 and fields[5] != '.' else '+'
+                if strand not in ('+', '-'):
+                    raise ValueError(f"{bed_file}:{lineno}: unknown strand {strand}")
+                try:
+                    mygene = index.fetch(chrom, start, end, name, strand)
+                except ValueError as e:
+                    raise ValueError(f"{bed_file}:{lineno}: {e}") from None
+                yield(mygene)
@@ -1,12 +1,26 @@
+import sys
+import heapq
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import argparse as args
+import tableio
+
+def pyplot():
+	"""matplotlib.pyplot, imported on first use with the non-interactive Agg backend.
+
+	The backend is only chosen if pyplot was not imported before, so a
+	caller (e.g. a notebook) keeps its own.
+	"""
+	if 'matplotlib.pyplot' not in sys.modules:
+		import matplotlib
+		matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+	return(plt)
 
 def parse_arg():
 	myargs = args.ArgumentParser(description='R-loop Peak Simulator')
-	myargs.add_argument('-i','--input', type=str, help='Input peak file (CSV)')
+	myargs.add_argument('-i','--input', type=str, help='Input peak file (CSV), or a structure table (CSV, Parquet, Feather or NPZ)')
 	myargs.add_argument('-o','--output', type=str, help='Output graph file (PNG)')
+	myargs.add_argument('-l','--levels', action='store_true', help='Also draw the peaks stacked on non-overlapping levels')
 	return myargs.parse_args()
 
 def main():
@@ -14,7 +28,7 @@ def main():
     if myargs.input:
         try:
             print(f"Reading peaks from: {myargs.input}")
-            peaks = pd.read_csv(myargs.input, sep='\t')  # Use tab separator for CSV files from rlooper
+            peaks = read_peaks(myargs.input)
             print(f"Loaded {len(peaks)} peaks")
             print(f"Columns: {list(peaks.columns)}")
         except Exception as e:
@@ -31,136 +45,181 @@ def main():
     
     print(f"Creating graph: {output_file}")
     try:
-        graph_compressed_pileup(peaks, output_file)
+        graph_compressed_pileup(peaks, output_file, myargs.levels)
     except Exception as e:
         print(f"Error creating graph: {e}")
         import traceback
         traceback.print_exc()
 
-def find_pileup_level(start, end, occupied_levels):
-	"""Find the lowest available level for a peak, allowing proper pileup"""
-	# Try to place in existing levels first
-	for level in range(len(occupied_levels)):
-		# Check if this peak can fit in this level (no overlap with existing peaks)
-		can_fit = True
-		for occupied_start, occupied_end in occupied_levels[level]:
-			# Check for overlap: peaks overlap if they don't end before the other starts
-			if not (end <= occupied_start or start >= occupied_end):
-				can_fit = False
-				break
-		
-		if can_fit:
-			occupied_levels[level].append((start, end))
-			return level
-	
-	# If no existing level works, create a new level
-	occupied_levels.append([(start, end)])
-	return len(occupied_levels) - 1
-
-def graph_compressed_pileup(peaks, output_file='rloop_peaks.png'):
-	plt.figure(figsize=(16, 8))
-	
-	# Sort peaks by start position, then by end position
-	peaks_sorted = peaks.sort_values(['start', 'end']).reset_index(drop=True)
-	
-	# Create proper pileup: overlapping peaks get stacked
-	levels = []  # Each element is list of (start, end, prob, original_index)
-	
-	# Create pileup array covering the genomic range
-	min_pos = 0 #peaks_sorted['start'].min()
-	max_pos = peaks_sorted['end'].max()*2
-	pileup_size = max_pos - min_pos + 1
-	pileup = [0] * pileup_size  # Initialize with zeros
-	
-	for idx, row in peaks_sorted.iterrows():
-		start = row['start']
-		end = row['end'] 
-		prob = row['probability']
-		# Count coverage for each position in the peak
-		for i in range(start, end + 1):
-			pileup[i - min_pos] += 1  # Adjust for array indexing
-
-		# # Find the first level where this peak can fit (no overlap)
-		# placed = False
-		# for level_idx, level_intervals in enumerate(levels):
-		# 	# Check if peak overlaps with any interval in this level
-		# 	overlaps = False
-		# 	for interval_start, interval_end, _, _ in level_intervals:
-		# 		if not (end <= interval_start or start >= interval_end):  # They overlap
-		# 			overlaps = True
-		# 			break
-			
-		# 	if not overlaps:  # Can place in this level
-		# 		levels[level_idx].append((start, end, prob, idx))
-		# 		placed = True
-		# 		break
-		
-		# if not placed:  # Need new level
-		# 	levels.append([(start, end, prob, idx)])
-		# 	if len(levels) <= 5:  # Debug first few levels
-		# 		print(f"Created level {len(levels)-1} for peak {idx}: {start}-{end}")
-	
-	# Draw the pileup
-	# for level_idx, level_intervals in enumerate(levels):
-	# 	for start, end, prob, orig_idx in level_intervals:
-	# 		# Use probability for color intensity  
-	# 		color_intensity = prob / peaks['probability'].max()  # Normalize to 0-1
-	# 		height = 0.8
-			
-	# 		# Draw horizontal block
-	# 		plt.barh(level_idx, end - start, left=start, height=height, 
-	# 				color=plt.cm.viridis(color_intensity), 
-	# 				alpha=0.85, edgecolor='navy', linewidth=0.3)
-			
-	# 		# Add probability label
-	# 		mid_pos = (start + end) / 2
-	# 		plt.text(mid_pos, level_idx, f'{prob:.3f}', 
-	# 				ha='center', va='center', fontsize=7, 
-	# 				color='white' if color_intensity > 0.5 else 'black',
-	# 				weight='bold')
-	# Create x-axis positions (genomic coordinates)
-	x_positions = range(min_pos, max_pos + 1)
-	
-	# Create line plot for pileup coverage
-	plt.plot(x_positions, pileup, 'b-', linewidth=2, alpha=0.8, label='Coverage')
-	
-	# Optional: Add filled area under the curve
-	plt.fill_between(x_positions, pileup, alpha=0.3, color='lightblue')
-	
-	# Optional: Add scatter points for peaks
-	plt.scatter(x_positions, pileup, s=10, alpha=0.6, color='darkblue')
-	
-	plt.xlabel('Genomic Position (bp)')
-	plt.ylabel('Peak Coverage Depth')
-	plt.title(f'PEAK: {len(peaks_sorted)} peaks')
-	plt.grid(True, alpha=0.3)
-	plt.legend()
-	
-	plt.tight_layout()
-	plt.savefig(output_file, dpi=300, bbox_inches='tight')
-	plt.close()
-	# Set y-axis to show all levels with some padding
-	# plt.ylim(-0.5, len(levels) - 0.5)
-	
-	# # Add colorbar
-	# sm = plt.cm.ScalarMappable(cmap=plt.cm.viridis, norm=plt.Normalize(vmin=0, vmax=peaks['probability'].max()))
-	# sm.set_array([])
-	# cbar = plt.colorbar(sm, ax=plt.gca())
-	# cbar.set_label('R-loop Formation Probability', rotation=270, labelpad=20)
-	
-	# # Calculate pileup stats
-	# peaks_per_level = [len(level) for level in levels]
-	# max_pileup = max(peaks_per_level)
-	# avg_pileup = sum(peaks_per_level) / len(peaks_per_level)
-	
-	# plt.tight_layout()
-	# plt.savefig(output_file, dpi=300, bbox_inches='tight')
-	# plt.close()
-	
-	# print(f"✅ Graph saved to {output_file}")
-	# print(f"📊 Pileup complete: {len(peaks_sorted)} peaks → {len(levels)} levels")
-	# print(f"�️  Max pileup depth: {max_pileup} peaks/level")
-	# print(f"📈 Average: {avg_pileup:.1f} peaks/level") 
+def read_peaks(input_file):
+	"""Load start, end and probability of the peaks (or structures) in input_file.
+
+	Peak files (csv or BED) have start/end columns; structure tables from rlooper_output
+	in any output format are read through tableio, loading only n, m and
+	probability, and converted to the same [start, end) intervals.
+	"""
+	import pandas as pd
+	if input_file.endswith('.bed'):
+		# BED6+1 peaks from --peak-format bed: the seventh column is the probability
+		return(pd.read_csv(input_file, sep='\t', header=None, usecols=[1, 2, 6], names=['start', 'end', 'probability']))
+	columns = tableio.readColumns(input_file)
+	if 'start' in columns and 'end' in columns:
+		return(tableio.readTable(input_file, ['start', 'end', 'probability']))
+	table = tableio.readTable(input_file, ['n', 'm', 'probability'])
+	start = table['n'].to_numpy().astype(np.int64)
+	end = start + table['m'].to_numpy().astype(np.int64) + 1
+	return(pd.DataFrame({'start': start, 'end': end, 'probability': table['probability'].to_numpy()}))
+
+# Coverage longer than this is reduced to min/max bins before drawing (about
+# the pixel width of the 16 inch figure at 300 dpi)
+DECIMATE_BINS = 4000
+
+def compute_coverage(start, end, length=None):
+	"""Peak coverage depth at every position of [0, length) for [start, end) peaks.
+
+	Each peak adds +1 at its start and -1 at its end of a difference array
+	(with bincount), and the prefix sum is the coverage: O(peaks + length)
+	instead of one increment per covered base.
+	"""
+	start = np.asarray(start, dtype=np.int64)
+	end = np.asarray(end, dtype=np.int64)
+	if length is None:
+		length = int(end.max()) if len(end) > 0 else 0
+	delta = np.bincount(start, minlength=length + 1) - np.bincount(end, minlength=length + 1)
+	return(np.cumsum(delta[:length]))
+
+def decimate(values, bins=DECIMATE_BINS):
+	"""(x, min, max) of values over at most bins equal bins; short arrays are returned as is."""
+	if len(values) <= bins:
+		return(np.arange(len(values)), values, values)
+	edges = np.unique(np.linspace(0, len(values), bins + 1).astype(np.int64)[:-1])
+	return(edges, np.minimum.reduceat(values, edges), np.maximum.reduceat(values, edges))
+
+def pack_levels(start, end):
+	"""Level of every peak in a stacked view where peaks on one level do not overlap.
+
+	Peaks are placed in order of start (then end), each on the lowest
+	level that is free at its start: levels in use sit in a heap keyed by
+	the end of their last peak, and levels freed by the time a peak starts
+	move to a heap of free level numbers. O(n log n) overall, with the same
+	assignment as trying every level in turn. Returns an int64 array aligned
+	with start and end, e.g. to export a packed-track layout.
+	"""
+	start = np.asarray(start, dtype=np.int64)
+	end = np.asarray(end, dtype=np.int64)
+	levels = np.zeros(len(start), dtype=np.int64)
+	busy = []  # (end of the last peak, level)
+	free = []  # levels whose last peak ended
+	nlevels = 0
+	order = np.lexsort((end, start))
+	for i, s, e in zip(order.tolist(), start[order].tolist(), end[order].tolist()):
+		while busy and busy[0][0] <= s:
+			heapq.heappush(free, heapq.heappop(busy)[1])
+		if free:
+			level = heapq.heappop(free)
+		else:
+			level = nlevels
+			nlevels += 1
+		levels[i] = level
+		heapq.heappush(busy, (e, level))
+	return(levels)
+
+def level_image(start, end, probability, levels, length, bins=DECIMATE_BINS):
+	"""(levels x bins) image of the stacked peaks, NaN where a bin holds no peak.
+
+	Every peak fills the bins it overlaps on its level; where several peaks
+	of one level share a bin the most probable one is shown.
+	"""
+	width = max(length / bins, 1.0)
+	bins = int(np.ceil(length / width))
+	first = (start / width).astype(np.int64)
+	last = np.maximum(np.ceil(end / width).astype(np.int64) - 1, first)
+	# Most probable peaks last, so they win the shared bins
+	order = np.argsort(probability, kind='stable')
+	counts = (last - first + 1)[order]
+	rows = np.repeat(levels[order], counts)
+	columns = np.repeat(first[order], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+	image = np.full((int(levels.max()) + 1, bins), np.nan)
+	image[rows, np.minimum(columns, bins - 1)] = np.repeat(probability[order], counts)
+	return(image)
+
+def draw_levels(ax, start, end, probability, levels, length):
+	"""Draw peaks at their pileup level, colored by probability.
+
+	Short tracks get one horizontal segment per peak in a single rasterized
+	collection; longer ones (like the decimated coverage) an image of
+	DECIMATE_BINS columns, which costs the same however many peaks there are.
+	"""
+	plt = pyplot()
+	norm = plt.Normalize(vmin=0, vmax=probability.max() if len(probability) > 0 else 1)
+	# An empty peak set still gets its (empty) track and color bar
+	top = levels.max() if len(levels) > 0 else 0
+	if length > DECIMATE_BINS and len(start) > 0:
+		cmap = plt.cm.viridis.copy()
+		cmap.set_bad('white')
+		artist = ax.imshow(level_image(start, end, probability, levels, length), cmap=cmap, norm=norm, aspect='auto', origin='lower',
+		                   interpolation='nearest', extent=(0, length, -0.5, top + 0.5))
+	else:
+		from matplotlib.collections import LineCollection
+		segments = np.empty((len(start), 2, 2))
+		segments[:, 0, 0] = start
+		segments[:, 1, 0] = end
+		segments[:, :, 1] = levels[:, None]
+		artist = LineCollection(segments, cmap=plt.cm.viridis, norm=norm, linewidths=max(0.2, min(4.0, 200.0 / (top + 1))), rasterized=True)
+		artist.set_array(probability)
+		ax.add_collection(artist)
+	ax.set_ylim(-0.5, top + 0.5)
+	ax.set_ylabel('Pileup level')
+	# Shared by every panel so the coverage and level x axes stay aligned
+	cbar = ax.figure.colorbar(artist, ax=ax.figure.axes)
+	cbar.set_label('R-loop Formation Probability', rotation=270, labelpad=20)
+
+def graph_compressed_pileup(peaks, output_file='rloop_peaks.png', show_levels=False):
+	"""Plot the coverage of the peaks, and with show_levels the stacked peaks below it.
+
+	Coverage comes from a difference array; tracks longer than
+	DECIMATE_BINS positions are drawn as per-bin min/max envelopes, and all
+	bulky artists are rasterized, so a 1 Mb track with a million peaks
+	plots in seconds.
+	"""
+	plt = pyplot()
+	start = peaks['start'].to_numpy().astype(np.int64)
+	end = peaks['end'].to_numpy().astype(np.int64)
+	coverage = compute_coverage(start, end)
+	x_positions, low, high = decimate(coverage)
+	decimated = len(x_positions) < len(coverage)
+
+	if show_levels:
+		fig, (ax, axlevels) = plt.subplots(2, 1, figsize=(16, 12), sharex=True, gridspec_kw={'height_ratios': [1, 2]}, constrained_layout=True)
+	else:
+		fig, ax = plt.subplots(figsize=(16, 8))
+
+	# Line plot for pileup coverage (the upper envelope when decimated)
+	ax.plot(x_positions, high, 'b-', linewidth=2 if not decimated else 0.8, alpha=0.8, label='Coverage', rasterized=decimated)
+	ax.fill_between(x_positions, high, alpha=0.3, color='lightblue', rasterized=True)
+	if decimated:
+		# Range of the coverage within each bin
+		ax.fill_between(x_positions, low, high, alpha=0.5, color='blue', linewidth=0, label='Min-max per bin', rasterized=True)
+	else:
+		ax.scatter(x_positions, high, s=10, alpha=0.6, color='darkblue', rasterized=True)
+
+	ax.set_ylabel('Peak Coverage Depth')
+	ax.set_title(f'PEAK: {len(peaks)} peaks')
+	ax.grid(True, alpha=0.3)
+	ax.legend()
+	if show_levels:
+		levels = pack_levels(start, end)
+		draw_levels(axlevels, start, end, peaks['probability'].to_numpy(), levels, len(coverage))
+		axlevels.set_xlabel('Genomic Position (bp)')
+		print(f"Pileup complete: {len(peaks)} peaks -> {levels.max() + 1 if len(levels) > 0 else 0} levels")
+	else:
+		ax.set_xlabel('Genomic Position (bp)')
+	ax.set_xlim(0, max(len(coverage), 1))
+
+	if not show_levels:
+		fig.tight_layout()
+	fig.savefig(output_file, dpi=300, bbox_inches='tight')
+	plt.close(fig)
 	return
 
 if __name__ == "__main__":
@@ -2,13 +2,19 @@ import argparse
 import os
 import sys
 import logging
-import pandas as pd
-import simulation
 
 currentDir = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(currentDir)
 
-def parseArgv():
+def loadSimulation():
+    # The engine modules sit next to this file. They (and numpy) are imported
+    # on first use, so importing main or running --help does not load them
+    if currentDir not in sys.path:
+        sys.path.append(currentDir)
+    import simulation
+    return(simulation)
+
+def parseArgv(argv=None):
+    # argv defaults to sys.argv[1:]; runner.py passes the options of each workflow sample
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
 
@@ -16,7 +22,34 @@ def parseArgv():
     parser.add_argument('-i','--fasta', type=str, help='Path to the FASTA file')
     parser.add_argument('-s','--sigma', type=float, help='sigma value [0.07]')
     parser.add_argument('-a','--a', type=float, help='a value [10]')
-    args = parser.parse_args()
+    parser.add_argument('-b','--bed', type=str, help='BED file of regions to simulate from the indexed FASTA file')
+    parser.add_argument('-e','--energy', type=str, help='dinucleotide energy CSV [energy.csv]')
+    parser.add_argument('--top', type=int, help='only output the TOP most probable structures')
+    parser.add_argument('--power-threshold', type=float, help='only output structures with probability >= 10^-POWER_THRESHOLD')
+    parser.add_argument('--profile', nargs='?', const='bedgraph', choices=['bedgraph', 'npy'], help='also write the per-base R-loop probability profile (rlooper_profile.bedgraph or .npz)')
+    parser.add_argument('--profile-only', action='store_true', help='write only the profile, without the structure table and peaks')
+    parser.add_argument('--window-size', type=float, help='windowed mode: split the sequence into domains of WINDOW_SIZE kb simulated independently (larger than the maximum R-loop length + 2 bases)')
+    parser.add_argument('--auto-domain-size', action='store_true', help='windowed mode with one domain per rloop_model.N bases')
+    parser.add_argument('-t','--threads', type=int, help='worker processes for the vectorized engine, not used by --stream or --peaks-only [1]')
+    parser.add_argument('--sweep-sigma', type=str, help='comma-separated sigma values for a parameter sweep (rlooper_sweep.csv)')
+    parser.add_argument('--sweep-a', type=str, help='comma-separated a values for a parameter sweep')
+    parser.add_argument('--output-format', choices=['tsv', 'parquet', 'feather', 'npz'], help='format of the structure table rlooper_output [tsv]')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], help='compress the tsv structure table (rlooper_output.csv.gz or .zst)')
+    parser.add_argument('--peaks-only', action='store_true', help='sample peaks in one engine pass without building or writing the structure table')
+    parser.add_argument('--stream', action='store_true', help='write the structure table block by block instead of holding it in memory (two engine passes)')
+    parser.add_argument('--npeak', type=int, help='peaks sampled per replicate from each structure table, i.e. per domain in windowed mode [50]')
+    parser.add_argument('--replicates', type=int, help='independent peak replicates [1]')
+    parser.add_argument('--seed', type=int, help='seed of the peak replicate streams [0]')
+    parser.add_argument('--peak-format', choices=['csv', 'bed'], help='rlooper_peaks.csv or compact BED6+1 rlooper_peaks.bed [csv]')
+    parser.add_argument('--batch', action='store_true', help='run the records on a pool of THREADS worker processes, longest first')
+    parser.add_argument('--batch-output', choices=['combined', 'per-gene'], help='batch mode: combined output files or one directory per record [combined]')
+    parser.add_argument('--cache', type=str, help='directory of a result cache: records simulated before with the same sequence, parameters and energy table are read from it')
+    parser.add_argument('--cache-size', type=float, help='size cap of the result cache in GB, least recently used entries are removed first; cached output files are a second full copy of every output [10]')
+    parser.add_argument('--band-cache', type=str, help='directory of memory-mapped sequence bands (Gbp), reused by later runs on the same sequence and energy table with any sigma or a')
+    parser.add_argument('--naive', action='store_true', help='use the reference per-structure loop instead of the vectorized engine')
+    parser.add_argument('-v','--verbose', action='store_true', help='log progress of the engine')
+    args = parser.parse_args(argv)
+    simulation = loadSimulation()
 
     if args.fasta:
         fastaFile = args.fasta
@@ -29,18 +62,72 @@ def parseArgv():
         logger.info(f' a: {a}')
     mysim = simulation.simulation_params()
     mysim.setFastaFile(args.fasta)
-    mysim.setSigma(args.sigma)
-    mysim.seta(args.a)
+    if args.sigma is not None:
+        mysim.setSigma(args.sigma)
+    if args.a is not None:
+        mysim.seta(args.a)
+    if args.bed is not None:
+        mysim.setBedFile(args.bed)
+    if args.energy is not None:
+        mysim.setEnergyFile(args.energy)
+    if args.top is not None:
+        mysim.top = args.top
+    if args.power_threshold is not None:
+        mysim.power_threshold = args.power_threshold
+        mysim.threshold_flag = True
+    if args.profile is not None:
+        mysim.profile_flag = True
+        mysim.profile_format = args.profile
+    mysim.profile_only_flag = args.profile_only
+    if args.window_size is not None:
+        mysim.dynamic_window_size = args.window_size
+        mysim.dynamic_flag = True
+    if args.auto_domain_size:
+        mysim.auto_domain_size = True
+        mysim.dynamic_flag = True
+    if args.threads is not None:
+        mysim.threads = args.threads
+    if args.sweep_sigma is not None:
+        mysim.sweep_sigmas = [float(x) for x in args.sweep_sigma.split(',')]
+    if args.sweep_a is not None:
+        mysim.sweep_as = [float(x) for x in args.sweep_a.split(',')]
+    if args.output_format is not None:
+        mysim.output_format = args.output_format
+    if args.compression is not None:
+        mysim.compression = args.compression
+    mysim.stream_flag = args.stream
+    mysim.peaks_only_flag = args.peaks_only
+    if args.npeak is not None:
+        mysim.npeak = args.npeak
+    if args.replicates is not None:
+        mysim.replicates = args.replicates
+    if args.seed is not None:
+        mysim.seed = args.seed
+    if args.peak_format is not None:
+        mysim.peak_format = args.peak_format
+    mysim.batch_flag = args.batch
+    if args.batch_output is not None:
+        mysim.batch_output = args.batch_output
+    if args.cache is not None:
+        mysim.cache_dir = args.cache
+    if args.cache_size is not None:
+        mysim.cache_size = args.cache_size
+    if args.band_cache is not None:
+        mysim.band_dir = args.band_cache
+    mysim.naive_flag = args.naive
+    mysim.verbose_flag = args.verbose
 
     return(mysim)
 
 
 def main():
     mysim = parseArgv()
+    simulation = loadSimulation()
     myres = simulation.simulation_main(mysim)
     print(myres)
 
-main()
+if __name__ == "__main__":
+    main()
 
 
 
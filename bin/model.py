@@ -1,104 +1,83 @@
 import os
 import sys
 import logging 
+import structure
 
-class rloop_model():
+class rloop_model(structure.Record):
+    """Immutable set of R-loop model parameters.
 
-    nick = -1
-    nicklen = 1
-    selffoldlen=0
-    maxLength=2000
-    N = 1500 #1500bp is the experimentally determined length of the (-) sc domain after the transcription machinery
-    A = 1/10.4 # turns/bp
-    C = 1.8 #tortional stiffness of ssDNA winding. (Could be 3.6 for ds or 1.8 for ss winding)
-    T = 310
-    k = (2200 * 0.0019858775 * T) / N #Hooke's law coefficient: (2200*ideal_gas_constant in kcal/mol*absolute_temp_in_kelvin)/N
-    a = 10 #Nucleation Free Energy in Kcals (~3-10.2kCals) 5000
-    currSim = 0
-    iter = 0
-    sigma = -0.07 # measurement of energy upstream of replication domain
-    alpha = N*sigma*A # linking difference: topological parameter
-    ambient_sigma = sigma
-    ambient_alpha = N * A * ambient_sigma
-    tx_ambient_sigma = -0.07 #  transcriptional sigma
-    tx_ambient_alpha = 0
-    tx_alpha = 0
-    tx_sigma = 0
-    sigma_total = ambient_sigma
-    alpha_total = ambient_alpha
-    selffoldlen = 0
+    Parameters are passed as keywords (rloop_model(sigma=-0.05, a=8)) and
+    the derived quantities (k, alpha and the ambient/total values) are
+    computed once in __init__. Use replace() for a model with different
+    parameters; instances are never modified, so one model can be shared
+    by concurrent simulations.
+    """
+
+    __slots__ = ('nick', 'nicklen', 'selffoldlen', 'maxLength', 'N', 'A', 'C', 'T', 'a', 'sigma',
+                 'tx_ambient_sigma', 'tx_ambient_alpha', 'tx_alpha', 'tx_sigma',
+                 'k', 'alpha', 'ambient_sigma', 'ambient_alpha', 'sigma_total', 'alpha_total')
+    fields = {
+        'nick': -1,
+        'nicklen': 1,
+        'selffoldlen': 0,
+        'maxLength': 2000,
+        'N': 1500, #1500bp is the experimentally determined length of the (-) sc domain after the transcription machinery
+        'A': 1/10.4, # turns/bp
+        'C': 1.8, #tortional stiffness of ssDNA winding. (Could be 3.6 for ds or 1.8 for ss winding)
+        'T': 310,
+        'a': 10, #Nucleation Free Energy in Kcals (~3-10.2kCals) 5000
+        'sigma': -0.07, # measurement of energy upstream of replication domain
+        'tx_ambient_sigma': -0.07, #  transcriptional sigma
+        'tx_ambient_alpha': 0,
+        'tx_alpha': 0,
+        'tx_sigma': 0,
+    }
+
+    # Primary parameters, e.g. to rebuild the model in a worker process
+    parameters = list(fields)
+
+    def __init__(self, **values):
+        super().__init__(**values)
+        derive = lambda name, value: object.__setattr__(self, name, value)
+        derive('k', (2200 * 0.0019858775 * self.T) / self.N) #Hooke's law coefficient: (2200*ideal_gas_constant in kcal/mol*absolute_temp_in_kelvin)/N
+        derive('alpha', self.N * self.sigma * self.A) # linking difference: topological parameter
+        derive('ambient_sigma', self.sigma)
+        derive('ambient_alpha', self.N * self.A * self.ambient_sigma)
+        derive('sigma_total', self.ambient_sigma)
+        derive('alpha_total', self.ambient_alpha)
+
+    def getParameters(self):
+        return(self.getFields())
+    @classmethod
+    def fromParameters(cls, params):
+        return(cls(**params))
 
-    def setSelffoldlen(self,length):
-        rloop_model.selffoldlen = length
     def getSelffoldlen(self):
-        return(rloop_model.selffoldlen)
-    
-    def setMaxLength(self,length):
-        rloop_model.maxLength = length
+        return(self.selffoldlen)
     def getMaxLength(self):
-        return(rloop_model.maxLength)
-    
-    def seta(self,a):
-        rloop_model.a = a
+        return(self.maxLength)
     def geta(self):
-        return(rloop_model.a)
-    
-    def setnick(self,n):
-        rloop_model.nick = n
-        rloop_model.nicklen = 1
+        return(self.a)
     def getnick(self):
-        return(rloop_model.nick)  
-
-    def setnicklen(self,nicklen):
-        rloop_model.nicklen = nicklen
+        return(self.nick)  
     def getnicklen(self):
-        return(rloop_model.nicklen)
-
-    def setN(self,N):
-        rloop_model.N = N
-        rloop_model.setAlpha(rloop_model,rloop_model.N*rloop_model.sigma*rloop_model.A)
-        rloop_model.k = (2200 * 0.0019858775 * rloop_model.T) / rloop_model.N
+        return(self.nicklen)
     def getN(self):
-        return(rloop_model.N)
-
-    def setSigma(self,s):
-        rloop_model.sigma = s
-        rloop_model.setAlpha(rloop_model,rloop_model.N*rloop_model.sigma*rloop_model.A)
+        return(self.N)
     def getSigma(self):
-        return(rloop_model.sigma)
-
-    def setAlpha(self,alpha):
-        rloop_model.alpha = alpha
+        return(self.sigma)
     def getAlpha(self):
-        return(rloop_model.alpha)
-
-    def setK(self,k):
-        rloop_model.k = k
+        return(self.alpha)
     def getK(self):
-        return(rloop_model.k)
-
-    def setA(self,A):
-        rloop_model.A = A
-        rloop_model.setAlpha(rloop_model.N*rloop_model.sigma*rloop_model.A)
+        return(self.k)
     def getA(self):
-        return(rloop_model.A)
-
-    def setC(self,C):
-        rloop_model.C = C
+        return(self.A)
     def getC(self):
-
-        return(rloop_model.C)
-    def setT(self,T):
-        rloop_model.T = T
-        rloop_model.k = (2200 * 0.0019858775 * rloop_model.T) / rloop_model.N
+        return(self.C)
     def getT(self):
-        return(rloop_model.T)
-
-    def setSuperhelicty(self,sigma):
-        rloop_model.sigma = sigma
-        rloop_model.setAlpha(rloop_model.N*rloop_model.sigma*rloop_model.A)
+        return(self.T)
     def getSuperhelicity(self):
-        return(rloop_model.sigma)
+        return(self.sigma)
     
     def join(self,mylist,delim):
         if (delim == None):
@@ -128,7 +107,3 @@ class rloop_model():
         else:
             dist += (b1-b0)
         return(dist)
-        
-    
-
-
@@ -0,0 +1,261 @@
+import os
+import sys
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import model
+import peaks
+import result
+import simulation
+
+logger = logging.getLogger(__name__)
+
+# Process pools reused across records and domains, keyed by worker count
+executors = {}
+
+def getExecutor(threads):
+    if threads not in executors:
+        executors[threads] = ProcessPoolExecutor(max_workers=threads)
+    return(executors[threads])
+
+def attachSharedMemory(name):
+    # Attaching in a worker must not register the block with the resource
+    # tracker, or it would be unlinked (or reported as leaked) when the
+    # worker exits; the parent owns and unlinks it
+    try:
+        return(shared_memory.SharedMemory(name=name, track=False))
+    except TypeError:
+        # Python < 3.13: skip registration while attaching
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return(shared_memory.SharedMemory(name=name))
+        finally:
+            resource_tracker.register = register
+
+class SharedArrays():
+    """NumPy arrays placed in multiprocessing.shared_memory blocks.
+
+    The parent creates the arrays and passes getSpec() to workers, which
+    map the same memory with attach() instead of receiving pickled copies.
+    """
+
+    def __init__(self):
+        self.blocks = {}
+        self.arrays = {}
+
+    def create(self, name, shape, dtype):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self.blocks[name] = block
+        self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return(self.arrays[name])
+
+    def share(self, name, values):
+        values = np.asarray(values)
+        array = self.create(name, values.shape, values.dtype)
+        array[...] = values
+        return(array)
+
+    def getSpec(self):
+        return({name: (self.blocks[name].name, array.shape, array.dtype.str) for name, array in self.arrays.items()})
+
+    @staticmethod
+    def attach(spec):
+        shared = SharedArrays()
+        for name, (blockname, shape, dtype) in spec.items():
+            block = attachSharedMemory(blockname)
+            shared.blocks[name] = block
+            shared.arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        return(shared)
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+
+    def unlink(self):
+        self.close()
+        for block in self.blocks.values():
+            block.unlink()
+        self.blocks = {}
+
+def splitStarts(counts, start, stop, chunks):
+    # Cut [start, stop) into up to `chunks` ranges holding about the same number of structures
+    total = counts.sum()
+    if total == 0 or chunks <= 1:
+        return([(start, stop)])
+    cumulative = np.cumsum(counts)
+    cuts = np.searchsorted(cumulative, np.linspace(0, total, chunks + 1)[1:-1], side='right')
+    bounds = np.unique(np.concatenate(([0], cuts, [len(counts)])))
+    return([(start + int(b0), start + int(b1)) for b0, b1 in zip(bounds[:-1], bounds[1:])])
+
+def stream_worker(task):
+    """Run one start range of the band in a worker process.
+
+    Returns the partial log partition function plus the partial profile and
+    pruned candidates; full structure tables are written straight into the
+    shared output columns.
+    """
+    mymodel = model.rloop_model.fromParameters(task['model'])
+    shared = SharedArrays.attach(task['inputs'])
+    try:
+        energy = simulation.energyTable(matrix=shared.arrays['energy'])
+        collectors = list()
+        table = None
+        profile = None
+        if task['table'] == 'full':
+            output = SharedArrays.attach(task['outputs'])
+            offset, size = task['offset'], task['size']
+            table = result.StructureTable.fromColumns({name: array[offset:offset + size] for name, array in output.arrays.items()})
+        elif task['table'] == 'pruned':
+            table = result.PrunedStructureTable(*task['pruned'])
+        if task['profile']:
+            profile = result.ProbabilityProfile(len(shared.arrays['codes']))
+        collectors = [c for c in (table, profile) if c is not None]
+        own0, own1 = task['owned']
+        if (own0, own1) != (0, len(shared.arrays['codes'])):
+            collectors = [result.StartRangeFilter(c, own0, own1) for c in collectors]
+        start, stop = task['range']
+        band = None
+        if task['band'] is not None:
+            import sweep
+            band = sweep.SequenceBand.open(task['band'])
+        bftotal = simulation.stream_rlooper(shared.arrays['codes'], mymodel, start, stop, collectors, False, energy,
+                                            Gsigma=shared.arrays['Gsigma'], myindex=task['index'], normalize=False, band=band)
+        if task['table'] == 'full':
+            del table
+            output.close()
+        return({'logZ': bftotal.getLogZ(),
+                'profile': profile,
+                'pruned': table if task['table'] == 'pruned' else None})
+    finally:
+        shared.close()
+
+def sample_worker(task):
+    """Draw the peaks that fall into one start range of the band in a worker process.
+
+    task['targets'] are sorted uniforms already scaled to probability and
+    shifted by the probability of the ranges before this one; returns
+    their n, m and probability columns in the same order.
+    """
+    mymodel = model.rloop_model.fromParameters(task['model'])
+    shared = SharedArrays.attach(task['inputs'])
+    try:
+        energy = simulation.energyTable(matrix=shared.arrays['energy'])
+        sampler = result.StreamPeakSampler(np.asarray(task['targets']).reshape(1, -1))
+        collector = result.StructureStream(task['logZ'], [sampler])
+        own0, own1 = task['owned']
+        if (own0, own1) != (0, len(shared.arrays['codes'])):
+            collector = result.StartRangeFilter(collector, own0, own1)
+        band = None
+        if task['band'] is not None:
+            import sweep
+            band = sweep.SequenceBand.open(task['band'])
+        start, stop = task['range']
+        simulation.stream_rlooper(shared.arrays['codes'], mymodel, start, stop, [collector], False, energy,
+                                  Gsigma=shared.arrays['Gsigma'], myindex=task['index'], normalize=False, band=band)
+        return(sampler.getPeaks())
+    finally:
+        shared.close()
+
+def sample_ranges(tasks, weights, logZ, targets, threads):
+    """Peaks drawn from the full band of a pruned run, one start range per worker.
+
+    weights are the log weights of the owned structures of every range of
+    tasks (from the first pass). Each sorted target goes to the range whose
+    share of the cumulative probability holds it, so the draws are those of
+    peaks.samplePeaks on the full table, however the band is split.
+    """
+    flat = targets.reshape(-1)
+    order = np.argsort(flat, kind='stable')
+    bounds = np.cumsum(np.exp(np.asarray(weights) - logZ))
+    scaled = flat[order] * bounds[-1]
+    cuts = np.searchsorted(scaled, bounds[:-1], side='right')
+    cuts = np.concatenate(([0], cuts, [len(scaled)]))
+    before = np.concatenate(([0.0], bounds[:-1]))
+    jobs = list()
+    for task, t0, t1, offset in zip(tasks, cuts[:-1], cuts[1:], before):
+        if t1 > t0:
+            jobs.append(dict(task, targets=scaled[t0:t1] - offset, logZ=logZ))
+    parts = [part for part in getExecutor(threads).map(sample_worker, jobs) if part is not None]
+    if len(parts) == 0:
+        return(None)
+    mypeaks = dict()
+    for name in ('n', 'm', 'probability'):
+        mypeaks[name] = np.empty(len(flat), dtype=parts[0][name].dtype)
+        # Back from target order to (replicate, draw) order
+        mypeaks[name][order] = np.concatenate([part[name] for part in parts])
+    mypeaks['replicate'] = np.repeat(np.arange(targets.shape[0], dtype=np.int32), targets.shape[1])
+    return(mypeaks)
+
+def simulate_domain(codes, mymodel, start, stop, energy, mysim, targets=None):
+    """Parallel counterpart of simulation.simulate_domain over mysim.threads processes.
+
+    The band of the domain is split into start ranges of similar size; the
+    encoded sequence, Gsigma vector and energy matrix are shared with the
+    workers through shared memory, and full structure tables are filled in
+    place in a shared buffer. Partial partition functions, profiles and
+    pruned tables are merged exactly before normalizing. Peaks of pruned
+    runs are drawn from the full band in a second parallel pass.
+    """
+    length = len(codes)
+    RT = 0.0019858775 * mymodel.getT()
+    energy = simulation.loadEnergyTable(energy)
+    myres, profile = simulation.makeCollectors(mysim, mymodel, length, start, stop)
+    starts, counts = simulation.computeBandCounts(length, mymodel, 0, length)
+    owned = np.where((starts >= start) & (starts < stop), counts, 0)
+    ownedbefore = np.concatenate(([0], np.cumsum(owned)))
+    allbefore = np.concatenate(([0], np.cumsum(counts)))
+
+    inputs = SharedArrays()
+    outputs = SharedArrays()
+    try:
+        inputs.share('codes', np.ascontiguousarray(codes, dtype=np.uint8))
+        inputs.share('Gsigma', simulation.computeGsigma(mymodel, length))
+        inputs.share('energy', energy.matrix)
+        tabletype = None
+        if isinstance(myres, result.PrunedStructureTable):
+            tabletype = 'pruned'
+        elif myres is not None:
+            tabletype = 'full'
+            for name, dtype in result.StructureTable.dtypes.items():
+                outputs.create(name, (myres.size,), dtype)
+        # A stored band is mapped by every worker from its files rather than shared
+        band = simulation.sequenceBand(codes, mymodel, energy, mysim)
+        bandpath = band.path if band is not None else None
+        tasks = list()
+        for s0, s1 in splitStarts(counts, 0, length, 4 * mysim.threads):
+            tasks.append({'model': mymodel.getParameters(), 'inputs': inputs.getSpec(), 'outputs': outputs.getSpec(),
+                          'range': (s0, s1), 'owned': (start, stop), 'index': int(allbefore[s0]) + 1,
+                          'table': tabletype, 'offset': int(ownedbefore[s0]), 'size': int(ownedbefore[s1] - ownedbefore[s0]),
+                          'pruned': (mysim.top, mysim.getProbabilityThreshold()), 'profile': profile is not None, 'band': bandpath})
+
+        bftotal = simulation.partitionFunction()
+        weights = list()
+        for part in getExecutor(mysim.threads).map(stream_worker, tasks):
+            bftotal.merge(simulation.partitionFunction(part['logZ']))
+            if profile is not None:
+                profile.merge(part['profile'])
+            if tabletype == 'pruned':
+                weights.append(part['pruned'].seenLogZ)
+                myres.merge(part['pruned'])
+        if tabletype == 'full':
+            for name, column in myres.columns.items():
+                column[:] = outputs.arrays[name]
+            myres.count = myres.size
+        for collector in (myres, profile):
+            if collector is not None:
+                collector.normalize(bftotal.getLogZ(), RT)
+        mypeaks = None
+        if targets is not None and tabletype == 'full':
+            mypeaks = peaks.samplePeaks(myres, targets)
+        elif targets is not None and tabletype == 'pruned' and np.isfinite(myres.seenLogZ):
+            mypeaks = sample_ranges(tasks, weights, bftotal.getLogZ(), targets, mysim.threads)
+    finally:
+        inputs.unlink()
+        outputs.unlink()
+    return(myres, profile, mypeaks)
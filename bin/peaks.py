@@ -0,0 +1,111 @@
+import os
+import sys
+import zlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Peak file formats and their file names
+PEAK_FILES = {
+    'csv': "rlooper_peaks.csv",
+    'bed': "rlooper_peaks.bed",
+}
+
+def peakStreams(seed, gene_name, offset, replicates):
+    """One random Generator per replicate for the peaks of a record (or domain).
+
+    The streams are spawned from a SeedSequence keyed by the simulation
+    seed, the record name and the domain offset, so every replicate is
+    reproducible on its own, whichever process draws it and in what order.
+    """
+    root = np.random.SeedSequence([seed, zlib.crc32(gene_name.encode()), offset])
+    return([np.random.default_rng(child) for child in root.spawn(replicates)])
+
+def drawTargets(generators, npeak):
+    """(replicates, npeak) uniform targets on [0, 1), one row per replicate stream."""
+    targets = np.empty((len(generators), npeak), dtype=np.float64)
+    for replicate, generator in enumerate(generators):
+        generator.random(out=targets[replicate])
+    return(targets)
+
+class PeakSampler():
+    """Inverse-CDF sampler over the probabilities of a structure table.
+
+    The cumulative distribution is built once; each batch of uniform
+    targets is then mapped to rows with a single searchsorted, so millions
+    of draws cost one vectorized pass.
+    """
+
+    def __init__(self, probability):
+        self.cdf = np.cumsum(probability, dtype=np.float64)
+        self.total = self.cdf[-1] if len(self.cdf) > 0 else 0.0
+
+    def sample(self, targets):
+        rows = np.searchsorted(self.cdf, np.asarray(targets) * self.total, side='right')
+        # Targets at the very top of [0, 1) can land past the last row through rounding
+        return(np.minimum(rows, len(self.cdf) - 1))
+
+def samplePeaks(myres, targets):
+    """Peaks drawn from the structure table myres for a (replicates, npeak) target array.
+
+    myres is a dict of columns (or a DataFrame). Returns a dict of n, m,
+    probability and replicate columns, or None for an empty table.
+    """
+    probability = np.asarray(myres['probability'])
+    if len(probability) == 0 or targets.size == 0:
+        return(None)
+    # Draws are exchangeable, so each replicate's targets are sorted first:
+    # searchsorted on increasing keys is an order of magnitude faster
+    rows = PeakSampler(probability).sample(np.sort(targets, axis=1)).reshape(-1)
+    peaks = {name: np.asarray(myres[name])[rows] for name in ('n', 'm', 'probability')}
+    peaks['replicate'] = np.repeat(np.arange(targets.shape[0], dtype=np.int32), targets.shape[1])
+    return(peaks)
+
+# BED scores are the probability scaled to the 0-1000 integer range of the format
+BED_SCORE_SCALE = 1000
+
+# Peak lines joined and written per chunk
+PEAK_CHUNK_LINES = 1 << 20
+
+def printpeaks(peaks, gene_name, append=False, outdir=".", fmt="csv", strand="+"):
+    """Append peaks to rlooper_peaks.csv (or compact BED6+1 rlooper_peaks.bed).
+
+    Peaks are sorted by replicate, start and end; strand is that of the
+    record. The csv keeps its historical columns, plus a replicate column
+    when there is more than one replicate. In the BED file the name field
+    is the replicate, the score field the probability in thousandths
+    (0-1000, as BED requires an integer) and a seventh column the
+    probability itself. Draws repeat the same structures many times, so
+    every distinct structure is formatted once and its text reused.
+    """
+    start = np.asarray(peaks['n']).astype(np.int64)
+    span = np.asarray(peaks['m']).astype(np.int64) + 1
+    replicate = np.asarray(peaks['replicate'])
+    order = np.lexsort((span, start, replicate))
+    start, span, replicate = start[order], span[order], replicate[order]
+    probability = np.asarray(peaks['probability'])[order]
+    keys, first, inverse = np.unique(start * (int(span.max()) + 1) + span, return_index=True, return_inverse=True)
+    ustart, uend, uprob = start[first].tolist(), (start + span)[first].tolist(), probability[first].tolist()
+    replicates = [str(r) for r in range(int(replicate.max()) + 1)]
+    if fmt == 'bed':
+        heads = [f"{gene_name}\t{s}\t{e}\t" for s, e in zip(ustart, uend)]
+        scores = np.minimum(np.rint(probability[first] * BED_SCORE_SCALE), BED_SCORE_SCALE).astype(np.int64).tolist()
+        tails = [f"\t{score}\t{strand}\t{p:.6g}\n" for score, p in zip(scores, uprob)]
+        header = None
+        line = lambda i, r: heads[i] + replicates[r] + tails[i]
+    else:
+        heads = [f"{gene_name}\t{s}\t{e}\t{p!r}\t{e - s - 1}\t{strand}" for s, e, p in zip(ustart, uend, uprob)]
+        if len(replicates) > 1:
+            header = "chr\tstart\tend\tprobability\tm\tstrand\treplicate\n"
+            line = lambda i, r: heads[i] + "\t" + replicates[r] + "\n"
+        else:
+            header = "chr\tstart\tend\tprobability\tm\tstrand\n"
+            line = lambda i, r: heads[i] + "\n"
+    inverse = inverse.reshape(-1).tolist()
+    replicate = replicate.tolist()
+    with open(os.path.join(outdir, PEAK_FILES[fmt]), "a" if append else "w") as f:
+        if header is not None and not append:
+            f.write(header)
+        for c0 in range(0, len(inverse), PEAK_CHUNK_LINES):
+            f.write("".join([line(i, r) for i, r in zip(inverse[c0:c0 + PEAK_CHUNK_LINES], replicate[c0:c0 + PEAK_CHUNK_LINES])]))
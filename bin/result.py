@@ -0,0 +1,430 @@
+import os
+import sys
+import logging
+import numpy as np
+
+
+class StructureTable():
+    """Columnar store for simulated R-loop structures.
+
+    Every column is a NumPy array preallocated to the number of (n, m)
+    structures in the band, so engines fill it in place; getColumns() hands
+    them on as a dict of arrays and a DataFrame is only built (and pandas
+    imported) when toDataFrame() is called.
+    """
+
+    dtypes = {
+        'index': np.int64,
+        'n': np.int64,
+        'm': np.int32,
+        'Gsigma': np.float64,
+        'Gbp': np.float64,
+        'a': np.float64,
+        'G': np.float64,
+        'bf': np.float64,
+        'probability': np.float64,
+    }
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.logZ = None
+        self.columns = {name: np.empty(size, dtype=dtype) for name, dtype in StructureTable.dtypes.items()}
+
+    @classmethod
+    def fromColumns(cls, columns):
+        # Empty table writing into existing arrays (e.g. a slice of shared memory)
+        table = cls(0)
+        table.columns = dict(columns)
+        table.size = len(table.columns['n'])
+        return(table)
+
+    def __len__(self):
+        return(self.count)
+
+    def __getitem__(self, name):
+        return(self.getColumn(name))
+
+    def getColumn(self, name):
+        return(self.columns[name][:self.count])
+
+    def appendRow(self, **row):
+        if self.count >= self.size:
+            raise IndexError(f"StructureTable is full ({self.size} rows)")
+        for name, value in row.items():
+            self.columns[name][self.count] = value
+        self.count += 1
+
+    def appendBlock(self, block):
+        length = len(block['n'])
+        if self.count + length > self.size:
+            raise IndexError(f"StructureTable is full ({self.size} rows)")
+        for name, column in self.columns.items():
+            if name in block:
+                column[self.count:self.count + length] = block[name]
+        self.count += length
+
+    def normalize(self, logZ, RT):
+        # probability = exp(-G/RT - log Z), which stays finite even when bf itself under- or overflows
+        self.logZ = logZ
+        probability = self.getColumn('probability')
+        np.divide(self.getColumn('G'), -RT, out=probability)
+        probability -= logZ
+        with np.errstate(under='ignore'):
+            np.exp(probability, out=probability)
+
+    def getColumns(self):
+        return({name: self.getColumn(name) for name in StructureTable.dtypes})
+
+    def toDataFrame(self):
+        import pandas as pd
+        return(pd.DataFrame(self.getColumns(), copy=False))
+
+
+class PrunedStructureTable(StructureTable):
+    """StructureTable that keeps only the most probable structures.
+
+    Structures are kept if their probability is at least threshold and/or
+    they are among the top most probable. Blocks are filtered as they
+    arrive: ranking by log Boltzmann factor does not depend on Z, and the
+    partition function seen so far is a lower bound of the final one, so
+    anything that fails the threshold against it can be dropped early.
+    The final filter uses the exact log Z passed to normalize().
+    """
+
+    def __init__(self, top=0, threshold=None):
+        super().__init__(0)
+        self.top = top
+        self.threshold = threshold
+        self.seenLogZ = -np.inf
+        self.candidates = {name: np.empty(0, dtype=dtype) for name, dtype in StructureTable.dtypes.items()}
+        self.candidates['logbf'] = np.empty(0, dtype=np.float64)
+
+    def appendBlock(self, block):
+        with np.errstate(over='ignore'):
+            self.seenLogZ = np.logaddexp(self.seenLogZ, np.logaddexp.reduce(block['logbf']))
+        length = len(block['n'])
+        candidates = {name: np.concatenate((values, block[name])) if name in block else np.concatenate((values, np.zeros(length, dtype=values.dtype)))
+                      for name, values in self.candidates.items()}
+        self.candidates = self.prune(candidates, self.seenLogZ)
+
+    def merge(self, other):
+        # Combine with the candidates of another table over a different start range
+        self.seenLogZ = np.logaddexp(self.seenLogZ, other.seenLogZ)
+        candidates = {name: np.concatenate((values, other.candidates[name])) for name, values in self.candidates.items()}
+        order = np.argsort(candidates['index'], kind='stable')
+        self.candidates = self.prune({name: values[order] for name, values in candidates.items()}, self.seenLogZ)
+
+    def prune(self, candidates, logZ):
+        keep = None
+        if self.threshold is not None:
+            keep = np.flatnonzero(candidates['logbf'] >= logZ + np.log(self.threshold))
+        if self.top > 0:
+            logbf = candidates['logbf'] if keep is None else candidates['logbf'][keep]
+            if len(logbf) > self.top:
+                best = np.argpartition(logbf, len(logbf) - self.top)[len(logbf) - self.top:]
+                keep = best if keep is None else keep[best]
+        if keep is None:
+            return(candidates)
+        keep.sort()
+        return({name: values[keep] for name, values in candidates.items()})
+
+    def normalize(self, logZ, RT):
+        self.candidates = self.prune(self.candidates, logZ)
+        self.columns = {name: self.candidates[name] for name in StructureTable.dtypes}
+        self.size = self.count = len(self.columns['n'])
+        super().normalize(logZ, RT)
+
+
+class StructureStream():
+    """Collector that passes structures on block by block instead of storing them.
+
+    The final log Z must be known up front (from a first pass of the
+    engine), so every block leaves with its final probabilities and memory
+    stays at one block however many structures there are. Each consumer is
+    called with a dict of StructureTable columns.
+    """
+
+    def __init__(self, logZ, consumers):
+        self.logZ = logZ
+        self.consumers = consumers
+
+    def appendBlock(self, block):
+        if len(block['n']) == 0:
+            return
+        columns = {name: block[name] for name in StructureTable.dtypes if name in block}
+        with np.errstate(under='ignore'):
+            columns['probability'] = np.exp(block['logbf'] - self.logZ)
+        for consumer in self.consumers:
+            consumer(columns)
+
+    def normalize(self, logZ, RT):
+        pass
+
+
+class LogWeight():
+    """Collector of the log-sum-exp of the Boltzmann factors of every structure it is handed."""
+
+    def __init__(self):
+        self.logW = -np.inf
+
+    def appendBlock(self, block):
+        if len(block['logbf']) == 0:
+            return
+        top = np.max(block['logbf'])
+        with np.errstate(under='ignore'):
+            self.logW = float(np.logaddexp(self.logW, top + np.log(np.sum(np.exp(block['logbf'] - top)))))
+
+    def normalize(self, logZ, RT):
+        pass
+
+
+class StreamPeakSampler():
+    """Draws peaks by probability from streamed StructureStream blocks.
+
+    targets is a (replicates, npeak) array of uniforms (see
+    peaks.drawTargets) and total the probability of all structures that
+    will be streamed: below 1, as the ground state (and in windowed mode
+    the structures outside the owned starts) carries the rest. The targets
+    are scaled by total like in peaks.PeakSampler, sorted once and matched
+    against the running cumulative probability with searchsorted, so only
+    the picked rows are kept and the draws equal those of
+    peaks.samplePeaks on the full table up to rounding.
+    """
+
+    def __init__(self, targets, total=1.0):
+        self.shape = targets.shape
+        flat = targets.reshape(-1)
+        self.order = np.argsort(flat, kind='stable')
+        self.targets = flat[self.order] * total
+        self.drawn = 0
+        self.seen = 0.0
+        self.picks = []
+        self.last = None
+
+    def __call__(self, columns):
+        cumulative = self.seen + np.cumsum(columns['probability'])
+        self.seen = cumulative[-1]
+        self.last = {name: columns[name][-1:] for name in ('n', 'm', 'probability')}
+        if self.drawn == len(self.targets):
+            return
+        rows = np.searchsorted(cumulative, self.targets[self.drawn:], side='right')
+        rows = rows[rows < len(cumulative)]
+        if len(rows) > 0:
+            self.picks.append({name: columns[name][rows] for name in ('n', 'm', 'probability')})
+            self.drawn += len(rows)
+
+    def getPeaks(self):
+        picks = list(self.picks)
+        if self.drawn < len(self.targets) and self.last is not None:
+            # Rounding can leave the total probability a hair below the last targets
+            picks.append({name: np.repeat(values, len(self.targets) - self.drawn) for name, values in self.last.items()})
+        if len(picks) == 0:
+            return(None)
+        peaks = {name: np.empty(len(self.targets), dtype=picks[0][name].dtype) for name in picks[0]}
+        for name in peaks:
+            # Back from target order to (replicate, draw) order
+            peaks[name][self.order] = np.concatenate([pick[name] for pick in picks])
+        peaks['replicate'] = np.repeat(np.arange(self.shape[0], dtype=np.int32), self.shape[1])
+        return(peaks)
+
+
+class PeakReservoir():
+    """Collector that samples peaks in a single pass, without storing structures.
+
+    Every one of the npeak slots of each replicate is a weighted reservoir
+    of size one: when a block arrives, a slot switches to it with
+    probability (block weight) / (weight seen so far), and the structure it
+    switches to is drawn from the block by its Boltzmann factor. After the
+    last block each slot holds a structure drawn with probability
+    proportional to its weight, so the peaks follow the same distribution
+    as drawing npeak times (with replacement) from the full table. Only the
+    block weights are needed, not log Z, and memory is O(replicates x
+    npeak). generators holds one numpy Generator per replicate.
+    """
+
+    def __init__(self, generators, npeak):
+        self.generators = generators
+        self.npeak = npeak
+        shape = (len(generators), npeak)
+        self.n = np.zeros(shape, dtype=np.int64)
+        self.m = np.zeros(shape, dtype=np.int64)
+        self.logbf = np.full(shape, -np.inf)
+        self.logW = -np.inf
+        self.logZ = None
+
+    def appendBlock(self, block):
+        if len(block['n']) == 0 or self.npeak == 0:
+            return
+        top = np.max(block['logbf'])
+        with np.errstate(under='ignore'):
+            weight = np.exp(block['logbf'] - top)
+        cumulative = np.cumsum(weight)
+        logWblock = top + np.log(cumulative[-1])
+        logW = np.logaddexp(self.logW, logWblock)
+        switch = np.exp(logWblock - logW)
+        self.logW = logW
+        for replicate, generator in enumerate(self.generators):
+            count = generator.binomial(self.npeak, switch)
+            if count == 0:
+                continue
+            slots = generator.choice(self.npeak, count, replace=False)
+            rows = np.searchsorted(cumulative, generator.random(count) * cumulative[-1], side='right')
+            rows = np.minimum(rows, len(cumulative) - 1)
+            self.n[replicate, slots] = block['n'][rows]
+            self.m[replicate, slots] = block['m'][rows]
+            self.logbf[replicate, slots] = block['logbf'][rows]
+
+    def normalize(self, logZ, RT):
+        self.logZ = logZ
+
+    def getPeaks(self):
+        # Peaks as a dict of n, m, probability and replicate columns, or None if no structure was seen
+        if not np.isfinite(self.logW):
+            return(None)
+        with np.errstate(under='ignore'):
+            probability = np.exp(self.logbf - self.logZ).reshape(-1)
+        replicate = np.repeat(np.arange(len(self.generators), dtype=np.int32), self.npeak)
+        return({'n': self.n.reshape(-1), 'm': self.m.reshape(-1), 'probability': probability, 'replicate': replicate})
+
+
+class ProbabilityProfile():
+    """Per-base probability of lying inside an R-loop.
+
+    Structure (n, m) covers bases [n, n + m + 1), the same span as the
+    simulated peaks. Boltzmann weights are added to a difference array with
+    bincount, so memory is O(sequence length) however many structures are
+    streamed through. Weights are stored relative to the largest log
+    Boltzmann factor seen so far and rescaled when it grows.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.shift = -np.inf
+        self.delta = np.zeros(length + 1, dtype=np.float64)
+        self.logZ = None
+        self.values = None
+
+    def appendBlock(self, block):
+        if len(block['n']) == 0:
+            return
+        top = np.max(block['logbf'])
+        if top > self.shift:
+            if np.isfinite(self.shift):
+                self.delta *= np.exp(self.shift - top)
+            self.shift = top
+        weight = np.exp(block['logbf'] - self.shift)
+        self.delta += np.bincount(block['n'], weights=weight, minlength=self.length + 1)
+        self.delta -= np.bincount(block['n'] + block['m'] + 1, weights=weight, minlength=self.length + 1)
+
+    def merge(self, other):
+        # Add the weights of another profile over the same sequence
+        if not np.isfinite(other.shift):
+            return
+        if other.shift > self.shift:
+            if np.isfinite(self.shift):
+                self.delta *= np.exp(self.shift - other.shift)
+            self.shift = other.shift
+        self.delta += other.delta * np.exp(other.shift - self.shift)
+
+    def normalize(self, logZ, RT):
+        self.logZ = logZ
+        values = np.cumsum(self.delta[:self.length])
+        if np.isfinite(self.shift):
+            values *= np.exp(self.shift - logZ)
+        # Cancellation in the prefix sum can leave tiny negative values
+        np.clip(values, 0.0, None, out=values)
+        self.values = values
+
+    def getValues(self):
+        return(self.values)
+
+
+class StartRangeFilter():
+    """Collector wrapper that passes on only structures starting in [start, stop)."""
+
+    def __init__(self, collector, start, stop):
+        self.collector = collector
+        self.start = start
+        self.stop = stop
+
+    def appendBlock(self, block):
+        n = block['n']
+        if len(n) == 0 or (n[0] >= self.start and n[-1] < self.stop):
+            self.collector.appendBlock(block)
+            return
+        keep = (n >= self.start) & (n < self.stop)
+        if keep.any():
+            self.collector.appendBlock({name: values[keep] for name, values in block.items()})
+
+    def normalize(self, logZ, RT):
+        self.collector.normalize(logZ, RT)
+
+
+class Result():
+    """In-memory outcome of simulating one sequence (see api.simulate).
+
+    Holds the structure table and the sampled peaks as dicts of NumPy
+    columns in sequence coordinates, and the probability profile as an
+    array; any of them is None when it was not requested (e.g. columns
+    with peaks_only_flag or profile_only_flag). DataFrames with the chr
+    column of the output files are built, and pandas imported, only on the
+    first getStructures() or getPeaks() call.
+    """
+
+    def __init__(self, name, columns=None, peaks=None, profile=None):
+        self.name = name
+        self.columns = columns
+        self.peaks = peaks
+        self.profile = profile
+        self.frames = {}
+
+    @staticmethod
+    def concatenate(parts):
+        # One dict of columns from the per-domain (or per-block) dicts, or None if there are none
+        if len(parts) == 0:
+            return(None)
+        if len(parts) == 1:
+            return(dict(parts[0]))
+        return({name: np.concatenate([part[name] for part in parts]) for name in parts[0]})
+
+    def __len__(self):
+        return(len(self.columns['n']) if self.columns is not None else 0)
+
+    def getName(self):
+        return(self.name)
+
+    def getColumns(self):
+        return(self.columns)
+
+    def getPeakColumns(self):
+        return(self.peaks)
+
+    def getProfile(self):
+        return(self.profile)
+
+    def frame(self, key, columns):
+        if columns is None:
+            return(None)
+        if key not in self.frames:
+            import pandas as pd
+            frame = pd.DataFrame(columns, copy=False)
+            frame.insert(0, 'chr', self.name)
+            self.frames[key] = frame
+        return(self.frames[key])
+
+    def getStructures(self):
+        return(self.frame('structures', self.columns))
+
+    def getPeaks(self):
+        # Peaks with the start/end intervals of rlooper_peaks.csv next to their n and m
+        if self.peaks is None:
+            return(None)
+        start = np.asarray(self.peaks['n']).astype(np.int64)
+        end = start + np.asarray(self.peaks['m']).astype(np.int64) + 1
+        return(self.frame('peaks', dict(self.peaks, start=start, end=end)))
+
+    def __repr__(self):
+        return(f"Result({self.name!r}, {len(self)} structures, "
+               f"{len(self.peaks['n']) if self.peaks is not None else 0} peaks, "
+               f"profile {'yes' if self.profile is not None else 'no'})")
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import time
+import logging
+import contextlib
+import traceback
+import simulation
+import main
+
+logger = logging.getLogger(__name__)
+
+@contextlib.contextmanager
+def sampleLog(path):
+    """Send stdout, stderr and logging to the log file of one sample."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    root = logging.getLogger()
+    handlers = root.handlers
+    with open(path, "w") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        handler = logging.StreamHandler(log)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.handlers = [handler]
+        try:
+            yield log
+        finally:
+            root.handlers = handlers
+
+def energyFile():
+    # The table the cli uses: data/energy.csv of the installed package, else the usual default
+    packaged = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "energy.csv")
+    if os.path.exists(packaged):
+        return(packaged)
+    return(os.path.abspath(simulation.defaultEnergyFile()))
+
+def run_sample(job):
+    """Simulate (and plot) one workflow sample in this process.
+
+    job holds the sample name, the main.py options in argv, the absolute
+    output_dir the files are written to, its log file and, optionally, the
+    plot to draw from the sample's peaks. The outputs are the same files
+    the per-sample rules write.
+    """
+    argv = list(job['argv'])
+    if '-e' not in argv and '--energy' not in argv:
+        # One path for every sample, so the compiled table is reused
+        argv.extend(['-e', energyFile()])
+    os.makedirs(job['output_dir'], exist_ok=True)
+    with sampleLog(job['log']):
+        simulation.simulation_main(main.parseArgv(argv), outdir=job['output_dir'])
+        if job.get('plot'):
+            try:
+                import grapher
+                peaks = grapher.read_peaks(os.path.join(job['output_dir'], "rlooper_peaks.csv"))
+                grapher.graph_compressed_pileup(peaks, job['plot'])
+            except Exception:
+                # As in the create_peak_plots rule, a failed plot does not fail the sample
+                traceback.print_exc()
+                print("Plot creation failed but continuing workflow...")
+
+def run_batch(jobs):
+    """Run workflow samples one after another in one long-lived process.
+
+    Imports, the compiled energy table (cached per file) and the process
+    pools are set up once for the whole batch instead of once per sample.
+    Every sample is attempted; returns the names of those that failed.
+    """
+    failed = list()
+    began = time.perf_counter()
+    for done, job in enumerate(jobs, start=1):
+        started = time.perf_counter()
+        try:
+            run_sample(job)
+            status = "done"
+        except Exception:
+            with open(job['log'], "a") as log:
+                traceback.print_exc(file=log)
+            failed.append(job['sample'])
+            status = f"FAILED, see {job['log']}"
+        logger.info(f"[{done}/{len(jobs)}] {job['sample']}: {status} in {time.perf_counter() - started:.2f} s "
+                    f"(elapsed {time.perf_counter() - began:.1f} s)")
+    return(failed)
+
+def main_runner():
+    # python runner.py JOBS.json, where JOBS.json is a list of run_sample jobs
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2:
+        print("Usage: runner.py <jobs.json>", file=sys.stderr)
+        return(2)
+    with open(sys.argv[1]) as f:
+        jobs = json.load(f)
+    failed = run_batch(jobs)
+    if failed:
+        logger.error(f"{len(failed)} of {len(jobs)} samples failed: {', '.join(failed)}")
+        return(1)
+    return(0)
+
+if __name__ == "__main__":
+    sys.exit(main_runner())
@@ -1,55 +1,129 @@
 import os
 import sys
+import csv
 import logging
 import model
 import gene
+import result
+import tableio
+import peaks
+import cache
 import math
+import threading
+import functools
 from math import pi
-import pandas as pd
 import numpy as np
-from numpy import random
-from numpy.random import choice
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def bundledEnergyFile():
+	# The energy.csv shipped next to this module
+	return(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'energy.csv'))
+
+def defaultEnergyFile():
+	# energy.csv in the working directory wins, as before; otherwise the bundled copy
+	if os.path.exists('energy.csv'):
+		return('energy.csv')
+	return(bundledEnergyFile())
+
+def compileEnergyTable(energyFile):
+	"""Read a n1,n2,energy CSV into a 5x5 float matrix indexed by gene.BASES codes."""
+	matrix = np.zeros((len(gene.BASES), len(gene.BASES)), dtype=np.float64)
+	with open(energyFile, newline='') as f:
+		for row in csv.DictReader(f):
+			n1, n2 = row['n1'].strip().upper(), row['n2'].strip().upper()
+			if n1 in gene.BASES and n2 in gene.BASES:
+				matrix[gene.baseCode(n1), gene.baseCode(n2)] = float(row['energy'])
+	matrix.setflags(write=False)
+	return(matrix)
+
 class energyTable:
+	"""Immutable dinucleotide energy matrix, either compiled from a CSV file or given directly."""
+
+	__slots__ = ('energyFile', 'matrix')
+
+	# Compiled matrices keyed by (absolute path, mtime) so each file is parsed once per process
+	cache = {}
+	cacheLock = threading.Lock()
 
-	df = pd.DataFrame()
+	def __init__(self, energyFile=None, matrix=None):
+		if energyFile is not None:
+			energyFile, matrix = energyTable.parseEnergyTable(energyFile)
+		elif matrix is None:
+			matrix = np.zeros((len(gene.BASES), len(gene.BASES)), dtype=np.float64)
+		object.__setattr__(self, 'energyFile', energyFile)
+		object.__setattr__(self, 'matrix', matrix)
 
-	def parseEnergyTable(self,energyFile):
-		energyTable.df = pd.read_table(energyFile, delimiter=',')
+	def __setattr__(self, name, value):
+		raise AttributeError("energyTable is immutable")
+
+	def __reduce__(self):
+		return(energyTable, (None, self.matrix))
+
+	@staticmethod
+	def parseEnergyTable(energyFile):
+		# Returns (absolute path, read-only matrix) from the per-process cache
+		path = os.path.abspath(energyFile)
+		key = (path, os.path.getmtime(path))
+		with energyTable.cacheLock:
+			if key not in energyTable.cache:
+				energyTable.cache[key] = compileEnergyTable(path)
+			return(path, energyTable.cache[key])
 				
 	def getEnergy(self,n1, n2):
-		t0 = energyTable.df
-		t1 = t0[t0['n1'] == n1]
-		t2 = t1[t1['n2'] == n2]
-		energy = t2['energy']
-		if len(energy) == 0:
-			return(0)
-		else:
-			return(energy.values[0])
+		return(self.matrix[gene.baseCode(n1), gene.baseCode(n2)])
+
+	def getDinucleotideEnergies(self, codes):
+		# Energy of every step codes[i] -> codes[i+1] in one fancy-indexing pass
+		return(self.matrix[codes[:-1], codes[1:]])
+
+def loadEnergyTable(energy=None):
+	"""Return energy as an energyTable, compiling it from a path (or the default file) if needed."""
+	if isinstance(energy, energyTable):
+		return(energy)
+	return(energyTable(energy if energy is not None else defaultEnergyFile()))
 	
 class simulation_params():
 	fasta_file = "example.fasta"
 	minlength = 2
-	dynamic_window_size = 15
+	dynamic_window_size = 15 # kb, domain length in windowed mode (dynamic_flag)
 	reverse_flag = False
 	complement_flag = False
-	power_threshold = 1
+	power_threshold = 1 # with threshold_flag, keep structures with probability >= 10^-power_threshold
+	threshold_flag = False
+	profile_flag = False # also write the per-base R-loop probability profile
+	profile_only_flag = False # write only the profile, without the structure table and peaks
+	profile_format = "bedgraph" # or "npy"
+	peaks_only_flag = False # sample peaks in one engine pass, without the structure table
+	output_format = "tsv" # structure table format, one of tableio.OUTPUT_FORMATS
+	compression = None # "gzip" or "zstd" for the tsv structure table
+	stream_flag = False # write the structure table block by block (two engine passes) instead of storing it
 	circular_flag = False
-	auto_domain_size = False
+	auto_domain_size = False # windowed mode: each domain owns rloop_model.N bases
 	import_flag = False
-	top = 0
+	top = 0 # if > 0, keep only the top most probable structures
 	dump = False
 	average_g = True  # or False
-	seed = 0
-	dynamic_flag = False
+	seed = 0 # seeds the SeedSequence the peak replicate streams are spawned from
+	npeak = 50 # peaks sampled per replicate from each structure table
+	replicates = 1 # independent peak replicates, one random stream each
+	peak_format = "csv" # rlooper_peaks.csv, or compact BED6+1 rlooper_peaks.bed
+	dynamic_flag = False # split long sequences into independently simulated domains
 	naive_flag = False
+	threads = 1 # worker processes for the vectorized engine
+	sweep_sigmas = None # lists of sigma and a values for a parameter sweep
+	sweep_as = None
+	batch_flag = False # run the records on a process pool of threads workers, longest first
+	batch_output = "combined" # or "per-gene": one output directory per record
+	cache_dir = None # directory of a cache.ResultCache of simulated records
+	cache_size = 10 # GB, least recently used cache entries are removed beyond this
+	band_dir = None # directory of a sweep.BandStore of memory-mapped sequence bands
 	verbose_flag = False
 	orig_flag = False
 	sigma = 0.07
 	a = 10
+	energy_file = None
+	bed_file = None
 	def setFastaFile(self,filename):
 		self.fasta_file = filename
 	def getFastaFile(self):
@@ -62,12 +136,20 @@ class simulation_params():
 		self.a = a
 	def geta(self):
 		return(self.a)
+	def getProbabilityThreshold(self):
+		return(10.0 ** (-1 * self.power_threshold) if self.threshold_flag else None)
+	def setBedFile(self,filename):
+		self.bed_file = filename
+	def getBedFile(self):
+		return(self.bed_file)
+	def setEnergyFile(self,filename):
+		self.energy_file = filename
+	def getEnergyFile(self):
+		return(self.energy_file)
 		
-def naive_forloop_rlooper(sequence, model, start, stop, structure, bp_energy, verbose):
+def naive_forloop_rlooper(sequence, model, start, stop, structure, bp_energy, verbose, energy=None):
 
-	myres = pd.DataFrame()
-	df = energyTable()
-	df.parseEnergyTable('energy.csv')
+	df = loadEnergyTable(energy)
 	
 	Gsigma = list()
 	for m in range(0, len(sequence)):
@@ -77,105 +159,519 @@ def naive_forloop_rlooper(sequence, model, start, stop, structure, bp_energy, ve
 
 		Gsigma.append((2 * (pi**2) * model.getC() * model.getK() * (model.getAlpha() + mact * model.getA())**2) / (4 * (pi**2) * model.getC() + model.getK() * mact))
 
-	n1 = list()
-	n2 = list()
-	Gsigmas = list()
-	Gbps = list()
-	Gs = list()
-	bfs = list()
+	starts, counts = computeBandCounts(len(sequence), model, start, stop)
+	myres = result.StructureTable(int(counts.sum()))
 	myindex = 0
-	bftotal = 0.0
+	RT = 0.0019858775 * model.getT()
+	bftotal = partitionFunction()
 	Gs_m0 = (0 + 0 + Gsigma[0])
-	bf_m0 = math.exp(-1 * Gs_m0 / (0.0019858775 * model.getT()))
 
 	mya = model.geta()
 
 	for n in range(start, stop):
 		Gbp = 0.0
-		if n % 10 == 0:
-			logger.info(f"n: {n}, bftotal: {bftotal}")
+		if verbose and n % 10 == 0:
+			logger.info(f"n: {n}, log bftotal: {bftotal.getLogZ()}")
 	
 		if n == 0:
-			Gs.append(Gs_m0)
-			bfs.append(bf_m0)
-			bftotal = bftotal + bf_m0
-			n1.append(n)
-			n2.append(m)
-			Gsigmas.append(Gsigma[m])
-			Gbps.append(0.0)
+			bftotal.add(-1 * Gs_m0 / RT)
 			myindex = myindex + 1
 		
 		for m in range(0, len(sequence)-n-1):
-			if m > 200:#model.getMaxLength():
+			if m > model.getMaxLength():
 				break
 			
 			curr_a = mya
 			
 			if n >= model.getnick() and n + m >= model.getnick() + model.getSelffoldlen():
-				Gbp += df.getEnergy(sequence[n+m],sequence[m+1])
+				Gbp += df.getEnergy(sequence[n+m],sequence[n+m+1])
 				
 			if n >= model.getnick() and n < model.getnick() + model.getnicklen():
 				curr_a = 0
-						
 
-			n1.append(sequence[n])
-			n2.append(sequence[n+m+1])
-			
-			Gbps.append(Gbp)
-			Gsigmas.append(Gsigma[m+1])
 			G = curr_a + Gbp + Gsigma[m+1]
-			Gs.append(G)
-			currbf = math.exp(-1 * (G) / (0.0019858775 * model.getT()))
-			bfs.append(currbf)
-			bftotal += currbf
+			bftotal.add(-1 * G / RT)
+			with np.errstate(over='ignore', under='ignore'):
+				currbf = np.exp(-1 * G / RT)
 
-
-			myres2 = pd.DataFrame.from_dict({'index': [myindex],'n': [n], 'm': [m], 'Gsigma': [Gsigma[m+1]], 'Gbp': [Gbp], 'a': [curr_a], 'G': [G], 'bf': [currbf]})
-			
-			if n == 0 and m == 0:
-				myres = myres2
-			else:	
-				myres = pd.concat([myres,myres2])
-				
+			myres.appendRow(index=myindex, n=n, m=m, Gsigma=Gsigma[m+1], Gbp=Gbp, a=curr_a, G=G, bf=currbf)
 			myindex = myindex + 1
 			
-	myres['probability'] = myres['bf'] / bftotal
+	myres.normalize(bftotal.getLogZ(), RT)
 
-	
 	return(myres)
 
-def simulation_main(mysim):
+def logSumExp(values):
+	values = np.atleast_1d(values)
+	if len(values) == 0:
+		return(-math.inf)
+	top = np.max(values)
+	if not np.isfinite(top):
+		return(float(top))
+	return(float(top + np.log(np.exp(values - top).sum())))
+
+class partitionFunction:
+	"""Partition function kept as a running log-sum-exp of log Boltzmann factors (-G/RT).
+
+	Raw sums of exp(-G/RT) under- or overflow for long sequences and strong
+	superhelicity; the log form stays exact and partial sums from separate
+	chunks can be merged afterwards.
+	"""
+
+	def __init__(self, logZ=-math.inf):
+		self.logZ = logZ
+
+	def add(self, logbf):
+		self.logZ = float(np.logaddexp(self.logZ, logSumExp(logbf)))
+		return(self)
+
+	def merge(self, other):
+		self.logZ = float(np.logaddexp(self.logZ, other.logZ))
+		return(self)
+
+	def getLogZ(self):
+		return(self.logZ)
+
+def computeGsigma(model, length):
+	# Superhelical energy of an R-loop as a function of its length; same
+	# formula as the per-m loop in naive_forloop_rlooper
+	return(gsigmaFromConstants(length, model.getC(), model.getK(), model.getAlpha(), model.getA()))
+
+def gsigmaFromConstants(length, C, K, alpha, A):
+	mact = np.arange(length, dtype=np.float64)
+	mact[1:] += 1
+	return((2 * (pi**2) * C * K * (alpha + mact * A)**2) / (4 * (pi**2) * C + K * mact))
+
+def computeBandCounts(length, model, start, stop):
+	# Number of structures (values of m) for every start position n
+	n = np.arange(start, stop, dtype=np.int64)
+	counts = np.minimum(length - n - 1, model.getMaxLength() + 1)
+	return(n, np.clip(counts, 0, None))
+
+def computeBandIndex(n, m, length, model):
+	# Position of structure (n, m) in the band of the whole sequence, numbered
+	# from 1 like the index column (0 is the ground state)
+	n = np.asarray(n, dtype=np.int64)
+	full = max(length - model.getMaxLength() - 1, 0) # starts with maxLength + 1 structures
+	head = np.minimum(n, full)
+	tail = np.maximum(n - full, 0)
+	# starts full..n-1 have length - n' - 1 structures each
+	before = (model.getMaxLength() + 1) * head + ((length - 1 - full) + (length - n)) * tail // 2
+	return(1 + before + m)
+
+def band_blocks(sequence, model, start, stop, energy=None, block_size=1 << 20, Gsigma=None, band=None):
+	"""Yield the (n, m) band in blocks of whole start positions.
+
+	Each block is a dict of flat arrays n, m, Gsigma, Gbp, a and G, ordered
+	by n then m exactly like naive_forloop_rlooper. With band (a
+	sweep.SequenceBand of the same sequence, energy table and model) Gbp
+	is sliced out of it instead of computed.
+	"""
+	codes = gene.encodeSequence(sequence)
+	length = len(codes)
+	if band is None:
+		cumE = np.concatenate(([0.0], np.cumsum(loadEnergyTable(energy).getDinucleotideEnergies(codes))))
+	else:
+		row = int(computeBandIndex(start, 0, length, model)) - 1
+
+	if Gsigma is None:
+		Gsigma = computeGsigma(model, length)
+	nick = model.getnick()
+	threshold = nick + model.getSelffoldlen()
+	nickend = nick + model.getnicklen()
+	mya = model.geta()
+
+	allstarts, allcounts = computeBandCounts(length, model, start, stop)
+	rows_per_n = max(int(allcounts.max()) if len(allcounts) > 0 else 1, 1)
+	step = max(block_size // rows_per_n, 1)
+	for b0 in range(0, len(allstarts), step):
+		starts = allstarts[b0:b0+step]
+		counts = allcounts[b0:b0+step]
+		total = int(counts.sum())
+		if total == 0:
+			continue
+		n = np.repeat(starts, counts)
+		offsets = np.repeat(np.cumsum(counts) - counts, counts)
+		m = np.arange(total, dtype=np.int64) - offsets
+		if band is not None:
+			Gbp = band.Gbp[row:row + total]
+			row += total
+		else:
+			# Gbp is the running sum of dinucleotide energies from max(n, nick + selffoldlen)
+			lo = np.maximum(n, threshold)
+			bpmask = (n >= nick) & (n + m >= threshold)
+			Gbp = np.where(bpmask, cumE[n + m + 1] - cumE[np.minimum(lo, n + m + 1)], 0.0)
+		a = np.where((n >= nick) & (n < nickend), 0.0, float(mya))
+		Gs = Gsigma[m + 1]
+		yield({'n': n, 'm': m, 'Gsigma': Gs, 'Gbp': Gbp, 'a': a, 'G': a + Gbp + Gs})
+
+def stream_rlooper(sequence, model, start, stop, collectors, verbose=False, energy=None, Gsigma=None, myindex=None, normalize=True, block_size=1 << 20, band=None):
+	"""Run the vectorized engine and hand every block of the band to collectors.
+
+	Each collector has appendBlock(block) and normalize(logZ, RT); blocks
+	carry n, m, Gsigma, Gbp, a, G, logbf, bf and index arrays. Returns the
+	partitionFunction of [start, stop). With normalize=False the collectors
+	are left unnormalized so partial runs can be merged first. band is
+	passed on to band_blocks.
+	"""
+	RT = 0.0019858775 * model.getT()
+	bftotal = partitionFunction()
+	if start <= 0 < stop:
+		# Ground state (no R-loop) only contributes to the partition function
+		bftotal.add(-1 * computeGsigma(model, 1)[0] / RT)
+	if myindex is None:
+		myindex = 1 if start <= 0 < stop else 0
+
+	for block in band_blocks(sequence, model, start, stop, energy, block_size, Gsigma, band):
+		block['logbf'] = -1 * block['G'] / RT
+		bftotal.add(block['logbf'])
+		with np.errstate(over='ignore', under='ignore'):
+			block['bf'] = np.exp(block['logbf'])
+		block['index'] = np.arange(myindex, myindex + len(block['n']))
+		myindex += len(block['n'])
+		for collector in collectors:
+			collector.appendBlock(block)
+		if verbose:
+			logger.info(f"n: {block['n'][-1]}, log bftotal: {bftotal.getLogZ()}")
+
+	if normalize:
+		for collector in collectors:
+			collector.normalize(bftotal.getLogZ(), RT)
+	return(bftotal)
+
+def vectorized_rlooper(sequence, model, start, stop, structure, bp_energy, verbose, energy=None):
+	starts, counts = computeBandCounts(len(sequence), model, start, stop)
+	myres = result.StructureTable(int(counts.sum()))
+	stream_rlooper(sequence, model, start, stop, [myres], verbose, energy)
+	return(myres)
+
+def replayStructureTable(myres, collectors, RT):
+	# Feed an already complete StructureTable (e.g. from the naive loop) to collectors
+	block = {name: myres[name] for name in result.StructureTable.dtypes}
+	block['logbf'] = myres['G'] / (-1 * RT)
+	for collector in collectors:
+		collector.appendBlock(block)
+		collector.normalize(myres.logZ, RT)
+
+def makeCollectors(mysim, mymodel, length, start, stop):
+	"""Return (structure table or None, profile or None) for structures starting in [start, stop)."""
+	myres = None
+	profile = None
+	if not mysim.profile_only_flag:
+		if mysim.top > 0 or mysim.threshold_flag:
+			myres = result.PrunedStructureTable(mysim.top, mysim.getProbabilityThreshold())
+		else:
+			starts, counts = computeBandCounts(length, mymodel, start, stop)
+			myres = result.StructureTable(int(counts.sum()))
+	if mysim.profile_flag or mysim.profile_only_flag:
+		profile = result.ProbabilityProfile(length)
+	return(myres, profile)
+
+def computeDomains(length, mysim, mymodel):
+	"""Split [0, length) into overlapping domains for windowed mode.
+
+	Returns (domain start, domain end, owned start, owned end) tuples. A
+	domain owns the structures starting in [owned start, owned end) and
+	extends maxLength + 2 bases past it, so every owned structure lies
+	entirely inside its domain. A window size that leaves no owned bases
+	after the overlap raises ValueError.
+	"""
+	if not mysim.dynamic_flag:
+		return([(0, length, 0, length)])
+	overlap = mymodel.getMaxLength() + 2
+	if mysim.auto_domain_size:
+		step = int(mymodel.getN())
+	else:
+		step = int(mysim.dynamic_window_size * 1000) - overlap
+	if step < 1:
+		raise ValueError(f"window size {mysim.dynamic_window_size} kb must be larger than the {overlap} bp overlap "
+		                 f"of the domains (maximum R-loop length + 2)")
+	domains = list()
+	for ws in range(0, max(length, 1), step):
+		if ws + step >= length:
+			domains.append((ws, length, ws, length))
+			break
+		domains.append((ws, min(ws + step + overlap, length), ws, ws + step))
+	return(domains)
+
+def simulate_domain(codes, mymodel, start, stop, energy, mysim, targets=None):
+	"""Simulate one domain (its own superhelical domain and partition function).
+
+	Only structures starting in [start, stop) are collected. Peaks are
+	drawn for the (replicates, npeak) uniform targets from all of those
+	structures, also when only a pruned table is kept (see sample_domain).
+	Returns (structure table or None, profile or None, peaks or None).
+	"""
+	if mysim.threads > 1 and not mysim.naive_flag:
+		import parallel
+		return(parallel.simulate_domain(codes, mymodel, start, stop, energy, mysim, targets))
+	myres, profile = makeCollectors(mysim, mymodel, len(codes), start, stop)
+	collectors = [c for c in (myres, profile) if c is not None]
+	if (start, stop) != (0, len(codes)):
+		collectors = [result.StartRangeFilter(c, start, stop) for c in collectors]
+	full = None
+	if mysim.naive_flag:
+		full = naive_forloop_rlooper(codes, mymodel, 0, len(codes), [], -1.0, True, energy)
+		replayStructureTable(full, collectors, 0.0019858775 * mymodel.getT())
+	else:
+		stream_rlooper(codes, mymodel, 0, len(codes), collectors, mysim.verbose_flag, energy, band=sequenceBand(codes, mymodel, energy, mysim))
+	mypeaks = None
+	if myres is not None and targets is not None:
+		if not isinstance(myres, result.PrunedStructureTable):
+			mypeaks = peaks.samplePeaks(myres, targets)
+		elif full is not None:
+			owned = (full['n'] >= start) & (full['n'] < stop)
+			mypeaks = peaks.samplePeaks({name: full[name][owned] for name in ('n', 'm', 'probability')}, targets)
+		else:
+			mypeaks = sample_domain(codes, mymodel, start, stop, energy, mysim, myres.logZ, myres.seenLogZ, targets)
+	return(myres, profile, mypeaks)
+
+def sample_domain(codes, mymodel, start, stop, energy, mysim, logZ, logW, targets):
+	"""Peaks of the structures starting in [start, stop), drawn in one more engine pass.
+
+	Used for pruned tables, which hold too few structures to sample from:
+	with log Z and the weight log W of the owned structures known from the
+	first pass, a StreamPeakSampler draws the same peaks as from the full
+	table, without storing it.
+	"""
+	sampler = result.StreamPeakSampler(targets, math.exp(logW - logZ))
+	collector = result.StructureStream(logZ, [sampler])
+	if (start, stop) != (0, len(codes)):
+		collector = result.StartRangeFilter(collector, start, stop)
+	stream_rlooper(codes, mymodel, 0, len(codes), [collector], False, energy, block_size=STREAM_BLOCK_SIZE, band=sequenceBand(codes, mymodel, energy, mysim))
+	return(sampler.getPeaks())
+
+def sequenceBand(codes, mymodel, energy, mysim):
+	# The stored band of codes from mysim.band_dir (see sweep.BandStore), or None without one
+	if mysim.band_dir is None:
+		return(None)
+	import sweep
+	return(sweep.BandStore(mysim.band_dir, int(mysim.cache_size * (1 << 30))).load(codes, mymodel, loadEnergyTable(energy)))
+
+def simulation_main(mysim, outdir="."):
+	"""Simulate mysim.fasta_file (or its BED regions) and write the output files into outdir.
+
+	A thin writer over simulate_record: structure tables, peaks and
+	profiles are passed to the file writers as they are produced (see
+	api.simulate for the same simulation without any file output).
+	"""
 	logger.info("Simulation main function")
 	logger.info(mysim.fasta_file)
-	mymodel = model.rloop_model()
-	mygene = gene.Gene()
-	mygene.loadFromFasta(mysim.getFastaFile())
-	mygene.printGene()
+	if mysim.sweep_sigmas or mysim.sweep_as:
+		import sweep
+		return(sweep.sweep_main(mysim, outdir))
+	if mysim.batch_flag:
+		import batch
+		return(batch.batch_main(mysim, outdir))
+	if mysim.threads > 1 and (useStreaming(mysim) or (mysim.peaks_only_flag and not mysim.profile_only_flag)):
+		# stream_domain and reservoir_domain are single-pass and run in this process
+		logger.warning(f"--threads {mysim.threads} is ignored with --stream and --peaks-only; they run serially")
 	logger.info("Model parameters:")
-	mymodel.setSigma(mysim.getSigma())
-	mymodel.seta(mysim.geta())
 	# Set other model parameters as needed
+	mymodel = model.rloop_model(sigma=mysim.getSigma(), a=mysim.geta())
 	logger.info(f"N: {mymodel.N}, sigma: {mymodel.sigma}, A: {mymodel.A}, C: {mymodel.C}, T: {mymodel.T}")
-	myres = naive_forloop_rlooper(mygene.getSequence(), mymodel, 0, mygene.getLength(), [], -1.0, True)
-	myres.index = np.arange(0,len(myres))
-	simpeak(myres,50,mygene.gene_name)
-	printout(myres)
+	energy = loadEnergyTable(mysim.getEnergyFile())
+	results = resultCache(mysim)
+	if results is not None:
+		# A repeated run gets its finished output files from the cache
+		runkey = cache.runKey([cache.recordKey(mygene, mymodel, energy, mysim) for mygene in readRecords(mysim)], mysim)
+		if results.fetchFiles(runkey, outdir) is not None:
+			logger.info(f"Output files of run {runkey[:12]} copied from the cache")
+			return
+	profiles = dict()
+	with openOutput(mysim, mymodel, outdir) as output:
+		writer = outputWriter(output, outdir, mysim.peak_format)
+		# Every record of a multi-FASTA file (or every BED region) goes into the same output files
+		for record, mygene in enumerate(readRecords(mysim)):
+			mygene.printGene()
+			recordprofile = simulate_record(mygene, mymodel, energy, mysim, functools.partial(writer.write, mygene.getName(), strand=mygene.getPos().strand))
+			if recordprofile is not None:
+				if mysim.profile_format == 'npy':
+					profiles[mygene.getName()] = recordprofile
+				else:
+					printprofile(recordprofile, mygene.getName(), append=record > 0, outdir=outdir)
+	if len(profiles) > 0:
+		np.savez(os.path.join(outdir, "rlooper_profile.npz"), **profiles)
+	if results is not None:
+		names = outputFiles(mysim, writer.peakswritten)
+		results.storeFiles(runkey, outdir, [name for name in names if os.path.exists(os.path.join(outdir, name))])
 
-def simpeak(myres, npeak,gene_name):
-	if len(myres) == 0:
+def readRecords(mysim):
+	# The records of mysim: the regions of its BED file, else every FASTA record
+	if mysim.getBedFile() is not None:
+		return(gene.readBedRegions(mysim.getFastaFile(), mysim.getBedFile()))
+	return(gene.readFasta(mysim.getFastaFile()))
+
+def resultCache(mysim):
+	# cache.ResultCache of mysim.cache_dir, or None without one
+	if mysim.cache_dir is None:
 		return(None)
+	return(cache.ResultCache(mysim.cache_dir, int(mysim.cache_size * (1 << 30)), block_size=STREAM_BLOCK_SIZE))
+
+def outputFiles(mysim, peakswritten=True):
+	"""Names of the files simulation_main writes for mysim."""
+	names = list()
+	if not mysim.profile_only_flag and not mysim.peaks_only_flag:
+		names.append(tableio.outputFile("rlooper_output", mysim.output_format, mysim.compression))
+	if not mysim.profile_only_flag and peakswritten:
+		names.append(peaks.PEAK_FILES[mysim.peak_format])
+	if mysim.profile_flag or mysim.profile_only_flag:
+		names.append("rlooper_profile.npz" if mysim.profile_format == 'npy' else "rlooper_profile.bedgraph")
+	return(names)
+
+def openOutput(mysim, mymodel, outdir="."):
+	"""TableWriter for rlooper_output in mysim.output_format (and mysim.compression for tsv)."""
+	path = os.path.join(outdir, tableio.outputFile("rlooper_output", mysim.output_format, mysim.compression))
+	return(tableio.TableWriter(path, mysim.output_format, tableio.compactDtypes(mymodel.getMaxLength()), compression=mysim.compression))
+
+class outputWriter:
+	"""Writes what simulate_record emits to a structure table writer and the peak file."""
+
+	def __init__(self, output, outdir=".", peak_format="csv"):
+		self.output = output
+		self.outdir = outdir
+		self.peak_format = peak_format
+		self.peakswritten = False
+
+	def write(self, gene_name, myres, mypeaks, strand="+"):
+		if mypeaks is not None:
+			peaks.printpeaks(mypeaks, gene_name, append=self.peakswritten, outdir=self.outdir, fmt=self.peak_format, strand=strand)
+			self.peakswritten = True
+		if myres is not None:
+			self.output.write(myres, gene_name)
+
+def useStreaming(mysim):
+	# Only full structure tables are streamed; pruned tables need every block before the final cut
+	return(mysim.stream_flag and not mysim.profile_only_flag and not mysim.peaks_only_flag and not mysim.naive_flag and mysim.top <= 0 and not mysim.threshold_flag)
+
+# Engine block size when streaming: smaller blocks keep the columns and text chunks built from each one small
+STREAM_BLOCK_SIZE = 1 << 18
+
+def stream_domain(codes, mymodel, start, stop, energy, mysim, consumer, targets):
+	"""Simulate one domain without storing its structure table.
+
+	The first pass of the engine only accumulates the partition function,
+	the total weight of the structures starting in [start, stop) (and the
+	profile); the second recomputes the blocks and hands them to consumer
+	with their probabilities, while peaks are drawn for the (replicates,
+	npeak) uniform targets on the way. Memory is one engine block at the
+	cost of computing the band twice. log Z is summed over smaller blocks
+	than for a stored table, so probabilities can differ from those in the
+	last digits. Returns (profile or None, peaks).
+	"""
+	profile = result.ProbabilityProfile(len(codes)) if mysim.profile_flag else None
+	weight = result.LogWeight()
+	Gsigma = computeGsigma(mymodel, len(codes))
+	band = sequenceBand(codes, mymodel, energy, mysim)
+	first = [c for c in (weight, profile) if c is not None]
+	if (start, stop) != (0, len(codes)):
+		first = [result.StartRangeFilter(c, start, stop) for c in first]
+	bftotal = stream_rlooper(codes, mymodel, 0, len(codes), first, mysim.verbose_flag, energy, Gsigma=Gsigma, block_size=STREAM_BLOCK_SIZE, band=band)
+	# Targets are spread over the probability of the streamed structures, not over 1
+	sampler = result.StreamPeakSampler(targets, math.exp(weight.logW - bftotal.getLogZ()))
+	second = result.StructureStream(bftotal.getLogZ(), [consumer, sampler])
+	if (start, stop) != (0, len(codes)):
+		second = result.StartRangeFilter(second, start, stop)
+	stream_rlooper(codes, mymodel, 0, len(codes), [second], False, energy, Gsigma=Gsigma, block_size=STREAM_BLOCK_SIZE, band=band)
+	return(profile, sampler.getPeaks())
+
+def reservoir_domain(codes, mymodel, start, stop, energy, mysim, generators):
+	"""Sample the peaks of one domain in a single engine pass.
+
+	No structure table is built or written: a result.PeakReservoir keeps
+	mysim.npeak peaks per replicate stream while the band goes by, so
+	memory is one engine block plus the peaks. The engine runs serially so
+	the draws do not depend on mysim.threads. Returns (profile or None, peaks).
+	"""
+	profile = result.ProbabilityProfile(len(codes)) if mysim.profile_flag else None
+	reservoir = result.PeakReservoir(generators, mysim.npeak)
+	collectors = [c for c in (reservoir, profile) if c is not None]
+	if (start, stop) != (0, len(codes)):
+		collectors = [result.StartRangeFilter(c, start, stop) for c in collectors]
+	stream_rlooper(codes, mymodel, 0, len(codes), collectors, mysim.verbose_flag, energy, block_size=STREAM_BLOCK_SIZE, band=sequenceBand(codes, mymodel, energy, mysim))
+	return(profile, reservoir.getPeaks())
+
+def simulate_record(mygene, mymodel, energy, mysim, emit):
+	"""Simulate one record, domain by domain.
+
+	emit(myres, peaks) receives each domain's structure table as a dict of
+	NumPy columns in sequence coordinates together with the peaks sampled
+	from it (a dict of n, m, probability and replicate columns); with
+	streaming (mysim.stream_flag) the table comes in engine-sized pieces
+	with peaks None, followed by one call with only the domain's peaks.
+	Every domain is an independent ensemble, so mysim.npeak peaks per
+	replicate are drawn from each domain and a windowed record gets npeak
+	times its number of domains. Returns the record's probability profile,
+	or None if no profile was requested. With mysim.cache_dir a record simulated before with the same
+	sequence, parameters and energy table is replayed from the cache.
+	"""
+	results = resultCache(mysim)
+	if results is not None:
+		return(results.simulate(mygene, mymodel, energy, mysim, emit, compute_record))
+	return(compute_record(mygene, mymodel, energy, mysim, emit))
+
+def compute_record(mygene, mymodel, energy, mysim, emit):
+	# simulate_record without the cache
+	codes = mygene.getCodes()
+	domains = computeDomains(len(codes), mysim, mymodel)
+	if len(domains) > 1:
+		logger.info(f"{mygene.getName()}: {len(domains)} domains")
+	recordprofile = np.zeros(len(codes)) if mysim.profile_flag or mysim.profile_only_flag else None
+	streaming = useStreaming(mysim)
+	for ws, we, own0, own1 in domains:
+		generators = peaks.peakStreams(mysim.seed, mygene.getName(), ws, mysim.replicates)
+		if mysim.peaks_only_flag and not mysim.profile_only_flag:
+			profile, mypeaks = reservoir_domain(codes[ws:we], mymodel, own0 - ws, own1 - ws, energy, mysim, generators)
+			if mypeaks is not None:
+				mypeaks['n'] += ws
+				emit(None, mypeaks)
+			if profile is not None:
+				recordprofile[ws:we] += profile.getValues()
+			continue
+		targets = peaks.drawTargets(generators, mysim.npeak)
+		if streaming:
+			def consumer(columns, ws=ws):
+				# The block arrays are shared with the peak sampler, so n is shifted into a new array
+				myres = dict(columns, n=columns['n'] + ws)
+				myres['index'] = computeBandIndex(myres['n'], myres['m'], len(codes), mymodel)
+				emit(myres, None)
+			profile, mypeaks = stream_domain(codes[ws:we], mymodel, own0 - ws, own1 - ws, energy, mysim, consumer, targets)
+			if mypeaks is not None:
+				mypeaks['n'] += ws
+				emit(None, mypeaks)
+			if profile is not None:
+				recordprofile[ws:we] += profile.getValues()
+			continue
+		myres, profile, mypeaks = simulate_domain(codes[ws:we], mymodel, own0 - ws, own1 - ws, energy, mysim, targets)
+		if profile is not None:
+			recordprofile[ws:we] += profile.getValues()
+		if myres is not None:
+			logger.info(f"{mygene.getName()}:{ws}-{we}: {len(myres)} structures, log Z = {myres.logZ}")
+			myres = myres.getColumns()
+			myres['n'] = myres['n'] + ws
+			myres['index'] = computeBandIndex(myres['n'], myres['m'], len(codes), mymodel)
+			if mypeaks is not None:
+				mypeaks['n'] = mypeaks['n'] + ws
+			emit(myres, mypeaks)
+	return(recordprofile)
+
+def simpeak(myres, npeak,gene_name,append=False,outdir=".",seed=0):
+	mypeaks = peaks.samplePeaks(myres, peaks.drawTargets(peaks.peakStreams(seed, gene_name, 0, 1), npeak))
+	if mypeaks is not None:
+		peaks.printpeaks(mypeaks, gene_name, append, outdir)
+
+def printprofile(values, gene_name, append=False, outdir="."):
+	# bedGraph with runs of equal probability merged into one interval
+	if len(values) == 0:
+		return
+	breaks = np.flatnonzero(np.diff(values) != 0) + 1
+	starts = np.concatenate(([0], breaks))
+	ends = np.concatenate((breaks, [len(values)]))
+	lines = [f"{gene_name}\t{start}\t{end}\t{value:.6g}\n" for start, end, value in zip(starts, ends, values[starts])]
+	with open(os.path.join(outdir, "rlooper_profile.bedgraph"), "a" if append else "w") as f:
+		f.writelines(lines)
 
-	randomindex = choice(myres.index, size=npeak, p=myres['probability']/myres['probability'].sum(), replace=True)
-	print(randomindex)
-	peaks = myres.loc[randomindex, :]
-	print(peaks[1:5])
-	peaks['start'] = peaks['n']
-	peaks['end'] = peaks['n'] + peaks['m'] + 1
-	peaks['chr'] = gene_name
-	peaks.sort_values(by=['chr','start','end'], ascending=True, inplace=True)
-	peaks['strand'] = '+'
-	open("rlooper_peaks.csv", "w").write(peaks[['chr','start','end','probability','m','strand']].to_csv(sep="\t",index=False))
-
-def printout(myres):
-	open("rlooper_output.csv", "w").write(myres.to_csv(sep="\t",index=False))
+def printout(myres,gene_name,append=False,outdir="."):
+	with tableio.TableWriter(os.path.join(outdir, "rlooper_output.csv"), "tsv", append=append) as output:
+		output.write(myres, gene_name)
 	return
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: wall time of short command lines, each in a fresh interpreter.
+
+    python bin/startup_benchmark.py [-n REPEATS] [-i small.fasta]
+
+Times the interpreter alone, importing the modules of the entry points,
+main.py --help, grapher.py --help and (with -i) a run on a small FASTA
+file, and reports the mean and the best of REPEATS runs.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+binDir = os.path.dirname(os.path.abspath(__file__))
+
+def timeCommand(cmd, repeats, cwd=None):
+    times = list()
+    for _ in range(repeats):
+        began = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - began)
+    return(sum(times) / len(times), min(times))
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of the rlooper entry points')
+    parser.add_argument('-n', '--repeats', type=int, default=5, help='runs per command [5]')
+    parser.add_argument('-i', '--fasta', type=str, help='small FASTA file to simulate as well')
+    args = parser.parse_args()
+
+    python = sys.executable
+    commands = [
+        ("python -c pass", [python, "-c", "pass"]),
+        ("import main, grapher, cli", [python, "-c", f"import sys; sys.path.insert(0, {binDir!r}); import main, grapher, cli"]),
+        ("import simulation", [python, "-c", f"import sys; sys.path.insert(0, {binDir!r}); import simulation"]),
+        ("main.py --help", [python, os.path.join(binDir, "main.py"), "--help"]),
+        ("grapher.py --help", [python, os.path.join(binDir, "grapher.py"), "--help"]),
+    ]
+    if args.fasta:
+        commands.append((f"main.py -i {os.path.basename(args.fasta)}",
+                         [python, os.path.join(binDir, "main.py"), "-i", os.path.abspath(args.fasta)]))
+    print(f"{'command':<32}{'mean (s)':>10}{'best (s)':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, cmd in commands:
+            mean, best = timeCommand(cmd, args.repeats, cwd=workdir)
+            print(f"{label:<32}{mean:>10.3f}{best:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -3,23 +3,78 @@ import sys
 import logging
 
 
-class Loci():
-    chromsome = "init"
-    strand = '+'
-    start_pos = 0
-    end_pos = 0
-    get_length = 0
-
-class Structure():
-    position = Loci()
-
-    free_energy = 0.0
-    gsigma=0.0
-    bp_energy = 0.0
-    boltzmann_factor = 0.0
-    probability = 0.0
-    residual_twist = 0.0
-    current_Gsigma = 0.0
-    external = False
-    external_length = 0
+class Record():
+    """Immutable per-instance record.
 
+    Subclasses list their fields (and defaults) in `fields`; values are
+    stored in __slots__ and set once in __init__, so instances never share
+    state and are safe to hand to other threads or processes. Use
+    replace() to derive a modified copy.
+    """
+
+    __slots__ = ()
+    fields = {}
+
+    def __init__(self, **values):
+        unknown = set(values) - set(self.fields)
+        if unknown:
+            raise TypeError(f"{type(self).__name__} got unexpected fields: {', '.join(sorted(unknown))}")
+        for name, default in self.fields.items():
+            object.__setattr__(self, name, values.get(name, default))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable; use replace({name}=...)")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def getFields(self):
+        return({name: getattr(self, name) for name in self.fields})
+
+    def replace(self, **changes):
+        values = self.getFields()
+        values.update(changes)
+        return(type(self)(**values))
+
+    def __reduce__(self):
+        return(_rebuild, (type(self), self.getFields()))
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return(NotImplemented)
+        return(self.getFields() == other.getFields())
+
+    def __hash__(self):
+        return(hash((type(self).__name__,) + tuple(self.getFields().values())))
+
+    def __repr__(self):
+        return(f"{type(self).__name__}(" + ", ".join(f"{name}={value!r}" for name, value in self.getFields().items()) + ")")
+
+def _rebuild(cls, values):
+    return(cls(**values))
+
+class Loci(Record):
+    __slots__ = ('chromsome', 'strand', 'start_pos', 'end_pos', 'get_length')
+    fields = {
+        'chromsome': "init",
+        'strand': '+',
+        'start_pos': 0,
+        'end_pos': 0,
+        'get_length': 0,
+    }
+
+class Structure(Record):
+    __slots__ = ('position', 'free_energy', 'gsigma', 'bp_energy', 'boltzmann_factor', 'probability',
+                 'residual_twist', 'current_Gsigma', 'external', 'external_length')
+    fields = {
+        'position': Loci(),
+        'free_energy': 0.0,
+        'gsigma': 0.0,
+        'bp_energy': 0.0,
+        'boltzmann_factor': 0.0,
+        'probability': 0.0,
+        'residual_twist': 0.0,
+        'current_Gsigma': 0.0,
+        'external': False,
+        'external_length': 0,
+    }
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import functools
+import numpy as np
+import model
+import result
+import tableio
+import cache
+import simulation
+
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=64)
+def cachedGsigma(length, N, A, C, T, sigma):
+    """Gsigma vector for a sequence length and rloop_model constants, kept in an LRU cache."""
+    K = (2200 * 0.0019858775 * T) / N
+    Gsigma = simulation.gsigmaFromConstants(length, C, K, N * sigma * A, A)
+    Gsigma.setflags(write=False)
+    return(Gsigma)
+
+# Bump when SequenceBand's arrays change, so stored bands of older code are not mapped
+BAND_VERSION = 2
+
+def bandKey(codes, mymodel, energy):
+    """Hash of what a SequenceBand depends on: the sequence, the energy matrix and the band settings."""
+    digest = hashlib.sha256()
+    settings = {'version': BAND_VERSION, 'maxLength': mymodel.getMaxLength(), 'nick': mymodel.getnick(),
+                'nicklen': mymodel.getnicklen(), 'selffoldlen': mymodel.getSelffoldlen()}
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(energy.matrix, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(codes, dtype=np.uint8).tobytes())
+    return(digest.hexdigest())
+
+def emptyArray(name, size, dtype):
+    return(np.empty(size, dtype=dtype))
+
+class SequenceBand():
+    """Sequence-dependent part of the (n, m) band of one sequence.
+
+    Gbp depends only on the sequence, the energy table and the nick /
+    self-fold / maximum length settings, so it is computed once and reused
+    for every sigma and a. It is the only array kept: n and m follow from
+    the sequence length and maximum length (computeBandCounts), and the
+    nicked structures, whose nucleation energy is waived, from n and the
+    nick, so structures() rebuilds them on first use. allocate(name, size,
+    dtype) provides the arrays, e.g. memory-mapped files of a BandStore;
+    path is the directory of a stored band, None for one held in memory.
+    """
+
+    arrays = ('Gbp',)
+
+    # Model settings the band is laid out by, kept with a stored band
+    settings = ('length', 'maxLength', 'nick', 'nicklen')
+
+    def __init__(self, codes, mymodel, energy=None, allocate=emptyArray):
+        self.length = len(codes)
+        self.maxLength = mymodel.getMaxLength()
+        self.nick = mymodel.getnick()
+        self.nicklen = mymodel.getnicklen()
+        self.path = None
+        self.columns = None
+        starts, counts = simulation.computeBandCounts(self.length, mymodel, 0, self.length)
+        self.Gbp = allocate('Gbp', int(counts.sum()), np.float64)
+        count = 0
+        # Gsigma is irrelevant here; pass zeros so band_blocks does not compute it
+        for block in simulation.band_blocks(codes, mymodel, 0, self.length, energy, Gsigma=np.zeros(self.length)):
+            self.Gbp[count:count + len(block['n'])] = block['Gbp']
+            count += len(block['n'])
+
+    @classmethod
+    def open(cls, path):
+        """Stored band of path, its arrays memory-mapped read-only."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        band = cls.__new__(cls)
+        for name in SequenceBand.settings:
+            setattr(band, name, meta[name])
+        band.path = path
+        band.columns = None
+        for name in SequenceBand.arrays:
+            setattr(band, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r'))
+        return(band)
+
+    def getMeta(self):
+        return({name: getattr(self, name) for name in SequenceBand.settings})
+
+    def __len__(self):
+        return(len(self.Gbp))
+
+    def structures(self):
+        """index, n, m and nicked columns of the band, rebuilt from its settings once and kept."""
+        if self.columns is None:
+            starts, counts = simulation.computeBandCounts(self.length, model.rloop_model(maxLength=self.maxLength), 0, self.length)
+            n = np.repeat(starts, counts).astype(result.StructureTable.dtypes['n'], copy=False)
+            offsets = np.repeat(np.cumsum(counts) - counts, counts)
+            m = (np.arange(len(n), dtype=np.int64) - offsets).astype(result.StructureTable.dtypes['m'], copy=False)
+            nicked = (n >= self.nick) & (n < self.nick + self.nicklen)
+            self.columns = {'index': np.arange(1, len(n) + 1, dtype=np.int64), 'n': n, 'm': m, 'nicked': nicked}
+        return(self.columns)
+
+    def reweight(self, mymodel, sigma, a, collector):
+        """Fill collector with the structures for one (sigma, a) grid point; returns log Z."""
+        Gsigma = cachedGsigma(self.length, mymodel.getN(), mymodel.getA(), mymodel.getC(), mymodel.getT(), sigma)
+        RT = 0.0019858775 * mymodel.getT()
+        columns = self.structures()
+        block = {'index': columns['index'], 'n': columns['n'], 'm': columns['m'], 'Gbp': self.Gbp}
+        block['Gsigma'] = Gsigma[columns['m'] + 1]
+        block['a'] = np.where(columns['nicked'], 0.0, float(a))
+        block['G'] = block['a'] + self.Gbp + block['Gsigma']
+        block['logbf'] = block['G'] / (-1 * RT)
+        with np.errstate(over='ignore', under='ignore'):
+            block['bf'] = np.exp(block['logbf'])
+        bftotal = simulation.partitionFunction()
+        bftotal.add(-1 * Gsigma[0] / RT)
+        bftotal.add(block['logbf'])
+        collector.appendBlock(block)
+        collector.normalize(bftotal.getLogZ(), RT)
+        return(bftotal.getLogZ())
+
+class BandStore():
+    """On-disk store of SequenceBands, keyed by bandKey and memory-mapped on load.
+
+    The first load of a sequence writes its band straight into .npy files
+    (so it is never held in memory); later loads, in any process, map them
+    read-only, which shares the pages between processes and leaves only
+    the parameter-dependent terms (Gsigma, a) to compute. Entries are
+    stored, refreshed and evicted least recently used first like those of
+    a cache.ResultCache of max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=cache.DEFAULT_CACHE_SIZE):
+        self.entries = cache.ResultCache(directory, max_bytes)
+
+    def open(self, key):
+        try:
+            path, meta = self.entries.openMeta(key)
+            return(SequenceBand.open(path))
+        except (OSError, ValueError, KeyError):
+            return(None)
+
+    def load(self, codes, mymodel, energy):
+        key = bandKey(codes, mymodel, energy)
+        band = self.open(key)
+        if band is not None:
+            return(band)
+        def fill(partial):
+            os.makedirs(partial)
+            def allocate(name, size, dtype):
+                return(np.lib.format.open_memmap(os.path.join(partial, f"{name}.npy"), mode='w+', dtype=dtype, shape=(size,)))
+            band = SequenceBand(codes, mymodel, energy, allocate)
+            for name in SequenceBand.arrays:
+                getattr(band, name).flush()
+            with open(os.path.join(partial, "meta.json"), "w") as f:
+                json.dump(band.getMeta(), f)
+        began = time.perf_counter()
+        self.entries.store(key, fill)
+        logger.info(f"Stored the band of {len(codes)} bases in {time.perf_counter() - began:.2f} s")
+        band = self.open(key)
+        if band is None:
+            # Larger than the whole store, so evicted right away
+            band = SequenceBand(codes, mymodel, energy)
+        return(band)
+
+# Options of a single simulation that change what a sweep would have to write
+UNSUPPORTED_OPTIONS = {'dynamic_flag': '--window-size/--auto-domain-size', 'profile_flag': '--profile',
+                       'profile_only_flag': '--profile-only', 'peaks_only_flag': '--peaks-only'}
+
+# Options a sweep runs without: it is serial and samples no peaks
+IGNORED_OPTIONS = {'threads': '--threads', 'npeak': '--npeak', 'replicates': '--replicates',
+                   'seed': '--seed', 'peak_format': '--peak-format'}
+
+def checkOptions(mysim):
+    """Raise ValueError for options a sweep does not support and warn about those it ignores."""
+    unsupported = [option for name, option in UNSUPPORTED_OPTIONS.items() if getattr(mysim, name)]
+    if len(unsupported) > 0:
+        raise ValueError(f"a parameter sweep does not support {', '.join(unsupported)}")
+    ignored = [option for name, option in IGNORED_OPTIONS.items() if getattr(mysim, name) != getattr(type(mysim), name)]
+    if len(ignored) > 0:
+        logger.warning(f"a parameter sweep runs serially and samples no peaks; ignoring {', '.join(ignored)}")
+
+def sweep_main(mysim, outdir="."):
+    """Simulate every record over the sigma x a grid of mysim.
+
+    Writes one tidy table (rlooper_sweep.csv, or the file of --output-format
+    and --compression) with the grid point's sigma and sweep_a columns in
+    front of the usual structure columns (whose a is 0 for nicked
+    structures), honoring --top/--power-threshold, and a per grid point
+    summary (rlooper_sweep_summary.csv) into outdir. Windowed mode,
+    profiles and peaks are not supported (see checkOptions).
+    """
+    checkOptions(mysim)
+    mymodel = model.rloop_model(sigma=mysim.getSigma(), a=mysim.geta())
+    sigmas = mysim.sweep_sigmas if mysim.sweep_sigmas else [mysim.getSigma()]
+    avalues = mysim.sweep_as if mysim.sweep_as else [mysim.geta()]
+    logger.info(f"Sweep over {len(sigmas)} sigma x {len(avalues)} a values")
+    energy = simulation.loadEnergyTable(mysim.getEnergyFile())
+    records = simulation.readRecords(mysim)
+    summary = list()
+    path = os.path.join(outdir, tableio.outputFile("rlooper_sweep", mysim.output_format, mysim.compression))
+    # Columns of the sweep table, for the NPZ writer: the grid point in front, without the bf column
+    dtypes = {'sigma': np.float64, 'sweep_a': np.float64}
+    dtypes.update((name, dtype) for name, dtype in tableio.compactDtypes(mymodel.getMaxLength()).items() if name != 'bf')
+    with tableio.TableWriter(path, mysim.output_format, dtypes, compression=mysim.compression) as output:
+        for mygene in records:
+            mygene.printGene()
+            if mysim.band_dir is not None:
+                band = BandStore(mysim.band_dir, int(mysim.cache_size * (1 << 30))).load(mygene.getCodes(), mymodel, energy)
+            else:
+                band = SequenceBand(mygene.getCodes(), mymodel, energy)
+            for sigma in sigmas:
+                for a in avalues:
+                    if mysim.top > 0 or mysim.threshold_flag:
+                        myres = result.PrunedStructureTable(mysim.top, mysim.getProbabilityThreshold())
+                    else:
+                        myres = result.StructureTable(len(band))
+                    logZ = band.reweight(mymodel, sigma, a, myres)
+                    summary.append(f"{mygene.getName()}\t{sigma}\t{a}\t{len(myres)}\t{logZ}\n")
+                    columns = {'sigma': np.full(len(myres), sigma, dtype=np.float64), 'sweep_a': np.full(len(myres), a, dtype=np.float64)}
+                    columns.update((name, values) for name, values in myres.getColumns().items() if name != 'bf')
+                    output.write(columns, mygene.getName())
+    with open(os.path.join(outdir, "rlooper_sweep_summary.csv"), "w") as f:
+        f.write("chr\tsigma\ta\tstructures\tlogZ\n")
+        f.writelines(summary)
+    logger.info(f"Gsigma cache: {cachedGsigma.cache_info()}")
@@ -0,0 +1,248 @@
+import io
+import os
+import sys
+import gzip
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --output-format choices and the file extension each one writes
+OUTPUT_FORMATS = {
+    'tsv': '.csv',
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'npz': '.npz',
+}
+
+# Compression of the text outputs and the suffix it adds
+COMPRESSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# Rows rendered per chunk, so the text of a huge table is never built at once
+TSV_CHUNK_ROWS = 1 << 16
+
+def outputFile(basename, fmt="tsv", compression=None):
+    """File name of an output table, e.g. rlooper_output.csv.gz or rlooper_output.parquet."""
+    if fmt == 'tsv':
+        return(basename + OUTPUT_FORMATS[fmt] + COMPRESSIONS[compression])
+    return(basename + OUTPUT_FORMATS[fmt])
+
+def textCompression(path):
+    for compression, suffix in COMPRESSIONS.items():
+        if compression is not None and path.endswith(suffix):
+            return(compression)
+    return(None)
+
+def openZstd(path, mode):
+    # Standard library on Python >= 3.14, else the zstandard package
+    try:
+        from compression import zstd
+        return(zstd.open(path, mode + 't'))
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression needs Python >= 3.14 or the zstandard package (pip install zstandard)")
+    if 'r' in mode:
+        # Appending adds a frame, so read across frames
+        return(io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)))
+    return(io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(open(path, mode + 'b'), closefd=True)))
+
+def openText(path, mode='r', compression='infer'):
+    """Open a plain, gzip or zstd text file; 'infer' picks the compression from the suffix."""
+    if compression == 'infer':
+        compression = textCompression(path)
+    if compression == 'gzip':
+        return(gzip.open(path, mode + 't', compresslevel=6))
+    if compression == 'zstd':
+        return(openZstd(path, mode))
+    return(open(path, mode))
+
+def compactDtypes(maxLength=2000):
+    """On-disk dtypes for the structure table columns of the binary formats.
+
+    Positions fit in uint32 and lengths in uint16 (unless maxLength is
+    larger); energies are stored as float32, while the Boltzmann factor and
+    the probability keep float64 so tiny probabilities stay exact.
+    """
+    return({
+        'index': np.int64,
+        'n': np.uint32,
+        'm': np.uint16 if maxLength < np.iinfo(np.uint16).max else np.uint32,
+        'Gsigma': np.float32,
+        'Gbp': np.float32,
+        'a': np.float32,
+        'G': np.float32,
+        'bf': np.float64,
+        'probability': np.float64,
+    })
+
+def importPyarrow(fmt):
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(f"--output-format {fmt} needs pyarrow (pip install pyarrow, or the 'columnar' extra)")
+    return(pyarrow)
+
+def tableColumns(table):
+    # Columns of a DataFrame or a dict of arrays as a dict of NumPy arrays, and the number of rows
+    columns = {name: np.asarray(table[name]) for name in table if name != 'chr'}
+    return(columns, len(next(iter(columns.values()))) if columns else 0)
+
+def formatColumn(values):
+    # Text of every value as pandas' to_csv writes it: ints as is, floats as their shortest repr
+    return(list(map(str, values.tolist())))
+
+class TableWriter():
+    """Writes structure tables of one or more records to a single file.
+
+    write() is called once per record, domain or streamed block with the
+    table as a dict of NumPy columns (or a DataFrame); the record name goes
+    into the leading chr column. Text is formatted TSV_CHUNK_ROWS rows at a
+    time, without pandas, straight into the (optionally gzip or zstd
+    compressed) file. Parquet
+    and Feather files are written batch by batch with zstd compression, so
+    only the current table is held in memory. NPZ cannot be appended to,
+    so its (compact) columns are collected and saved on close().
+    """
+
+    def __init__(self, path, fmt="tsv", dtypes=None, append=False, compression='infer'):
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format {fmt}; choose one of {', '.join(OUTPUT_FORMATS)}")
+        if append and fmt != 'tsv':
+            raise ValueError(f"{fmt} output cannot be appended to; keep one TableWriter open instead")
+        self.path = path
+        self.fmt = fmt
+        self.dtypes = dtypes if dtypes is not None else compactDtypes()
+        self.append = append
+        self.compression = compression
+        self.rows = 0
+        self.headerWritten = append
+        self.handle = None
+        self.writer = None
+        self.parts = []
+        self.names = {}
+        if fmt in ('parquet', 'feather'):
+            self.pa = importPyarrow(fmt)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def compact(self, columns):
+        return({name: values.astype(self.dtypes.get(name, values.dtype), copy=False) for name, values in columns.items()})
+
+    def write(self, myres, gene_name):
+        columns, rows = tableColumns(myres)
+        if self.fmt == 'tsv':
+            if self.handle is None:
+                self.handle = openText(self.path, "a" if self.append else "w", self.compression)
+            if not self.headerWritten:
+                # Once, even when the first records have no structures
+                self.handle.write("\t".join(['chr'] + list(columns)) + "\n")
+                self.headerWritten = True
+            prefix = f"{gene_name}\t"
+            for start in range(0, rows, TSV_CHUNK_ROWS):
+                texts = [formatColumn(values[start:start + TSV_CHUNK_ROWS]) for values in columns.values()]
+                self.handle.write("".join([prefix + "\t".join(row) + "\n" for row in zip(*texts)]))
+        elif self.fmt == 'npz':
+            code = self.names.setdefault(gene_name, len(self.names))
+            columns = self.compact(columns)
+            columns['chr'] = np.full(rows, code, dtype=np.uint32)
+            self.parts.append(columns)
+        else:
+            pa = self.pa
+            columns = self.compact(columns)
+            # Parquet dictionary-encodes the repeated chr values on disk; Feather compresses them
+            arrays = [pa.array(np.full(rows, gene_name, dtype=object), type=pa.string())]
+            arrays += [pa.array(values) for values in columns.values()]
+            batch = pa.RecordBatch.from_arrays(arrays, names=['chr'] + list(columns))
+            if self.writer is None:
+                if self.fmt == 'parquet':
+                    self.writer = pa.parquet.ParquetWriter(self.path, batch.schema, compression='zstd')
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression='zstd')
+                    self.writer = pa.ipc.new_file(self.path, batch.schema, options=options)
+            self.writer.write_batch(batch)
+        self.rows += rows
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.fmt == 'npz' and self.parts is not None:
+            columns = {name: np.concatenate([part[name] for part in self.parts]) if self.parts else np.zeros(0, dtype=dtype)
+                       for name, dtype in dict(self.dtypes, chr=np.uint32).items()}
+            np.savez(self.path, chr_names=np.array(list(self.names), dtype=str), **columns)
+            self.parts = None
+
+def readTable(path, columns=None):
+    """Read an output table written in any of OUTPUT_FORMATS (chosen by extension).
+
+    Only the given columns are loaded where the format allows it: Parquet
+    and Feather read just those columns, NPZ only decompresses those
+    members and text files are parsed with usecols.
+    """
+    import pandas as pd
+    columns = list(columns) if columns is not None else None
+    if path.endswith('.parquet'):
+        return(pd.read_parquet(path, columns=columns))
+    if path.endswith('.feather'):
+        return(pd.read_feather(path, columns=columns))
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            names = ['chr'] + [name for name in data.files if name not in ('chr', 'chr_names')]
+            table = {}
+            for name in (columns if columns is not None else names):
+                if name == 'chr':
+                    table['chr'] = pd.Categorical.from_codes(data['chr'], categories=data['chr_names'])
+                else:
+                    table[name] = data[name]
+        return(pd.DataFrame(table))
+    if textCompression(path) == 'zstd':
+        with openText(path) as f:
+            return(pd.read_csv(f, sep='\t', usecols=columns))
+    return(pd.read_csv(path, sep='\t', usecols=columns))
+
+def readColumns(path):
+    """Column names of an output table, read from its schema or header only."""
+    if path.endswith('.parquet'):
+        pa = importPyarrow('parquet')
+        return(pa.parquet.read_schema(path).names)
+    if path.endswith('.feather'):
+        pa = importPyarrow('feather')
+        with pa.memory_map(path) as source:
+            return(pa.ipc.open_file(source).schema.names)
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return(['chr'] + [name for name in data.files if name not in ('chr', 'chr_names')])
+    with openText(path) as f:
+        return(f.readline().rstrip('\n').split('\t'))
+
+def countRows(path):
+    """Number of rows of an output table, from the file metadata where possible."""
+    if path.endswith('.parquet'):
+        pa = importPyarrow('parquet')
+        return(pa.parquet.ParquetFile(path).metadata.num_rows)
+    if path.endswith('.feather'):
+        pa = importPyarrow('feather')
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            return(sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches)))
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return(len(data['n']))
+    with openText(path) as f:
+        return(sum(1 for _ in f) - 1)
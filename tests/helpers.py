@@ -0,0 +1,34 @@
+"""Comparison helpers shared by the engine tests."""
+
+import numpy as np
+
+def randomSequence(length, seed=0):
+    # GC-rich enough to give R-loops a non-negligible probability
+    rng = np.random.default_rng(seed)
+    return(''.join(rng.choice(list("ACGGGT"), size=length)))
+
+def sortedTable(columns):
+    order = np.lexsort((columns['m'], columns['n']))
+    return({name: np.asarray(values)[order] for name, values in columns.items()})
+
+def sortedPeaks(mypeaks):
+    order = np.lexsort((mypeaks['m'], mypeaks['n'], mypeaks['replicate']))
+    return({name: np.asarray(values)[order] for name, values in mypeaks.items()})
+
+def assertSameTables(a, b):
+    a, b = sortedTable(a), sortedTable(b)
+    np.testing.assert_array_equal(a['n'], b['n'])
+    np.testing.assert_array_equal(a['m'], b['m'])
+    for name in ('Gsigma', 'Gbp', 'G'):
+        np.testing.assert_allclose(a[name], b[name], rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(a['probability'], b['probability'], rtol=1e-9)
+
+def assertSameProfiles(a, b):
+    # The profile is a cumulative sum of weight differences, so bases near zero carry rounding noise
+    np.testing.assert_allclose(a, b, rtol=1e-9, atol=1e-9 * np.max(b))
+
+def assertSamePeaks(a, b):
+    a, b = sortedPeaks(a), sortedPeaks(b)
+    for name in ('replicate', 'n', 'm'):
+        np.testing.assert_array_equal(a[name], b[name])
+    np.testing.assert_allclose(a['probability'], b['probability'], rtol=1e-9)
@@ -0,0 +1,24 @@
+import os
+import pytest
+
+import api
+from helpers import randomSequence, assertSameTables
+
+SEQUENCE = randomSequence(120, seed=10)
+
+def test_unknown_parameters_are_rejected():
+    with pytest.raises(ValueError, match="unknown simulation parameter"):
+        api.makeParams({'sigmaa': 0.07})
+
+def test_no_files_without_caches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    api.simulate(SEQUENCE, {'npeak': 20, 'profile_flag': True})
+    assert os.listdir(tmp_path) == []
+
+def test_caches_write_only_their_directories(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    params = {'cache_dir': str(tmp_path / "results"), 'band_dir': str(tmp_path / "bands")}
+    first = api.simulate(SEQUENCE, params)
+    again = api.simulate(SEQUENCE, params)
+    assert sorted(os.listdir(tmp_path)) == ["bands", "results"]
+    assertSameTables(first.getColumns(), again.getColumns())
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pytest
+
+import api
+import gene
+import model
+import result
+import simulation
+import sweep
+from helpers import randomSequence, assertSameTables, assertSamePeaks
+
+SEQUENCE = randomSequence(140, seed=12)
+
+def energyTable():
+    return(simulation.loadEnergyTable(simulation.bundledEnergyFile()))
+
+def test_band_store_keeps_only_gbp(tmp_path):
+    mymodel = model.rloop_model(nick=30, nicklen=20, maxLength=60)
+    codes = gene.Gene(SEQUENCE).getCodes()
+    store = sweep.BandStore(str(tmp_path))
+    stored = store.load(codes, mymodel, energyTable())
+    assert sorted(os.listdir(stored.path)) == ["Gbp.npy", "meta.json"]
+    mapped = store.load(codes, mymodel, energyTable())
+    assert isinstance(mapped.Gbp, np.memmap) and not mapped.Gbp.flags.writeable
+    # The rebuilt columns are those the engine lays the band out in
+    blocks = list(simulation.band_blocks(codes, mymodel, 0, len(codes), energyTable()))
+    columns = mapped.structures()
+    np.testing.assert_array_equal(columns['n'], np.concatenate([block['n'] for block in blocks]))
+    np.testing.assert_array_equal(columns['m'], np.concatenate([block['m'] for block in blocks]))
+    np.testing.assert_array_equal(columns['index'], np.arange(1, len(mapped) + 1))
+    np.testing.assert_array_equal(columns['nicked'], np.concatenate([block['a'] for block in blocks]) == 0)
+    np.testing.assert_array_equal(mapped.Gbp, np.concatenate([block['Gbp'] for block in blocks]))
+
+def test_stored_and_fresh_bands_reweight_alike(tmp_path):
+    mymodel = model.rloop_model(nick=30, nicklen=20)
+    codes = gene.Gene(SEQUENCE).getCodes()
+    tables = []
+    for band in (sweep.SequenceBand(codes, mymodel, energyTable()), sweep.BandStore(str(tmp_path)).load(codes, mymodel, energyTable())):
+        table = result.StructureTable(len(band))
+        band.reweight(mymodel, -0.05, 6, table)
+        tables.append(table.getColumns())
+    assertSameTables(*tables)
+
+def test_band_key_follows_the_band_settings():
+    codes = gene.Gene(SEQUENCE).getCodes()
+    key = sweep.bandKey(codes, model.rloop_model(), energyTable())
+    assert sweep.bandKey(codes, model.rloop_model(sigma=-0.05, a=4), energyTable()) == key
+    assert sweep.bandKey(codes, model.rloop_model(nick=10), energyTable()) != key
+    assert sweep.bandKey(codes[:-1], model.rloop_model(), energyTable()) != key
+
+@pytest.mark.parametrize('params', [{}, {'threads': 2}, {'stream_flag': True}])
+def test_simulations_with_a_band_store_match(tmp_path, params):
+    fresh = api.simulate(SEQUENCE, dict(params, npeak=40))
+    banded = api.simulate(SEQUENCE, dict(params, npeak=40, band_dir=str(tmp_path)))
+    assertSameTables(fresh.getColumns(), banded.getColumns())
+    assertSamePeaks(fresh.getPeakColumns(), banded.getPeakColumns())
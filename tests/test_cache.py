@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import pytest
+
+import api
+import cache
+import gene
+import model
+import simulation
+from helpers import randomSequence, assertSameTables, assertSamePeaks
+
+SEQUENCE = randomSequence(120, seed=11)
+
+def key(sequence=SEQUENCE, name="g", params=None, **values):
+    energy = simulation.loadEnergyTable(simulation.bundledEnergyFile())
+    return(cache.recordKey(gene.Gene(sequence, name), model.rloop_model(**values), energy, api.makeParams(params)))
+
+def test_record_key_is_stable():
+    assert key() == key()
+    assert key(params={'threads': 4, 'output_format': 'parquet', 'compression': 'gzip'}) == key()
+
+@pytest.mark.parametrize('change', [{'sequence': SEQUENCE[:-1] + ("A" if SEQUENCE[-1] != "A" else "C")}, {'name': "h"},
+                                    {'sigma': -0.05}, {'a': 5}, {'params': {'npeak': 10}}, {'params': {'top': 5}}])
+def test_record_key_follows_what_changes_the_result(change):
+    assert key(**change) != key()
+
+def test_run_key_follows_the_output_settings():
+    records = [key(), key(name="h")]
+    assert cache.runKey(records, api.makeParams()) == cache.runKey(records, api.makeParams())
+    assert cache.runKey(records, api.makeParams({'output_format': 'parquet'})) != cache.runKey(records, api.makeParams())
+    assert cache.runKey(records[::-1], api.makeParams()) != cache.runKey(records, api.makeParams())
+
+def test_cached_records_replay_the_simulation(tmp_path):
+    params = {'cache_dir': str(tmp_path), 'npeak': 30, 'profile_flag': True}
+    fresh = api.simulate(SEQUENCE, params)
+    cached = api.simulate(SEQUENCE, params)
+    assertSameTables(fresh.getColumns(), cached.getColumns())
+    assertSamePeaks(fresh.getPeakColumns(), cached.getPeakColumns())
+    np.testing.assert_array_equal(fresh.getProfile(), cached.getProfile())
+
+def storeBytes(results, name, size):
+    def fill(partial):
+        os.makedirs(partial)
+        with open(os.path.join(partial, "meta.json"), "w") as f:
+            f.write("{}")
+        with open(os.path.join(partial, "data"), "wb") as f:
+            f.write(b"\0" * size)
+    results.store(name, fill)
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    results = cache.ResultCache(str(tmp_path), max_bytes=3500)
+    for i, name in enumerate(["aa1", "bb2", "cc3"]):
+        storeBytes(results, name, 1000)
+        os.utime(os.path.join(results.entryPath(name), "meta.json"), (i, i))
+    # Opening aa1 makes it the most recently used, so bb2 goes first
+    results.openMeta("aa1")
+    storeBytes(results, "dd4", 1000)
+    assert not os.path.exists(results.entryPath("bb2"))
+    assert all(os.path.exists(results.entryPath(name)) for name in ["aa1", "cc3", "dd4"])
+    assert results.size() <= 3500
+
+def test_stores_under_the_cap_do_not_scan(tmp_path, monkeypatch):
+    results = cache.ResultCache(str(tmp_path), max_bytes=10000)
+    storeBytes(results, "aa1", 1000)
+    scans = []
+    original = cache.ResultCache.entries
+    monkeypatch.setattr(cache.ResultCache, 'entries', lambda self: scans.append(1) or original(self))
+    # A new ResultCache of the same directory keeps the running total
+    results = cache.ResultCache(str(tmp_path), max_bytes=10000)
+    for name in ["bb2", "cc3", "dd4"]:
+        storeBytes(results, name, 1000)
+    assert scans == []
+    storeBytes(results, "ee5", 7000)
+    assert len(scans) == 1
+    assert results.size() <= 10000
@@ -0,0 +1,46 @@
+import pytest
+
+import api
+import gene
+import model
+import simulation
+from helpers import randomSequence
+
+def test_single_domain_without_dynamic_flag():
+    mysim = api.makeParams()
+    assert simulation.computeDomains(5000, mysim, model.rloop_model()) == [(0, 5000, 0, 5000)]
+
+@pytest.mark.parametrize('length', [1, 2999, 3000, 3001, 12345])
+@pytest.mark.parametrize('params', [{'dynamic_window_size': 2.5}, {'auto_domain_size': True}])
+def test_domains_own_every_start_once(length, params):
+    mymodel = model.rloop_model()
+    mysim = api.makeParams(dict(params, dynamic_flag=True))
+    domains = simulation.computeDomains(length, mysim, mymodel)
+    owned = [(own0, own1) for ws, we, own0, own1 in domains]
+    assert owned[0][0] == 0 and owned[-1][1] == length
+    assert all(a[1] == b[0] for a, b in zip(owned, owned[1:]))
+    for ws, we, own0, own1 in domains:
+        assert ws == own0 and we <= length
+        # The longest structure starting at the last owned base ends inside the domain
+        assert we == length or we >= own1 - 1 + mymodel.getMaxLength() + 1
+    if params.get('auto_domain_size'):
+        assert all(own1 - own0 == mymodel.getN() for ws, we, own0, own1 in domains[:-1])
+
+def test_window_smaller_than_the_overlap_raises():
+    mysim = api.makeParams({'dynamic_flag': True, 'dynamic_window_size': 1.0})
+    with pytest.raises(ValueError):
+        simulation.computeDomains(5000, mysim, model.rloop_model())
+
+def test_windowed_run_lists_the_same_structures():
+    # A short maximum length keeps the overlap small enough for a quick windowed run
+    mymodel = model.rloop_model(maxLength=30)
+    mygene = gene.Gene(randomSequence(400, seed=8), "windowed")
+    energy = simulation.loadEnergyTable(simulation.bundledEnergyFile())
+    def structures(params):
+        tables = list()
+        simulation.simulate_record(mygene, mymodel, energy, api.makeParams(params), lambda myres, mypeaks: tables.append(myres) if myres is not None else None)
+        return(sorted((n, m) for table in tables for n, m in zip(table['n'].tolist(), table['m'].tolist())))
+    whole = structures({})
+    windowed = structures({'dynamic_flag': True, 'dynamic_window_size': 0.1})
+    assert len(whole) > 0
+    assert windowed == whole
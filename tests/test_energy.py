@@ -0,0 +1,47 @@
+import csv
+import os
+import pickle
+import numpy as np
+import pytest
+
+import gene
+import simulation
+
+def readCsv(path):
+    with open(path, newline='') as f:
+        return({(row['n1'], row['n2']): float(row['energy']) for row in csv.DictReader(f)})
+
+def test_matrix_matches_csv():
+    path = simulation.bundledEnergyFile()
+    energy = simulation.energyTable(path)
+    for (n1, n2), value in readCsv(path).items():
+        assert energy.getEnergy(n1, n2) == value
+        assert energy.matrix[gene.BASES.index(n1), gene.BASES.index(n2)] == value
+    # Lower case bases map to the same codes
+    assert energy.getEnergy('g', 'c') == energy.getEnergy('G', 'C')
+
+def test_dinucleotide_energies_of_a_sequence():
+    energy = simulation.loadEnergyTable(simulation.bundledEnergyFile())
+    sequence = "GGGACTTNAG"
+    expected = [energy.getEnergy(a, b) for a, b in zip(sequence[:-1], sequence[1:])]
+    np.testing.assert_array_equal(energy.getDinucleotideEnergies(gene.encodeSequence(sequence)), expected)
+
+def test_table_is_immutable_and_parsed_once(tmp_path):
+    path = tmp_path / "energy.csv"
+    path.write_text("n1,n2,energy\nG,G,-1.5\nA,T,0.25\n")
+    first = simulation.energyTable(str(path))
+    second = simulation.energyTable(str(path))
+    assert first.matrix is second.matrix
+    assert first.energyFile == os.path.abspath(path)
+    with pytest.raises(ValueError):
+        first.matrix[0, 0] = 1.0
+    with pytest.raises(AttributeError):
+        first.matrix = None
+    assert first.getEnergy('G', 'G') == -1.5 and first.getEnergy('A', 'T') == 0.25
+    assert first.getEnergy('C', 'C') == 0.0
+
+def test_pickled_table_keeps_the_matrix():
+    energy = simulation.loadEnergyTable(simulation.bundledEnergyFile())
+    copy = pickle.loads(pickle.dumps(energy))
+    np.testing.assert_array_equal(copy.matrix, energy.matrix)
+    assert simulation.loadEnergyTable(copy) is copy
@@ -0,0 +1,16 @@
+import api
+from helpers import randomSequence, assertSameTables, assertSameProfiles, assertSamePeaks
+
+SEQUENCE = randomSequence(160)
+
+def test_naive_and_vectorized_engines_agree():
+    naive = api.simulate(SEQUENCE, {'naive_flag': True, 'profile_flag': True})
+    vectorized = api.simulate(SEQUENCE, {'profile_flag': True})
+    assertSameTables(naive.getColumns(), vectorized.getColumns())
+    assertSameProfiles(naive.getProfile(), vectorized.getProfile())
+    assertSamePeaks(naive.getPeakColumns(), vectorized.getPeakColumns())
+
+def test_probabilities_leave_the_ground_state():
+    columns = api.simulate(SEQUENCE).getColumns()
+    total = columns['probability'].sum()
+    assert 0 < total < 1
@@ -0,0 +1,33 @@
+import gzip
+
+import gene
+
+RECORDS = b">chr1 first record\nACGTAC\nGTNN\n\n>chr2\nggga\n>empty\n>chr3\nTTTT\nA\n"
+
+def test_multi_record_fasta(tmp_path):
+    path = tmp_path / "multi.fa"
+    path.write_bytes(RECORDS)
+    records = list(gene.readFasta(str(path)))
+    assert [r.getName() for r in records] == ["chr1", "chr2", "empty", "chr3"]
+    assert [r.getSequence() for r in records] == ["ACGTACGTNN", "GGGA", "", "TTTTA"]
+    assert records[0].getHeader() == ">chr1 first record"
+
+def test_gzip_and_crlf_fasta(tmp_path):
+    path = tmp_path / "multi.fa.gz"
+    path.write_bytes(gzip.compress(RECORDS.replace(b"\n", b"\r\n")))
+    assert [r.getSequence() for r in gene.readFasta(str(path))] == ["ACGTACGTNN", "GGGA", "", "TTTTA"]
+
+def test_records_are_read_lazily(tmp_path):
+    path = tmp_path / "multi.fa"
+    path.write_bytes(RECORDS)
+    records = gene.readFasta(str(path))
+    assert next(records).getName() == "chr1"
+    assert next(records).getName() == "chr2"
+
+def test_load_from_fasta(tmp_path):
+    path = tmp_path / "multi.fa"
+    path.write_bytes(RECORDS)
+    assert gene.Gene.loadFromFasta(str(path)).getName() == "chr1"
+    empty = tmp_path / "empty.fa"
+    empty.write_bytes(b"")
+    assert gene.Gene.loadFromFasta(str(empty)).getLength() == 0
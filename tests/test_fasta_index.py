@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pytest
+
+import gene
+
+def wrap(sequence, width, newline):
+    return(newline.join(sequence[i:i + width] for i in range(0, len(sequence), width)) + newline)
+
+def writeGenome(path, newline="\n", width=7):
+    rng = np.random.default_rng(0)
+    chroms = {"chr1": ''.join(rng.choice(list("ACGTN"), size=53)), "chr2": ''.join(rng.choice(list("acgt"), size=14))}
+    with open(path, "w", newline="") as f:
+        for name, sequence in chroms.items():
+            f.write(f">{name} description{newline}" + wrap(sequence, width, newline))
+    return(chroms)
+
+@pytest.mark.parametrize('newline', ["\n", "\r\n"])
+def test_fetch_codes_matches_slicing(tmp_path, newline):
+    path = str(tmp_path / "genome.fa")
+    chroms = writeGenome(path, newline)
+    with gene.FastaIndex(path) as index:
+        assert index.getNames() == ["chr1", "chr2"]
+        for name, sequence in chroms.items():
+            assert index.getLength(name) == len(sequence)
+            expected = gene.encodeSequence(sequence)
+            # Every region, so each combination of first and last line offsets is covered
+            for start in range(len(sequence) + 1):
+                for end in range(start, len(sequence) + 1):
+                    np.testing.assert_array_equal(index.fetchCodes(name, start, end), expected[start:end])
+
+def test_index_is_written_and_reused(tmp_path):
+    path = str(tmp_path / "genome.fa")
+    writeGenome(path)
+    with gene.FastaIndex(path):
+        pass
+    fai = path + ".fai"
+    entries = gene.readFastaIndex(fai)
+    assert entries == gene.buildFastaIndex(path)
+    # A newer .fai is trusted as is: a changed entry shows it was read, not rebuilt
+    length, offset, linebases, linewidth = entries["chr2"]
+    entries["chr2"] = (length - 1, offset, linebases, linewidth)
+    gene.writeFastaIndex(entries, fai)
+    os.utime(fai, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    with gene.FastaIndex(path) as index:
+        assert index.getLength("chr2") == length - 1
+    # A .fai older than the FASTA file is rebuilt
+    os.utime(fai, (os.path.getmtime(path) - 10, os.path.getmtime(path) - 10))
+    with gene.FastaIndex(path) as index:
+        assert index.getLength("chr2") == length
+
+def test_ragged_lines_and_gzip_are_rejected(tmp_path):
+    path = tmp_path / "ragged.fa"
+    path.write_text(">chr1\nACG\nACGT\n")
+    with pytest.raises(ValueError):
+        gene.buildFastaIndex(str(path))
+    compressed = tmp_path / "genome.fa.gz"
+    compressed.write_bytes(b"\x1f\x8b\x08\x00")
+    with pytest.raises(ValueError):
+        gene.FastaIndex(str(compressed))
+
+def test_bed_regions(tmp_path):
+    path = str(tmp_path / "genome.fa")
+    chroms = writeGenome(path)
+    bed = tmp_path / "regions.bed"
+    bed.write_text("track name=regions\n# comment\nchr1\t3\t20\tplus\t0\t+\nchr1\t3\t20\tminus\t0\t-\nchr2\t0\t14\n")
+    plus, minus, whole = gene.readBedRegions(path, str(bed))
+    assert plus.getSequence() == chroms["chr1"][3:20]
+    assert minus.getSequence() == plus.reverseComplement()
+    assert minus.getPos().strand == '-'
+    assert (whole.getName(), whole.getSequence()) == ("chr2:0-14", chroms["chr2"].upper())
+
+@pytest.mark.parametrize('line', ["chr9\t0\t5\n", "chr1\t50\t60\n", "chr1\t-1\t5\n", "chr1\t0\t5\tname\t0\t*\n"])
+def test_bad_bed_regions_raise(tmp_path, line):
+    path = str(tmp_path / "genome.fa")
+    writeGenome(path)
+    bed = tmp_path / "regions.bed"
+    bed.write_text("chr1\t0\t5\n" + line)
+    with pytest.raises(ValueError, match="regions.bed:2"):
+        list(gene.readBedRegions(path, str(bed)))
@@ -0,0 +1,53 @@
+import pickle
+import numpy as np
+import pytest
+
+import gene
+
+def test_encode_decode_round_trip():
+    codes = gene.encodeSequence("ACGTNacgtnRY")
+    assert codes.dtype == np.uint8
+    np.testing.assert_array_equal(codes, [0, 1, 2, 3, 4, 0, 1, 2, 3, 4, 4, 4])
+    assert gene.decodeSequence(codes) == b"ACGTNACGTNNN"
+    assert gene.encodeSequence(b"GT").tolist() == gene.encodeSequence(["G", "T"]).tolist() == [2, 3]
+
+def test_gene_is_immutable():
+    mygene = gene.Gene("ACGT", "g")
+    with pytest.raises(AttributeError):
+        mygene.gene_name = "other"
+    with pytest.raises(ValueError):
+        mygene.getCodes()[0] = 1
+    renamed = mygene.replace(name="other")
+    assert renamed.getName() == "other" and mygene.getName() == "g"
+    assert renamed.getCodes() is mygene.getCodes()
+
+def test_caller_code_array_is_copied_not_frozen():
+    codes = np.array([0, 1, 2, 3, 4], dtype=np.uint8)
+    mygene = gene.Gene(codes, "g")
+    assert codes.flags.writeable
+    codes[0] = 3
+    assert mygene.getSequence() == "ACGTN"
+
+def test_frozen_code_array_is_taken_over():
+    codes = np.array([2, 2, 2], dtype=np.uint8)
+    codes.setflags(write=False)
+    assert gene.Gene(codes, "g").getCodes() is codes
+
+def test_ascii_arrays_are_rejected():
+    with pytest.raises(ValueError):
+        gene.Gene(np.frombuffer(b"ACGT", dtype=np.uint8))
+
+def test_pickle_round_trip():
+    mygene = gene.Gene("GGGAGGGANNC", "g", ">g description", ground_state_energy=1.5)
+    copy = pickle.loads(pickle.dumps(mygene))
+    assert copy.getSequence() == mygene.getSequence()
+    assert (copy.getName(), copy.getHeader(), copy.getGroundStateEnergy()) == ("g", ">g description", 1.5)
+
+def test_composition_and_reverse_complement():
+    mygene = gene.Gene("GGGCAATN", "g")
+    np.testing.assert_array_equal(mygene.countBases(), [2, 1, 3, 1, 1])
+    assert mygene.computeGCSkew() == pytest.approx((3 - 1) / 4)
+    assert mygene.computeATSkew() == pytest.approx((2 - 1) / 3)
+    assert mygene.computeGCContent() == pytest.approx(4 / 8)
+    assert mygene.reverseComplement() == "NATTGCCC"
+    assert mygene.extractSubsequence(1, 4) == "GGC"
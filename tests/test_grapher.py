@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import grapher
+
+@pytest.mark.parametrize('show_levels', [False, True])
+def test_empty_peak_set_is_plotted(tmp_path, show_levels):
+    pytest.importorskip("matplotlib")
+    peaks = pd.DataFrame({'start': [], 'end': [], 'probability': []})
+    output = tmp_path / "peaks.png"
+    grapher.graph_compressed_pileup(peaks, str(output), show_levels=show_levels)
+    assert output.stat().st_size > 0
+
+def firstFitLevels(start, end):
+    # The original packing: each peak, in order of start and end, on the first level it overlaps nothing in
+    occupied = []
+    levels = [0] * len(start)
+    for i in sorted(range(len(start)), key=lambda i: (start[i], end[i])):
+        for level, intervals in enumerate(occupied):
+            if all(end[i] <= s or start[i] >= e for s, e in intervals):
+                break
+        else:
+            level = len(occupied)
+            occupied.append([])
+        occupied[level].append((start[i], end[i]))
+        levels[i] = level
+    return(levels)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pack_levels_matches_first_fit(seed):
+    rng = np.random.default_rng(seed)
+    start = rng.integers(0, 300, size=400)
+    end = start + rng.integers(1, 60, size=400)
+    levels = grapher.pack_levels(start, end)
+    assert levels.dtype == np.int64
+    assert levels.tolist() == firstFitLevels(start.tolist(), end.tolist())
+
+def test_pack_levels_reuses_touching_levels():
+    # A peak starting where another ends shares its level; an empty set has no levels
+    assert grapher.pack_levels([0, 5, 3, 10], [5, 10, 8, 12]).tolist() == [0, 0, 1, 0]
+    assert len(grapher.pack_levels([], [])) == 0
@@ -0,0 +1,30 @@
+import logging
+import numpy as np
+import pytest
+
+import api
+import main
+import simulation
+from helpers import randomSequence, assertSameTables, assertSameProfiles, assertSamePeaks
+
+@pytest.mark.parametrize('params', [{}, {'top': 5}, {'threshold_flag': True, 'power_threshold': 3}])
+def test_threaded_merge_matches_serial(params):
+    sequence = randomSequence(400, seed=3)
+    serial = api.simulate(sequence, dict(params, profile_flag=True, npeak=200))
+    threaded = api.simulate(sequence, dict(params, profile_flag=True, npeak=200, threads=2))
+    if params:
+        # Pruned tables break probability ties by arrival order, which depends on the split
+        np.testing.assert_allclose(np.sort(serial.getColumns()['probability']), np.sort(threaded.getColumns()['probability']), rtol=1e-9)
+    else:
+        assertSameTables(serial.getColumns(), threaded.getColumns())
+    assertSameProfiles(serial.getProfile(), threaded.getProfile())
+    assertSamePeaks(serial.getPeakColumns(), threaded.getPeakColumns())
+
+@pytest.mark.parametrize('option', ["--stream", "--peaks-only"])
+def test_serial_modes_warn_about_threads(tmp_path, caplog, option):
+    fasta = tmp_path / "input.fa"
+    fasta.write_text(">first\n" + randomSequence(80, seed=7) + "\n")
+    mysim = main.parseArgv(["-i", str(fasta), "-e", simulation.bundledEnergyFile(), "-t", "2", option])
+    with caplog.at_level(logging.WARNING, logger="simulation"):
+        simulation.simulation_main(mysim, outdir=str(tmp_path))
+    assert any("--threads 2 is ignored" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,37 @@
+import numpy as np
+
+import peaks
+
+TABLE = {'n': np.array([1, 2, 3]), 'm': np.array([10, 20, 30]), 'probability': np.array([0.1, 0.2, 0.3])}
+
+def test_sample_peaks_inverse_cdf():
+    # Probabilities sum to 0.6; the other 0.4 is the ground state, so targets are scaled by 0.6
+    targets = np.array([[0.0, 0.2, 0.5, 0.99]])
+    mypeaks = peaks.samplePeaks(TABLE, targets)
+    np.testing.assert_array_equal(mypeaks['n'], [1, 2, 3, 3])
+    np.testing.assert_array_equal(mypeaks['replicate'], [0, 0, 0, 0])
+
+def test_peak_streams_are_reproducible():
+    first = peaks.drawTargets(peaks.peakStreams(0, "record", 0, 2), 50)
+    again = peaks.drawTargets(peaks.peakStreams(0, "record", 0, 2), 50)
+    other = peaks.drawTargets(peaks.peakStreams(0, "other", 0, 2), 50)
+    np.testing.assert_array_equal(first, again)
+    assert not np.array_equal(first, other)
+
+def test_bed_peaks_have_integer_scores_and_the_record_strand(tmp_path):
+    mypeaks = peaks.samplePeaks(TABLE, np.array([[0.0, 0.5], [0.2, 0.99]]))
+    peaks.printpeaks(mypeaks, "chr1:0-40", outdir=str(tmp_path), fmt="bed", strand="-")
+    rows = [line.split("\t") for line in (tmp_path / "rlooper_peaks.bed").read_text().splitlines()]
+    assert [row[3] for row in rows] == ["0", "0", "1", "1"]
+    for row in rows:
+        assert 0 <= int(row[4]) <= 1000
+        assert row[5] == "-"
+        assert int(row[4]) == round(1000 * float(row[6]))
+
+def test_csv_peaks_carry_the_record_strand(tmp_path):
+    mypeaks = peaks.samplePeaks(TABLE, np.array([[0.0, 0.5]]))
+    peaks.printpeaks(mypeaks, "chr1:0-40", outdir=str(tmp_path), strand="-")
+    lines = (tmp_path / "rlooper_peaks.csv").read_text().splitlines()
+    assert lines[0].split("\t")[-1] == "strand"
+    assert len(lines) == 3
+    assert all(line.endswith("\t-") for line in lines[1:])
@@ -0,0 +1,12 @@
+import pytest
+
+import api
+from helpers import randomSequence, assertSamePeaks
+
+SEQUENCE = randomSequence(160)
+
+@pytest.mark.parametrize('pruning', [{'top': 5}, {'threshold_flag': True, 'power_threshold': 3}])
+def test_pruned_tables_sample_peaks_from_every_structure(pruning):
+    full = api.simulate(SEQUENCE, {'npeak': 300})
+    pruned = api.simulate(SEQUENCE, dict(pruning, npeak=300))
+    assertSamePeaks(full.getPeakColumns(), pruned.getPeakColumns())
@@ -0,0 +1,17 @@
+import numpy as np
+
+import api
+from helpers import randomSequence
+
+def test_peaks_only_reservoir_follows_the_table():
+    # The one-pass reservoir draws other structures than the stored sampler, but from the same distribution
+    sequence = randomSequence(200, seed=4)
+    stored = api.simulate(sequence)
+    reservoir = api.simulate(sequence, {'peaks_only_flag': True, 'npeak': 4000})
+    columns = stored.getColumns()
+    expected = columns['probability'] / columns['probability'].sum()
+    drawn = reservoir.getPeakColumns()
+    lookup = {(n, m): i for i, (n, m) in enumerate(zip(columns['n'].tolist(), columns['m'].tolist()))}
+    counts = np.bincount([lookup[(n, m)] for n, m in zip(drawn['n'].tolist(), drawn['m'].tolist())], minlength=len(expected))
+    top = np.argsort(expected)[::-1][:5]
+    np.testing.assert_allclose(counts[top] / counts.sum(), expected[top], atol=0.03)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import api
+import main
+import peaks
+import result
+import simulation
+import tableio
+from helpers import randomSequence, assertSameTables, assertSamePeaks
+
+def writeFasta(path, records):
+    with open(path, "w") as f:
+        for name, sequence in records:
+            f.write(f">{name}\n{sequence}\n")
+    return(str(path))
+
+def runMain(tmp_path, label, options):
+    # Files written by main.py for options, as {name: text} (compressed files decompressed)
+    fasta = writeFasta(tmp_path / "input.fa", [("first", randomSequence(160, seed=5)), ("second", randomSequence(120, seed=6))])
+    outdir = tmp_path / label
+    outdir.mkdir()
+    mysim = main.parseArgv(["-i", fasta, "-e", simulation.bundledEnergyFile()] + options)
+    main.loadSimulation().simulation_main(mysim, outdir=str(outdir))
+    files = {}
+    for path in sorted(outdir.iterdir()):
+        with tableio.openText(str(path)) as f:
+            files[path.name] = f.read()
+    return(files)
+
+@pytest.mark.parametrize('compression', ['gzip', 'zstd'])
+def test_compressed_text_round_trip(tmp_path, compression):
+    path = str(tmp_path / tableio.outputFile("rlooper_output", "tsv", compression))
+    lines = [f"line {i}\t{i * 0.5!r}\n" for i in range(5000)]
+    with tableio.openText(path, "w", compression) as f:
+        f.write("".join(lines[:3000]))
+    # Appending adds a gzip member or zstd frame; readers must go across them
+    with tableio.openText(path, "a", compression) as f:
+        f.write("".join(lines[3000:]))
+    assert tableio.textCompression(path) == compression
+    with tableio.openText(path) as f:
+        assert f.read() == "".join(lines)
+
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+def test_compressed_tables_read_back(tmp_path, compression):
+    path = str(tmp_path / tableio.outputFile("rlooper_output", "tsv", compression))
+    table = {'n': np.arange(70000), 'm': np.arange(70000) % 13, 'probability': np.linspace(0, 1e-6, 70000)}
+    with tableio.TableWriter(path, compression=compression) as output:
+        output.write(table, "gene1")
+    assert tableio.countRows(path) == 70000
+    assert tableio.readColumns(path) == ['chr', 'n', 'm', 'probability']
+    np.testing.assert_array_equal(tableio.readTable(path, columns=['m'])['m'], table['m'])
+
+@pytest.mark.parametrize('compression', [[], ["--compression", "gzip"]])
+def test_streamed_output_files_match_stored(tmp_path, compression):
+    stored = runMain(tmp_path, "stored", compression)
+    streamed = runMain(tmp_path, "streamed", compression + ["--stream"])
+    assert stored == streamed
+
+@pytest.mark.parametrize('block', [1, 7, 1000])
+def test_stream_sampler_matches_stored_table(block):
+    rng = np.random.default_rng(1)
+    probability = rng.random(500)
+    probability *= 0.3 / probability.sum()
+    table = {'n': np.arange(500), 'm': np.arange(500) % 17, 'probability': probability}
+    targets = peaks.drawTargets(peaks.peakStreams(0, "record", 0, 3), 200)
+    sampler = result.StreamPeakSampler(targets, probability.sum())
+    for start in range(0, 500, block):
+        sampler({name: values[start:start + block] for name, values in table.items()})
+    assertSamePeaks(sampler.getPeaks(), peaks.samplePeaks(table, targets))
+
+def test_streamed_peaks_match_stored_peaks():
+    sequence = randomSequence(600, seed=2)
+    stored = api.simulate(sequence, {'npeak': 300, 'replicates': 2})
+    streamed = api.simulate(sequence, {'npeak': 300, 'replicates': 2, 'stream_flag': True})
+    assertSameTables(stored.getColumns(), streamed.getColumns())
+    assertSamePeaks(stored.getPeakColumns(), streamed.getPeakColumns())
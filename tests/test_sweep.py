@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import api
+import gene
+import main
+import model
+import result
+import simulation
+import sweep
+import tableio
+from helpers import randomSequence, assertSameTables
+
+SEQUENCE = randomSequence(150, seed=9)
+
+def runSweep(tmp_path, options):
+    fasta = tmp_path / "input.fa"
+    fasta.write_text(">swept\n" + SEQUENCE + "\n")
+    mysim = main.parseArgv(["-i", str(fasta), "-e", simulation.bundledEnergyFile(), "--sweep-sigma", "0.05,0.07", "--sweep-a", "4,10"] + options)
+    simulation.simulation_main(mysim, outdir=str(tmp_path))
+    return(tableio.readTable(str(tmp_path / "rlooper_sweep.csv")))
+
+def test_sweep_matches_fresh_runs(tmp_path):
+    table = runSweep(tmp_path, [])
+    assert len(table) > 0
+    for sigma in (0.05, 0.07):
+        for a in (4, 10):
+            rows = table[(table['sigma'] == sigma) & (table['sweep_a'] == a)]
+            fresh = api.simulate(SEQUENCE, {'sigma': sigma, 'a': a}).getColumns()
+            np.testing.assert_array_equal(rows['n'].to_numpy(), fresh['n'])
+            np.testing.assert_array_equal(rows['m'].to_numpy(), fresh['m'])
+            np.testing.assert_array_equal(rows['a'].to_numpy(), fresh['a'])
+            np.testing.assert_allclose(rows['probability'].to_numpy(), fresh['probability'], rtol=1e-9)
+
+def test_nicked_structures_keep_their_own_a():
+    mymodel = model.rloop_model(nick=40, nicklen=30)
+    codes = gene.Gene(SEQUENCE).getCodes()
+    energy = simulation.loadEnergyTable(simulation.bundledEnergyFile())
+    band = sweep.SequenceBand(codes, mymodel, energy)
+    swept = result.StructureTable(len(band))
+    band.reweight(mymodel, mymodel.getSigma(), mymodel.geta(), swept)
+    fresh = result.StructureTable(len(band))
+    simulation.stream_rlooper(codes, mymodel, 0, len(codes), [fresh], False, energy)
+    columns = swept.getColumns()
+    assert (columns['a'] == 0).any() and (columns['a'] == mymodel.geta()).any()
+    assertSameTables(columns, fresh.getColumns())
+
+@pytest.mark.parametrize('option', [["--window-size", "5"], ["--profile"], ["--profile-only"], ["--peaks-only"]])
+def test_unsupported_options_are_rejected(tmp_path, option):
+    with pytest.raises(ValueError, match="does not support"):
+        runSweep(tmp_path, option)
+
+def test_ignored_options_warn(tmp_path, caplog):
+    runSweep(tmp_path, ["-t", "2", "--npeak", "10"])
+    assert any("ignoring --threads, --npeak" in record.getMessage() for record in caplog.records)
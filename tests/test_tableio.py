@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import tableio
+
+def makeTable(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return({
+        'index': np.arange(1, rows + 1, dtype=np.int64),
+        'n': rng.integers(0, 5000, rows).astype(np.int64),
+        'm': rng.integers(0, 2000, rows).astype(np.int64),
+        'Gsigma': rng.random(rows) * 50,
+        'Gbp': rng.random(rows) - 0.5,
+        'a': np.full(rows, 10.0),
+        'G': rng.random(rows) * 60,
+        'bf': rng.random(rows) * 1e-30,
+        'probability': rng.random(rows) * 1e-8,
+    })
+
+@pytest.mark.parametrize('fmt', list(tableio.OUTPUT_FORMATS))
+def test_round_trip(tmp_path, fmt):
+    if fmt in ('parquet', 'feather'):
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path / tableio.outputFile("rlooper_output", fmt))
+    first, second = makeTable(100, seed=1), makeTable(50, seed=2)
+    with tableio.TableWriter(path, fmt) as output:
+        output.write(first, "gene1")
+        output.write(second, "gene2")
+    table = tableio.readTable(path)
+    assert list(table.columns) == ['chr'] + list(first)
+    assert list(table['chr'].astype(str)) == ["gene1"] * 100 + ["gene2"] * 50
+    for name in ('index', 'n', 'm'):
+        np.testing.assert_array_equal(table[name], np.concatenate([first[name], second[name]]))
+    # Binary formats store energies as float32 and the probability as float64; pandas' text parser may round the last bit
+    np.testing.assert_allclose(table['G'], np.concatenate([first['G'], second['G']]), rtol=1e-15 if fmt == 'tsv' else 1e-6)
+    np.testing.assert_allclose(table['probability'], np.concatenate([first['probability'], second['probability']]), rtol=1e-15 if fmt == 'tsv' else 0)
+    assert tableio.countRows(path) == 150
+    assert tableio.readColumns(path) == ['chr'] + list(first)
+
+def test_tsv_matches_pandas(tmp_path):
+    pd = pytest.importorskip('pandas')
+    table = makeTable(1000)
+    path = str(tmp_path / "rlooper_output.csv")
+    with tableio.TableWriter(path) as output:
+        output.write(table, "gene1")
+    frame = pd.DataFrame(table)
+    frame.insert(0, 'chr', "gene1")
+    with open(path) as f:
+        assert f.read() == frame.to_csv(sep="\t", index=False)
+
+def test_header_written_once_after_empty_record(tmp_path):
+    path = str(tmp_path / "rlooper_output.csv")
+    with tableio.TableWriter(path) as output:
+        output.write(makeTable(0), "empty")
+        output.write(makeTable(3), "gene1")
+        output.write(makeTable(0), "empty2")
+        output.write(makeTable(2), "gene2")
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 6
+    assert lines[0].startswith("chr\t")
+    assert sum(line.startswith("chr\t") for line in lines) == 1
+
+def test_appended_tsv_has_no_second_header(tmp_path):
+    path = str(tmp_path / "rlooper_output.csv")
+    with tableio.TableWriter(path) as output:
+        output.write(makeTable(3), "gene1")
+    with tableio.TableWriter(path, append=True) as output:
+        output.write(makeTable(2), "gene2")
+    assert tableio.countRows(path) == 5
+    assert list(tableio.readTable(path)['chr']) == ["gene1"] * 3 + ["gene2"] * 2
+
+def test_binary_formats_cannot_be_appended(tmp_path):
+    with pytest.raises(ValueError):
+        tableio.TableWriter(str(tmp_path / "rlooper_output.npz"), "npz", append=True)